@@ -1,4 +1,5 @@
 import asyncio
+import logging
 from functools import reduce
 from typing import List, Any, Tuple, Optional, Union
 
@@ -8,9 +9,13 @@ from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
 from langchain.schema import Document
 
 from allms.domain.enumerables import AggregationLogicForLongInputData, LanguageModelTask
-from allms.domain.input_data import InputData
 from allms.domain.prompt_dto import (AggregateOutputClass, KeywordsOutputClass, SummaryOutputClass)
-from allms.utils.long_text_processing_utils import split_text_to_max_size
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter
+from allms.utils.long_text_processing_utils import get_max_allowed_number_of_tokens, split_text_to_max_size
+from allms.utils.prompt_packing_utils import pack_examples
+from allms.utils.token_counting_utils import TokenCounter
+
+logger = logging.getLogger(__name__)
 
 
 class LongTextProcessingChain(BaseCombineDocumentsChain):
@@ -21,12 +26,18 @@ class LongTextProcessingChain(BaseCombineDocumentsChain):
     reduce_llm_chain: LLMChain
     input_data_variable_name: str
     aggregation_strategy: AggregationLogicForLongInputData
+    # Shared with the model, so the requests for the chunks compete for the same slots as the other requests
+    concurrency_limiter: Optional[Union[asyncio.Semaphore, AdaptiveConcurrencyLimiter]] = None
 
     @property
     def _chain_type(self) -> str:
         return "long_description_chain"
 
     async def combine_docs(self, input_data: Document, **kwargs: Any) -> Tuple[str, dict]:
+        """
+        Returns the response for the whole text and the statistics of its reduction, which are added to the outputs of
+        the chain next to the response, e.g. when it's called with `ainvoke`. `arun` returns only the response.
+        """
         chunked_input: List[Document] = split_text_to_max_size(
             llm=self.map_llm_chain.llm,
             prompt_template=self.map_llm_chain.prompt,
@@ -36,25 +47,24 @@ class LongTextProcessingChain(BaseCombineDocumentsChain):
         )
 
         chunk_responses = await self._map_step(chunked_input)
-        aggregated_response = self._reduce_step(chunk_responses)
-
-        return aggregated_response, {}
+        return await self._reduce_step(chunk_responses)
 
     async def acombine_docs(self, input_data: List[Document], **kwargs: Any) -> Tuple[str, dict]:
         return await self.combine_docs(input_data)
 
     async def _map_step(self, chunked_document: List[Document]) -> List[str]:
-        results = list(map(lambda document: self.map_llm_chain.arun(document), chunked_document))
-        return await asyncio.gather(*results)
+        return await asyncio.gather(*[
+            self._run_llm_chain(self.map_llm_chain, document.page_content) for document in chunked_document
+        ])
 
-    def _reduce_step(self, chunk_responses: List[InputData]) -> str:
+    async def _reduce_step(self, chunk_responses: List[str]) -> Tuple[str, dict]:
         if self.aggregation_strategy == AggregationLogicForLongInputData.REDUCE_BY_LLM_PROMPTING:
-            return self._construct_input_from_list_and_run_reduce_chain(chunk_responses)
+            return await self._construct_input_from_list_and_run_reduce_chain(chunk_responses)
         elif self.aggregation_strategy == AggregationLogicForLongInputData.SIMPLE_CONCATENATION:
             if self.task == LanguageModelTask.SUMMARY:
-                return self._aggregate_results_for_summary(chunk_responses).json()
+                return self._aggregate_results_for_summary(chunk_responses).json(), {}
             elif self.task == LanguageModelTask.KEYWORDS:
-                return self._aggregate_results_for_keywords(chunk_responses).json()
+                return self._aggregate_results_for_keywords(chunk_responses).json(), {}
 
     def _deserialize_response(self, response: str) -> Union[SummaryOutputClass, KeywordsOutputClass]:
         if self.task == LanguageModelTask.SUMMARY:
@@ -62,14 +72,59 @@ class LongTextProcessingChain(BaseCombineDocumentsChain):
         elif self.task == LanguageModelTask.KEYWORDS:
             return KeywordsOutputClass.parse_raw(response)
 
-    def _construct_input_from_list_and_run_reduce_chain(self, response_list: List[InputData]) -> str:
-        aggregate_input = Document(
-            page_content=AggregateOutputClass(summaries=[
-                self._deserialize_response(response) for response in response_list]
-            ).json()
+    async def _construct_input_from_list_and_run_reduce_chain(self, response_list: List[str]) -> Tuple[str, dict]:
+        """
+        Reduces the responses for the chunks level by level, until a single response remains. On every level, the
+        responses are split into as few consecutive groups as fit the reduce prompt, and the groups are reduced in
+        parallel. The depth of the tree and the fan-out (the number of reduced responses) of every level are returned.
+        """
+        reduce_fan_outs: List[int] = []
+        while True:
+            response_groups = self._group_responses_for_reduce(response_list)
+            response_list = await asyncio.gather(*[
+                self._run_llm_chain(
+                    self.reduce_llm_chain,
+                    AggregateOutputClass(summaries=[self._deserialize_response(response) for response in group]).json()
+                )
+                for group in response_groups
+            ])
+            reduce_fan_outs.append(max(map(len, response_groups)))
+            if len(response_list) == 1:
+                break
+
+        logger.info(f"Responses for the chunks were reduced in {len(reduce_fan_outs)} levels with fan-outs {reduce_fan_outs}")
+        return response_list[0], {"reduce_depth": len(reduce_fan_outs), "reduce_fan_outs": reduce_fan_outs}
+
+    def _group_responses_for_reduce(self, response_list: List[str]) -> List[List[str]]:
+        token_counter = TokenCounter(count_tokens=self.reduce_llm_chain.llm.get_num_tokens)
+        number_of_prompt_tokens = token_counter.count(
+            self.reduce_llm_chain.prompt.format(text=AggregateOutputClass(summaries=[]).json())
         )
-
-        return self.reduce_llm_chain.run(aggregate_input.text)
+        max_number_of_tokens = get_max_allowed_number_of_tokens(
+            self.model_total_max_tokens, self.max_output_tokens
+        ) - number_of_prompt_tokens
+        # One token more for the separator between the responses
+        responses_tokens = [
+            number_of_tokens + 1 for number_of_tokens in token_counter.count_batch(
+                [self._deserialize_response(response).json() for response in response_list]
+            )
+        ]
+
+        groups = pack_examples(responses_tokens, max_number_of_tokens, max_examples_per_request=len(response_list))
+        if len(groups) == len(response_list) > 1:
+            # Without merging at least two responses, the tree would never end
+            logger.warning(
+                "Each of the responses takes more than half of the reduce prompt, so they're reduced in pairs and the "
+                "reduce prompts may exceed the max allowed number of tokens"
+            )
+            groups = [[index, index + 1][:len(response_list) - index] for index in range(0, len(response_list), 2)]
+        return [[response_list[index] for index in group] for group in groups]
+
+    async def _run_llm_chain(self, llm_chain: LLMChain, text: str) -> str:
+        if self.concurrency_limiter is None:
+            return await llm_chain.arun(text)
+        async with self.concurrency_limiter:
+            return await llm_chain.arun(text)
 
     @staticmethod
     def _aggregate_results_for_summary(chunk_responses: List[Document]) -> SummaryOutputClass:
@@ -95,6 +150,7 @@ def load_long_text_processing_chain(
         reduce_prompt: BasePromptTemplate,
         aggregation_strategy: AggregationLogicForLongInputData,
         input_data_variable_name: str = "text",
+        concurrency_limiter: Optional[Union[asyncio.Semaphore, AdaptiveConcurrencyLimiter]] = None,
         verbose: Optional[bool] = None
 ) -> LongTextProcessingChain:
     map_chain = LLMChain(llm=llm, prompt=map_prompt, verbose=verbose)
@@ -107,6 +163,8 @@ def load_long_text_processing_chain(
         map_llm_chain=map_chain,
         reduce_llm_chain=reduce_chain,
         input_data_variable_name=input_data_variable_name,
+        input_key=input_data_variable_name,
         aggregation_strategy=aggregation_strategy,
+        concurrency_limiter=concurrency_limiter,
         verbose=verbose
     )
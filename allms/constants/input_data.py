@@ -9,6 +9,7 @@ class IODataConstants:
     GENERATED_TOKENS_NUMBER = "number_of_generated_tokens"
 
     RESPONSE_STR_NAME = "response"
+    ERROR_STR_NAME = "error"
 
     ERROR_MESSAGE_STR = "Response error"
     VALUE_ERROR_MESSAGE = "Value Error has occurred"
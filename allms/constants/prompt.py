@@ -5,3 +5,4 @@ class PromptConstants:
     PARTIAL_VARIABLES_STR = "partial_variables"
     TEXT_STR = "text"
     OUTPUT_DATA_MODEL_CLASS_SEPARATOR = "\n\n"
+    PACKED_EXAMPLES = "packed_examples"
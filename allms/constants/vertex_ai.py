@@ -1,7 +1,10 @@
 class VertexModelConstants:
     RESPONSE_SEPARATOR = "<LLM_RESPONSE_SEPARATOR>"
     RESPONSE_BLOCKED_STR = "<RESPONSE_BLOCKED>"
+    EMPTY_RESPONSE_ERROR_MESSAGE = "The response is empty. It may have been blocked due to content filtering."
 
     GCP_PROJECT_ID_STR_NAME = "GCP_PROJECT_ID"
     GCP_LLM_REGION_STR_NAME = "GCP_LLM_REGION"
     GCP_MODEL_NAME_STR_NAME = "GCP_MODEL_NAME"
+
+    CACHED_SYSTEM_PROMPT_KWARG = "cached_system_prompt"
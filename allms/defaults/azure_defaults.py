@@ -27,3 +27,25 @@ class AzureMistralAIDefaults:
     MAX_OUTPUT_TOKENS: int = 1024
     TEMPERATURE = 0.0
     TOP_P = 1.0
+
+
+@dataclass
+class AzureSelfDeployedDefaults:
+    MAX_CONNECTIONS: int = 1000
+    MAX_KEEPALIVE_CONNECTIONS: int = 100
+    KEEPALIVE_EXPIRY_S: float = 30.0
+
+
+@dataclass
+class AzureOpenAIMultiDeploymentDefaults:
+    DEPLOYMENT_WEIGHT: float = 1.0
+    # Time for which a deployment is taken out of rotation after a 429 or 5xx response without a Retry-After header
+    DEPLOYMENT_COOLDOWN_S: float = 30.0
+
+
+@dataclass
+class AzureOpenAIBatchDefaults:
+    ENDPOINT: str = "/chat/completions"
+    COMPLETION_WINDOW: str = "24h"
+    POLL_INTERVAL_S: float = 60.0
+    TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
@@ -5,3 +5,8 @@ from dataclasses import dataclass
 class GeneralDefaults:
     MAX_RETRIES = 8
     MAX_CONCURRENCY = 1000
+    MAX_REST_TRANSPORT_WORKERS = 64
+    COMPILED_PROMPTS_CACHE_SIZE = 128
+    MAX_EXAMPLES_PER_PACKED_REQUEST = 20
+    ADAPTIVE_CONCURRENCY_INITIAL_LIMIT = 16
+    ADAPTIVE_CONCURRENCY_PAUSE_S = 10.0
@@ -0,0 +1,5 @@
+class IODefaults:
+    CHUNK_SIZE = 1000
+    ENCODING = "utf-8"
+    SINK_BUFFER_SIZE = 1000
+    SINK_FLUSH_INTERVAL_S = 10.0
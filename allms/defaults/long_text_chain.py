@@ -1,5 +1,6 @@
 class LongTextChainDefaults:
-    OVERLAP_SIZE = 50
+    OVERLAP_SIZE = 50  # in tokens
+    MAX_TRUNCATION_TOKENIZER_CALLS = 24
     AGGREGATOR_DEFAULT_STR_SEPARATOR = ", "
 
     # TODO Refactor along with adding support for LongDocument processing
@@ -0,0 +1,5 @@
+class ResponseCacheDefaults:
+    TTL_S = 7 * 24 * 60 * 60
+    MAX_SIZE_BYTES = 1024 ** 3
+    COMPRESSION_LEVEL = 6
+    EVICTION_BATCH_SIZE = 1000
@@ -0,0 +1,3 @@
+class TokenCountingDefaults:
+    CACHE_SIZE = 100_000
+    BATCH_SIZE = 1000
@@ -27,3 +27,15 @@ class GemmaModelDefaults:
     TOP_P = 0.95
     TOP_K = 40
     VERBOSE = True
+
+
+class GeminiBatchPredictionDefaults:
+    POLL_INTERVAL_S = 60.0
+    INPUT_FILE_NAME = "input.jsonl"
+    OUTPUT_DIRECTORY_NAME = "output"
+    PREDICTIONS_FILE_PATTERN = "predictions*.jsonl"
+
+
+class GeminiContextCacheDefaults:
+    TTL_S = 3600.0
+    RENEWAL_MARGIN_S = 600.0
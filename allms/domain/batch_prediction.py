@@ -0,0 +1,10 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class BatchPredictionJobStatus(BaseModel):
+    has_ended: bool
+    has_succeeded: bool = False
+    output_uri: Optional[str] = None
+    error_message: Optional[str] = None
@@ -4,6 +4,7 @@ from typing import Dict, Optional, Sequence
 import google.oauth2.credentials
 from langchain_google_vertexai import HarmBlockThreshold, HarmCategory
 
+from allms.defaults.azure_defaults import AzureSelfDeployedDefaults
 from allms.defaults.vertex_ai import GeminiModelDefaults, PalmModelDefaults
 
 
@@ -22,6 +23,8 @@ class AzureSelfDeployedConfiguration:
     api_key: str
     deployment: str
     endpoint_url: str
+    max_connections: int = AzureSelfDeployedDefaults.MAX_CONNECTIONS
+    max_keepalive_connections: int = AzureSelfDeployedDefaults.MAX_KEEPALIVE_CONNECTIONS
 
 
 @dataclass
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+
+class ContextCacheStats(BaseModel):
+    number_of_requests: int = 0
+    number_of_prompt_tokens: int = 0
+    number_of_cached_tokens: int = 0
+
+    @property
+    def cached_tokens_ratio(self) -> float:
+        """Fraction of the prompt tokens that were read from a context cache, as reported by the model."""
+        if self.number_of_prompt_tokens == 0:
+            return 0.0
+        return self.number_of_cached_tokens / self.number_of_prompt_tokens
@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class DeduplicationStats(BaseModel):
+    number_of_examples: int = 0
+    number_of_unique_prompts: int = 0
+
+    @property
+    def deduplication_ratio(self) -> float:
+        """Fraction of the examples whose request was coalesced with another example with the same rendered prompt."""
+        if self.number_of_examples == 0:
+            return 0.0
+        return 1 - self.number_of_unique_prompts / self.number_of_examples
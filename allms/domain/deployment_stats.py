@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+
+class DeploymentStats(BaseModel):
+    deployment: str
+    weight: float
+    number_of_requests: int = 0
+    number_of_successful_requests: int = 0
+    number_of_rate_limit_errors: int = 0
+    number_of_server_errors: int = 0
+    number_of_in_flight_requests: int = 0
+    is_healthy: bool = True
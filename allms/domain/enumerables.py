@@ -15,6 +15,7 @@ class AggregationLogicForLongInputData(str, ListConvertableEnum):
 
 class AvailableModels(str, ListConvertableEnum):
     AZURE_OPENAI_MODEL = "azure_openai"
+    AZURE_OPENAI_MULTI_DEPLOYMENT_MODEL = "azure_openai_multi_deployment"
     AZURE_LLAMA2_MODEL = "azure_llama2"
     AZURE_MISTRAL_MODEL = "azure_mistral"
     VERTEXAI_PALM2_MODEL = "vertexai_palm2"
@@ -6,12 +6,14 @@ from allms.models.abstract import AbstractModel
 from allms.models.azure_llama2 import AzureLlama2Model
 from allms.models.azure_mistral import AzureMistralModel
 from allms.models.azure_openai import AzureOpenAIModel
+from allms.models.azure_openai_multi_deployment import AzureOpenAIMultiDeploymentModel
 from allms.models.vertexai_gemini import VertexAIGeminiModel
 from allms.models.vertexai_palm import VertexAIPalmModel
 from allms.models.vertexai_gemma import VertexAIGemmaModel
 
 __all__ = [
     "AzureOpenAIModel",
+    "AzureOpenAIMultiDeploymentModel",
     "AzureLlama2Model",
     "AzureMistralModel",
     "VertexAIPalmModel",
@@ -26,6 +28,7 @@ __all__ = [
 def get_available_models() -> Dict[str, Type[AbstractModel]]:
     return {
         AvailableModels.AZURE_OPENAI_MODEL: AzureOpenAIModel,
+        AvailableModels.AZURE_OPENAI_MULTI_DEPLOYMENT_MODEL: AzureOpenAIMultiDeploymentModel,
         AvailableModels.AZURE_LLAMA2_MODEL: AzureLlama2Model,
         AvailableModels.AZURE_MISTRAL_MODEL: AzureMistralModel,
         AvailableModels.VERTEXAI_PALM2_MODEL: VertexAIPalmModel,
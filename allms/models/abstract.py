@@ -1,10 +1,14 @@
 import asyncio
+import itertools
 import logging
 import re
 import typing
 import urllib
 from abc import ABC, abstractmethod
-from functools import partial
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from pathlib import Path
 from urllib.error import URLError
 
 import google
@@ -29,16 +33,39 @@ from allms.constants.input_data import IODataConstants
 from allms.constants.prompt import PromptConstants
 from allms.defaults.general_defaults import GeneralDefaults
 from allms.defaults.long_text_chain import LongTextChainDefaults
+from allms.defaults.token_counting import TokenCountingDefaults
+from allms.domain.deduplication_stats import DeduplicationStats
 from allms.domain.enumerables import AggregationLogicForLongInputData, LanguageModelTask
 from allms.domain.input_data import InputData
 from allms.domain.prompt_dto import SummaryOutputClass, KeywordsOutputClass
 from allms.domain.response import ResponseData
 from allms.models.vertexai_base import GCPInvalidRequestError
+from allms.utils.async_utils import map_as_completed
+from allms.utils.checkpoint_utils import CheckpointJournal
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter, TokenRateLimiter
+from allms.utils.deduplication_utils import PromptDeduplicator
 from allms.utils.long_text_processing_utils import get_max_allowed_number_of_tokens
+from allms.utils.prompt_packing_utils import (
+    build_packed_prompt,
+    get_packed_output_data_model_class,
+    pack_examples,
+    render_packed_example
+)
+from allms.utils.response_cache_utils import ResponseCache
 from allms.utils.response_parsing_utils import ResponseParser
+from allms.utils.token_counting_utils import PromptTokenCounter, TokenCounter
 
 logger = logging.getLogger(__name__)
 
+_INPUT_VARIABLES_PATTERN = re.compile(r"(?<!\{)\{([^{}]+)\}(?!\})")
+
+
+class _CompiledPrompt(typing.NamedTuple):
+    prompt_template: ChatPromptTemplate
+    parser: typing.Optional[PydanticOutputParser]
+    predict_example_any_length_partial: typing.Callable[..., typing.Awaitable[ResponseData]]
+    prompt_tokens_counter: PromptTokenCounter
+
 
 class AbstractModel(ABC):
     def __init__(
@@ -48,25 +75,43 @@ class AbstractModel(ABC):
             model_total_max_tokens: int,
             event_loop: typing.Optional[asyncio.AbstractEventLoop] = None,
             max_concurrency: int = GeneralDefaults.MAX_CONCURRENCY,
-            max_retries: int = GeneralDefaults.MAX_RETRIES
+            max_retries: int = GeneralDefaults.MAX_RETRIES,
+            response_cache: typing.Optional[ResponseCache] = None,
+            concurrency_limiter: typing.Optional[AdaptiveConcurrencyLimiter] = None,
+            rate_limiter: typing.Optional[TokenRateLimiter] = None,
+            response_parsing_executor: typing.Optional[Executor] = None,
+            deduplicate_prompts: bool = False
     ):
         self._model_total_max_tokens = model_total_max_tokens
         self._max_output_tokens = max_output_tokens
         self._temperature = temperature
-        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._max_concurrency = max_concurrency
+        self._concurrency_limiter = concurrency_limiter or asyncio.Semaphore(max_concurrency)
+        self._response_cache = response_cache
+        self._rate_limiter = rate_limiter
+        self._response_parsing_executor = response_parsing_executor
+        self._deduplicate_prompts = deduplicate_prompts
+        self._deduplication_stats: typing.Optional[DeduplicationStats] = None
+        self._rest_transport_executor: typing.Optional[ThreadPoolExecutor] = None
 
         # TODO: To be changed after implementing support for long sequences
         self._task = LanguageModelTask.KEYWORDS
         self._is_long_text_bypass_enabled: bool = False  # Should be false till we fully implement support for long sequences in our package
         self._aggregation_strategy: AggregationLogicForLongInputData = AggregationLogicForLongInputData.SIMPLE_CONCATENATION
         self._parser: typing.Optional[PydanticOutputParser] = None
+        # Prompt templates, parsers and chains reused by the calls with the same prompt, keyed by
+        # (prompt, system_prompt, output_data_model_class, input_keys)
+        self._compiled_prompts: typing.OrderedDict[typing.Tuple, _CompiledPrompt] = OrderedDict()
         self._json_pattern = re.compile(r"{.*?}", re.DOTALL)
         self._is_json_format_injected_into_prompt: bool = True
+        # Prompt tokens can be counted by segments only for the regex-based BPE tokenizers, see PromptTokenCounter
+        self._is_prompt_token_counting_by_segments_enabled: bool = False
 
         if max_output_tokens >= model_total_max_tokens:
             raise ValueError("max_output_tokens has to be lower than model_total_max_tokens")
 
         self._llm = self._create_llm()
+        self._token_counter = TokenCounter(count_tokens=self._count_tokens, count_tokens_batch=self._count_tokens_batch)
 
         if not event_loop:
             try:
@@ -89,14 +134,47 @@ class AbstractModel(ABC):
     def _create_llm(self) -> BaseChatModel:
         ...
 
-    def _get_prompt_tokens_number(self, prompt: ChatPromptTemplate, input_data: InputData) -> int:
-        return self._llm.get_num_tokens(prompt.format_prompt(**input_data.input_mappings).to_string())
+    def _count_tokens(self, text: str) -> int:
+        return self._llm.get_num_tokens(text)
+
+    def _count_tokens_batch(self, texts: typing.List[str]) -> typing.List[int]:
+        return list(map(self._count_tokens, texts))
 
     def _get_model_response_tokens_number(self, model_response: typing.Optional[str]) -> int:
         if model_response:
             return self._llm.get_num_tokens(model_response)
         return 0
 
+    def _get_model_parameters(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "temperature": self._temperature,
+            "max_output_tokens": self._max_output_tokens
+        }
+
+    def _get_response_cache_key(self, prompt: ChatPromptTemplate, input_data: InputData) -> str:
+        return ResponseCache.build_key(
+            provider=type(self).__name__,
+            model_parameters=self._get_model_parameters(),
+            prompt=prompt.format_prompt(**input_data.input_mappings).to_string()
+        )
+
+    def get_deduplication_stats(self) -> typing.Optional[DeduplicationStats]:
+        """Returns the statistics of the prompt deduplication in the last generation, if it's enabled."""
+        return self._deduplication_stats
+
+    def close(self) -> None:
+        """
+        Releases the connection pools and the REST transport threads kept between the generations. They're created
+        again if the model is used afterwards.
+        """
+        self._event_loop.run_until_complete(self._aclose())
+        if self._rest_transport_executor is not None:
+            self._rest_transport_executor.shutdown()
+            self._rest_transport_executor = None
+
+    async def _aclose(self) -> None:
+        pass
+
     def generate(
             self,
             prompt: str,
@@ -104,7 +182,7 @@ class AbstractModel(ABC):
             output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
             system_prompt: typing.Optional[str] = None
     ) -> typing.List[ResponseData]:
-        model_responses = self._event_loop.run_until_complete(
+        return self._event_loop.run_until_complete(
             self._generate(
                 prompt=prompt,
                 input_data=input_data,
@@ -113,9 +191,144 @@ class AbstractModel(ABC):
             )
         )
 
-        if output_data_model_class:
-            return ResponseParser(self._parser).parse_model_output(model_responses)
-        return model_responses
+    def generate_packed(
+            self,
+            prompt: str,
+            input_data: typing.List[InputData],
+            output_data_model_class: typing.Type[BaseModel],
+            system_prompt: typing.Optional[str] = None,
+            max_examples_per_request: int = GeneralDefaults.MAX_EXAMPLES_PER_PACKED_REQUEST
+    ) -> typing.List[ResponseData]:
+        """
+        Packs up to `max_examples_per_request` examples into each request, so the prompt, the system prompt and the
+        format instructions are sent once per request instead of once per example. The model is asked for a keyed list
+        of outputs, which is split back into a `ResponseData` per example, with the token counts of the request
+        apportioned between its examples. Examples whose packed output is missing or can't be parsed are sent again
+        one by one.
+        """
+        return self._event_loop.run_until_complete(
+            self._generate_packed(
+                prompt=prompt,
+                input_data=input_data,
+                output_data_model_class=output_data_model_class,
+                system_prompt=system_prompt,
+                max_examples_per_request=max_examples_per_request
+            )
+        )
+
+    def generate_stream(
+            self,
+            prompt: str,
+            input_data: typing.Optional[typing.List[InputData]] = None,
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
+            system_prompt: typing.Optional[str] = None
+    ) -> typing.Iterator[ResponseData]:
+        yield from self._iterate_in_event_loop(
+            self.agenerate_stream(
+                prompt=prompt,
+                input_data=input_data,
+                output_data_model_class=output_data_model_class,
+                system_prompt=system_prompt
+            )
+        )
+
+    def generate_with_checkpoint(
+            self,
+            prompt: str,
+            input_data: typing.List[InputData],
+            checkpoint_path: typing.Union[str, Path],
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
+            system_prompt: typing.Optional[str] = None
+    ) -> typing.List[ResponseData]:
+        if len({example.id for example in input_data}) != len(input_data):
+            raise ValueError("Ids of the input data have to be unique to resume the generation from a checkpoint")
+
+        with CheckpointJournal(checkpoint_path) as checkpoint_journal:
+            pending_input_data = [
+                example for example in input_data if not checkpoint_journal.is_completed(example.id)
+            ]
+            logger.info(
+                f"{len(input_data) - len(pending_input_data)} examples were already completed, "
+                f"generating responses for {len(pending_input_data)} examples"
+            )
+            if pending_input_data:
+                for example_index, response_data in self._iterate_in_event_loop(
+                        self._agenerate_stream_with_indexes(
+                            prompt=prompt,
+                            input_data=pending_input_data,
+                            output_data_model_class=output_data_model_class,
+                            system_prompt=system_prompt
+                        )
+                ):
+                    checkpoint_journal.append(pending_input_data[example_index].id, response_data)
+
+            input_data_ids = {example.id for example in input_data}
+            responses_by_id: typing.Dict[str, ResponseData] = {}
+            for example_id, response_data in checkpoint_journal.read_responses(output_data_model_class):
+                if example_id not in input_data_ids:
+                    continue
+                # A successful response is never replaced, and a failed one is replaced by the result of its retry
+                if example_id not in responses_by_id or responses_by_id[example_id].error is not None:
+                    responses_by_id[example_id] = response_data
+
+        return [responses_by_id[example.id] for example in input_data]
+
+    async def agenerate_stream(
+            self,
+            prompt: str,
+            input_data: typing.Optional[typing.List[InputData]] = None,
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
+            system_prompt: typing.Optional[str] = None
+    ) -> typing.AsyncIterator[ResponseData]:
+        responses_stream = self._agenerate_stream_with_indexes(
+            prompt=prompt,
+            input_data=input_data,
+            output_data_model_class=output_data_model_class,
+            system_prompt=system_prompt
+        )
+        try:
+            async for _, model_response in responses_stream:
+                yield model_response
+        finally:
+            # Closed explicitly, so the requests in flight are cancelled as soon as the consumer stops iterating
+            await responses_stream.aclose()
+
+    async def _agenerate_stream_with_indexes(
+            self,
+            prompt: str,
+            input_data: typing.Optional[typing.List[InputData]] = None,
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
+            system_prompt: typing.Optional[str] = None
+    ) -> typing.AsyncIterator[typing.Tuple[int, ResponseData]]:
+        # The input data is validated lazily, batch by batch, so the first requests are sent right away
+        predict_example_any_length_partial, prompt_tokens_counter = self._prepare_generation(
+            prompt=prompt,
+            input_data=input_data,
+            output_data_model_class=output_data_model_class,
+            system_prompt=system_prompt,
+            validate_input_data=False
+        )
+        response_parser = ResponseParser(self._parser) if output_data_model_class else None
+
+        async for example_index, model_response in self._predict_examples_as_completed(
+                predict_example_any_length_partial,
+                prompt_tokens_counter,
+                input_data,
+                prompt_input_variables=self._get_prompt_input_variables(prompt)
+        ):
+            if response_parser:
+                model_response = await self._parse_response_data(response_parser, model_response)
+            yield example_index, model_response
+
+    def _iterate_in_event_loop(self, async_iterator: typing.AsyncIterator[typing.Any]) -> typing.Iterator[typing.Any]:
+        try:
+            while True:
+                try:
+                    yield self._event_loop.run_until_complete(async_iterator.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            self._event_loop.run_until_complete(async_iterator.aclose())
 
     async def _generate(
             self,
@@ -124,51 +337,282 @@ class AbstractModel(ABC):
             output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
             system_prompt: typing.Optional[str] = None
     ) -> typing.List[ResponseData]:
+        predict_example_any_length_partial, prompt_tokens_counter = self._prepare_generation(
+            prompt=prompt,
+            input_data=input_data,
+            output_data_model_class=output_data_model_class,
+            system_prompt=system_prompt
+        )
+        response_parser = ResponseParser(self._parser) if output_data_model_class else None
+
+        responses: typing.List[typing.Optional[ResponseData]] = [None] * (len(input_data) if input_data is not None else 1)
+        parsing_tasks: typing.Dict[int, asyncio.Future] = {}
+        async for example_index, model_response in self._predict_examples_as_completed(
+                predict_example_any_length_partial,
+                prompt_tokens_counter,
+                input_data
+        ):
+            if response_parser:
+                # Every response is parsed as soon as it arrives, while the other requests are still in flight
+                parsing_tasks[example_index] = asyncio.ensure_future(
+                    self._parse_response_data(response_parser, model_response)
+                )
+            else:
+                responses[example_index] = model_response
+
+        for example_index, parsed_response in zip(parsing_tasks.keys(), await asyncio.gather(*parsing_tasks.values())):
+            responses[example_index] = parsed_response
+        return responses
+
+    async def _generate_packed(
+            self,
+            prompt: str,
+            input_data: typing.List[InputData],
+            output_data_model_class: typing.Type[BaseModel],
+            system_prompt: typing.Optional[str],
+            max_examples_per_request: int
+    ) -> typing.List[ResponseData]:
+        compiled_prompt = self._get_compiled_prompt(
+            prompt=prompt,
+            input_data=input_data,
+            output_data_model_class=output_data_model_class,
+            system_prompt=system_prompt
+        )
+        if not input_data:
+            return []
+        empty_pack = InputData(input_mappings={PromptConstants.PACKED_EXAMPLES: ""}, id=IODataConstants.DEFAULT_ID)
+        packed_output_data_model_class = get_packed_output_data_model_class(output_data_model_class)
+        packed_compiled_prompt = self._get_compiled_prompt(
+            prompt=build_packed_prompt(
+                prompt,
+                input_data[0].get_input_keys(),
+                # Otherwise, the model would only know the format of a single output from the instructions in the prompt
+                format_instructions=None if self._is_json_format_injected_into_prompt else PydanticOutputParser(
+                    pydantic_object=packed_output_data_model_class
+                ).get_format_instructions()
+            ),
+            input_data=[empty_pack],
+            output_data_model_class=packed_output_data_model_class,
+            system_prompt=system_prompt
+        )
+
+        rendered_examples = [
+            render_packed_example(str(example_index), example) for example_index, example in enumerate(input_data)
+        ]
+        examples_tokens_numbers = self._token_counter.count_batch(rendered_examples)
+        packs = pack_examples(
+            numbers_of_tokens=examples_tokens_numbers,
+            max_number_of_tokens=(
+                get_max_allowed_number_of_tokens(self._model_total_max_tokens, self._max_output_tokens)
+                - packed_compiled_prompt.prompt_tokens_counter.count_batch([empty_pack])[0]
+            ),
+            max_examples_per_request=max_examples_per_request
+        )
+        logger.info(f"Packed {len(input_data)} examples into {len(packs)} requests")
+
+        responses: typing.List[typing.Optional[ResponseData]] = [None] * len(input_data)
+        packed_response_parser = ResponseParser(packed_compiled_prompt.parser)
+        async for pack_index, packed_response in self._predict_examples_as_completed(
+                packed_compiled_prompt.predict_example_any_length_partial,
+                packed_compiled_prompt.prompt_tokens_counter,
+                [
+                    InputData(
+                        input_mappings={
+                            PromptConstants.PACKED_EXAMPLES: "\n".join(map(rendered_examples.__getitem__, pack))
+                        },
+                        id=str(pack_index)
+                    )
+                    for pack_index, pack in enumerate(packs)
+                ]
+        ):
+            packed_response = packed_response_parser.parse_response_data(packed_response)
+            if packed_response.response is None:
+                continue
+            outputs_by_key = {
+                packed_output.key: packed_output.output for packed_output in packed_response.response.outputs
+            }
+            pack = packs[pack_index]
+            pack_tokens_number = sum(examples_tokens_numbers[example_index] for example_index in pack)
+            for example_index in pack:
+                output = outputs_by_key.get(str(example_index))
+                if output is not None:
+                    responses[example_index] = ResponseData(
+                        input_data=input_data[example_index],
+                        response=output,
+                        number_of_prompt_tokens=round(
+                            packed_response.number_of_prompt_tokens
+                            * examples_tokens_numbers[example_index] / pack_tokens_number
+                        ),
+                        number_of_generated_tokens=round(packed_response.number_of_generated_tokens / len(pack))
+                    )
+
+        unpacked_example_indices = [
+            example_index for example_index, response in enumerate(responses) if response is None
+        ]
+        if unpacked_example_indices:
+            logger.info(f"Sending {len(unpacked_example_indices)} examples without a valid packed output one by one")
+            response_parser = ResponseParser(compiled_prompt.parser)
+            async for index, model_response in self._predict_examples_as_completed(
+                    compiled_prompt.predict_example_any_length_partial,
+                    compiled_prompt.prompt_tokens_counter,
+                    [input_data[example_index] for example_index in unpacked_example_indices]
+            ):
+                responses[unpacked_example_indices[index]] = response_parser.parse_response_data(model_response)
+
+        return responses
+
+    async def _parse_response_data(self, response_parser: ResponseParser, model_response: ResponseData) -> ResponseData:
+        if self._response_parsing_executor is None:
+            return response_parser.parse_response_data(model_response)
+        return await asyncio.get_running_loop().run_in_executor(
+            self._response_parsing_executor, response_parser.parse_response_data, model_response
+        )
+
+    def _prepare_generation(
+            self,
+            prompt: str,
+            input_data: typing.Optional[typing.List[InputData]] = None,
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
+            system_prompt: typing.Optional[str] = None,
+            validate_input_data: bool = True
+    ) -> typing.Tuple[typing.Callable[..., typing.Awaitable[ResponseData]], PromptTokenCounter]:
+        compiled_prompt = self._get_compiled_prompt(
+            prompt=prompt,
+            input_data=input_data,
+            output_data_model_class=output_data_model_class,
+            system_prompt=system_prompt,
+            validate_input_data=validate_input_data
+        )
+        return compiled_prompt.predict_example_any_length_partial, compiled_prompt.prompt_tokens_counter
+
+    def _get_compiled_prompt(
+            self,
+            prompt: str,
+            input_data: typing.Optional[typing.List[InputData]] = None,
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None,
+            system_prompt: typing.Optional[str] = None,
+            validate_input_data: bool = True
+    ) -> _CompiledPrompt:
         self._validate_system_prompt(system_prompt=system_prompt)
-        self._validate_input(prompt=prompt, input_data=input_data)
-        if input_data is None:
-            # Prompt without symbolic variables is passed - create input_data accordingly
-            input_data = [InputData(input_mappings={}, id=IODataConstants.DEFAULT_ID)]
+        self._validate_input(prompt=prompt, input_data=input_data, validate_input_data=validate_input_data)
+
+        input_keys = tuple(input_data[0].get_input_keys()) if input_data else ()
+        compiled_prompt_key = (prompt, system_prompt, output_data_model_class, input_keys)
+        compiled_prompt = self._compiled_prompts.get(compiled_prompt_key)
+        if compiled_prompt is None:
+            compiled_prompt = self._compile_prompt(
+                prompt=prompt,
+                input_keys=list(input_keys),
+                output_data_model_class=output_data_model_class,
+                system_prompt=system_prompt
+            )
+            self._compiled_prompts[compiled_prompt_key] = compiled_prompt
+            if len(self._compiled_prompts) > GeneralDefaults.COMPILED_PROMPTS_CACHE_SIZE:
+                self._compiled_prompts.popitem(last=False)
+        else:
+            self._compiled_prompts.move_to_end(compiled_prompt_key)
+
+        self._parser = compiled_prompt.parser
+        return compiled_prompt
 
+    def _compile_prompt(
+            self,
+            prompt: str,
+            input_keys: typing.List[str],
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]],
+            system_prompt: typing.Optional[str]
+    ) -> _CompiledPrompt:
         prompt_template_args = {
             PromptConstants.TEMPLATE_STR: prompt,
-            PromptConstants.INPUT_VARIABLES_STR: list(input_data[0].get_input_keys())
+            PromptConstants.INPUT_VARIABLES_STR: input_keys
         }
 
+        parser = None
         if output_data_model_class:
-            self._parser = PydanticOutputParser(pydantic_object=output_data_model_class)
+            parser = PydanticOutputParser(pydantic_object=output_data_model_class)
 
             if self._is_json_format_injected_into_prompt:
                 prompt_template_args[PromptConstants.PARTIAL_VARIABLES_STR] = {
-                    PromptConstants.OUTPUT_DATA_MODEL: self._parser.get_format_instructions(),
+                    PromptConstants.OUTPUT_DATA_MODEL: parser.get_format_instructions(),
                 }
                 prompt_template_args[PromptConstants.TEMPLATE_STR] = self._add_output_data_format(prompt=prompt)
 
-        chat_prompts = await self._build_chat_prompts(prompt_template_args, system_prompt)
+        chat_prompts = self._build_chat_prompts(prompt_template_args, system_prompt)
 
         prompt_template = ChatPromptTemplate.from_messages(chat_prompts)
 
         chain = self._get_chain(prompt_template)
         long_chain = self._get_chain_for_long_text(prompt_template)
 
-        predict_example_any_length_partial = partial(
-            self._predict_example_of_any_length,
+        return _CompiledPrompt(
             prompt_template=prompt_template,
-            standard_chain=chain,
-            long_chain=long_chain
+            parser=parser,
+            predict_example_any_length_partial=partial(
+                self._predict_example_of_any_length,
+                prompt_template=prompt_template,
+                standard_chain=chain,
+                long_chain=long_chain
+            ),
+            prompt_tokens_counter=PromptTokenCounter(
+                prompt_template=prompt_template,
+                input_variables=input_keys,
+                token_counter=self._token_counter,
+                count_by_segments=self._is_prompt_token_counting_by_segments_enabled
+            )
         )
 
-        logger.info("Generating responses...")
-        results = list(map(lambda data: predict_example_any_length_partial(input_data=data), input_data))
+    async def _predict_examples_as_completed(
+            self,
+            predict_example_any_length_partial: typing.Callable[..., typing.Awaitable[ResponseData]],
+            prompt_tokens_counter: PromptTokenCounter,
+            input_data: typing.Optional[typing.List[InputData]] = None,
+            prompt_input_variables: typing.Optional[typing.FrozenSet[str]] = None
+    ) -> typing.AsyncIterator[typing.Tuple[int, ResponseData]]:
+        if input_data is None:
+            # Prompt without symbolic variables is passed - create input_data accordingly
+            input_data = [InputData(input_mappings={}, id=IODataConstants.DEFAULT_ID)]
 
-        responses = await asyncio.gather(*results)
+        prompt_deduplicator = PromptDeduplicator() if self._deduplicate_prompts else None
+        if prompt_deduplicator:
+            self._deduplication_stats = prompt_deduplicator.stats
 
-        return responses
+        logger.info("Generating responses...")
+        async for example_index, model_response in map_as_completed(
+                function=lambda data_with_tokens_number: predict_example_any_length_partial(
+                    input_data=data_with_tokens_number[0],
+                    number_of_prompt_tokens=data_with_tokens_number[1],
+                    prompt_deduplicator=prompt_deduplicator
+                ),
+                items=self._add_prompt_tokens_numbers(input_data, prompt_tokens_counter, prompt_input_variables),
+                num_workers=min(self._max_concurrency, len(input_data))
+        ):
+            yield example_index, model_response
+
+        if prompt_deduplicator:
+            logger.info(
+                f"{prompt_deduplicator.stats.number_of_unique_prompts} unique prompts were sent for "
+                f"{prompt_deduplicator.stats.number_of_examples} examples, deduplication ratio: "
+                f"{prompt_deduplicator.stats.deduplication_ratio:.2%}"
+            )
 
-    async def _build_chat_prompts(
+    @staticmethod
+    def _add_prompt_tokens_numbers(
+            input_data: typing.Iterable[InputData],
+            prompt_tokens_counter: PromptTokenCounter,
+            prompt_input_variables: typing.Optional[typing.FrozenSet[str]] = None
+    ) -> typing.Iterator[typing.Tuple[InputData, int]]:
+        # Tokens are counted in batches, so the first requests can be sent before the whole input_data is processed.
+        # If prompt_input_variables are passed, every batch is validated against them before its tokens are counted
+        input_data_iterator = iter(input_data)
+        while input_data_batch := list(itertools.islice(input_data_iterator, TokenCountingDefaults.BATCH_SIZE)):
+            if prompt_input_variables is not None:
+                AbstractModel._validate_input_data_batch(prompt_input_variables, input_data_batch)
+            yield from zip(input_data_batch, prompt_tokens_counter.count_batch(input_data_batch))
+
+    def _build_chat_prompts(
             self,
             prompt_template_args: dict,
-            system_prompt: SystemMessagePromptTemplate
+            system_prompt: typing.Optional[str]
     ) -> typing.List[typing.Union[SystemMessagePromptTemplate, HumanMessagePromptTemplate]]:
         human_message = HumanMessagePromptTemplate(prompt=PromptTemplate(**prompt_template_args))
         if not system_prompt:
@@ -201,17 +645,33 @@ class AbstractModel(ABC):
                 f"input, because otherwise it may lead to unexpected errors. Example id: {input_data.id}"
             )
 
+    def _get_too_long_prompt_response(
+            self,
+            input_data: InputData,
+            prompt_tokens_number: int
+    ) -> typing.Optional[ResponseData]:
+        try:
+            self._validate_input_data_len(input_data=input_data, number_of_prompt_tokens=prompt_tokens_number)
+        except ValueError as value_error:
+            logger.info(f"Error for id {input_data.id} has occurred. Message: {value_error} ")
+            return ResponseData(
+                input_data=None if len(input_data.input_mappings) == 0 else input_data,
+                response=None,
+                number_of_prompt_tokens=prompt_tokens_number,
+                number_of_generated_tokens=0,
+                error=f"{IODataConstants.VALUE_ERROR_MESSAGE}: {value_error}"
+            )
+        return None
+
     def _predict_example_of_any_length(
             self,
             input_data: InputData,
+            number_of_prompt_tokens: int,
             prompt_template: ChatPromptTemplate,
             standard_chain: LLMChain,
-            long_chain: LLMChain
-    ) -> ResponseData:
-        number_of_prompt_tokens = self._get_prompt_tokens_number(
-            prompt=prompt_template,
-            input_data=input_data
-        )
+            long_chain: LLMChain,
+            prompt_deduplicator: typing.Optional[PromptDeduplicator] = None
+    ) -> typing.Awaitable[ResponseData]:
         max_token_limit = get_max_allowed_number_of_tokens(self._model_total_max_tokens, self._max_output_tokens)
         is_example_too_long = number_of_prompt_tokens > max_token_limit
 
@@ -222,39 +682,56 @@ class AbstractModel(ABC):
         )
         if is_example_too_long and self._is_long_text_bypass_enabled:
             return predict_example_partial(chain=long_chain)
-        return predict_example_partial(chain=standard_chain)
+        predict_example_partial = partial(
+            predict_example_partial,
+            chain=standard_chain,
+            response_cache_key=(
+                self._get_response_cache_key(prompt=prompt_template, input_data=input_data)
+                if self._response_cache else None
+            )
+        )
+        # Examples rejected as too long aren't coalesced, because their error message refers to their id
+        if prompt_deduplicator is None or number_of_prompt_tokens > self._model_total_max_tokens:
+            return predict_example_partial()
+        return prompt_deduplicator.predict(
+            rendered_prompt=prompt_template.format_prompt(**input_data.input_mappings).to_string(),
+            input_data=input_data,
+            predict_example=predict_example_partial
+        )
 
     async def _predict_example(
             self,
             chain: LLMChain,
             input_data: InputData,
-            prompt_tokens_number: int
+            prompt_tokens_number: int,
+            response_cache_key: typing.Optional[str] = None
     ) -> ResponseData:
         error_message: typing.Optional[str] = None
         number_of_input_mappings = len(input_data.input_mappings)
 
-        try:
-            self._validate_input_data_len(input_data=input_data, number_of_prompt_tokens=prompt_tokens_number)
-        except ValueError as value_error:
-            logger.info(f"Error for id {input_data.id} has occurred. Message: {value_error} ")
-            error_message = f"{IODataConstants.VALUE_ERROR_MESSAGE}: {value_error}"
-            return ResponseData(
-                input_data=None if number_of_input_mappings == 0 else input_data,
-                response=None,
-                number_of_prompt_tokens=prompt_tokens_number,
-                number_of_generated_tokens=0,
-                error=error_message
-            )
+        too_long_prompt_response = self._get_too_long_prompt_response(input_data, prompt_tokens_number)
+        if too_long_prompt_response:
+            return too_long_prompt_response
+
+        if response_cache_key:
+            cached_response = self._response_cache.get(response_cache_key)
+            if cached_response:
+                return cached_response.model_copy(
+                    update={"input_data": None if number_of_input_mappings == 0 else input_data}
+                )
+
+        if self._rate_limiter:
+            await self._rate_limiter.acquire(prompt_tokens_number + self._max_output_tokens)
 
+        model_response = None
         try:
-            async with self._semaphore:
-                if number_of_input_mappings == 0:
-                    # Workaround when prompt without symbolic variables is passed - arun() can't be called without any arg
-                    model_response = chain.run({}) if hasattr(chain.llm, "api_transport") and chain.llm.api_transport == "rest" else await chain.arun({})
-                else:
-                    model_response = chain.run(
-                        **input_data.input_mappings) if hasattr(chain.llm, "api_transport") and chain.llm.api_transport == "rest" else await chain.arun(
-                        **input_data.input_mappings)
+            if isinstance(chain, LongTextProcessingChain):
+                # The long text chain acquires the limiter for each of its requests, so holding it here as well could
+                # deadlock once all the slots are taken by long examples
+                model_response = await self._run_chain(chain, input_data.input_mappings)
+            else:
+                async with self._concurrency_limiter:
+                    model_response = await self._run_chain(chain, input_data.input_mappings)
         except openai.InternalServerError as invalid_request_error:
             logger.info(f"Error for id {input_data.id} has occurred. Message: {invalid_request_error} ")
             if invalid_request_error.code == "content_filter":
@@ -270,13 +747,46 @@ class AbstractModel(ABC):
             logger.info(f"Error for id {input_data.id} has occurred. Message: {other_error} ")
             error_message = f"{type(other_error).__name__}: {other_error}"
 
-        return ResponseData(
+        finally:
+            # Also for the errors that aren't handled above and for cancellation, so that the reserved tokens aren't
+            # lost for the rest of the generation
+            number_of_generated_tokens = self._get_model_response_tokens_number(model_response)
+            if self._rate_limiter:
+                self._rate_limiter.refund(self._max_output_tokens - number_of_generated_tokens)
+
+        response_data = ResponseData(
             input_data=None if number_of_input_mappings == 0 else input_data,
             response=model_response,
             number_of_prompt_tokens=prompt_tokens_number,
-            number_of_generated_tokens=self._get_model_response_tokens_number(model_response),
+            number_of_generated_tokens=number_of_generated_tokens,
             error=error_message
         )
+        if response_cache_key and error_message is None:
+            self._response_cache.set(response_cache_key, response_data)
+
+        return response_data
+
+    async def _run_chain(self, chain: LLMChain, input_mappings: typing.Dict[str, typing.Any]) -> str:
+        if getattr(getattr(chain, "llm", None), "api_transport", None) == "rest":
+            # The REST transport has no async client, so the blocking call is offloaded to a thread pool shared by all
+            # the requests of this model to keep the event loop free for the other requests
+            if input_mappings:
+                run_chain = partial(chain.run, **input_mappings)
+            else:
+                run_chain = partial(chain.run, {})
+            return await asyncio.get_running_loop().run_in_executor(self._get_rest_transport_executor(), run_chain)
+        if not input_mappings:
+            # Workaround when prompt without symbolic variables is passed - arun() can't be called without any arg
+            return await chain.arun({})
+        return await chain.arun(**input_mappings)
+
+    def _get_rest_transport_executor(self) -> ThreadPoolExecutor:
+        if self._rest_transport_executor is None:
+            self._rest_transport_executor = ThreadPoolExecutor(
+                max_workers=min(self._max_concurrency, GeneralDefaults.MAX_REST_TRANSPORT_WORKERS),
+                thread_name_prefix="allms-rest-transport"
+            )
+        return self._rest_transport_executor
 
     def _get_number_of_tokens_in_prompt(self, prompt: PromptTemplate, input_data: InputData) -> int:
         return self._llm.get_num_tokens(prompt.format_prompt(**input_data.input_mappings).to_string())
@@ -308,24 +818,40 @@ class AbstractModel(ABC):
             max_output_tokens=self._max_output_tokens,
             map_prompt=prompt_template,
             reduce_prompt=reduce_prompt_template,
-            aggregation_strategy=self._aggregation_strategy
+            aggregation_strategy=self._aggregation_strategy,
+            concurrency_limiter=self._concurrency_limiter
         )
 
-    def _validate_input(self, prompt: str, input_data: typing.Optional[typing.List[InputData]] = None) -> None:
-        # Extracts text inside the {} but escapes the text inside {{}}
-        # This behaviour allows to pass JSON-like strings to the prompt
-        # reference: https://github.com/langchain-ai/langchain/issues/1660#issuecomment-1469320129
-        prompt_input_variables_set = AbstractModel._extract_input_variables_from_prompt(prompt)
-        if PromptConstants.OUTPUT_DATA_MODEL in prompt_input_variables_set:
-            prompt_input_variables_set.remove(PromptConstants.OUTPUT_DATA_MODEL)
+    def _validate_input(
+            self,
+            prompt: str,
+            input_data: typing.Optional[typing.List[InputData]] = None,
+            validate_input_data: bool = True
+    ) -> None:
+        prompt_input_variables_set = AbstractModel._get_prompt_input_variables(prompt)
 
         if input_data:
-            for data in input_data:
-                self._validate_input_data(prompt_input_variables_set, data)
+            if validate_input_data:
+                self._validate_input_data_batch(prompt_input_variables_set, input_data)
         elif len(prompt_input_variables_set) > 0:
             raise ValueError(
                 input_exception_message.get_prompt_contains_input_key_when_missing_input_data())
 
+    @staticmethod
+    def _get_prompt_input_variables(prompt: str) -> typing.FrozenSet[str]:
+        return AbstractModel._extract_input_variables_from_prompt(prompt) - {PromptConstants.OUTPUT_DATA_MODEL}
+
+    @staticmethod
+    def _validate_input_data_batch(
+            prompt_input_variables: typing.FrozenSet[str],
+            input_data: typing.Iterable[InputData]
+    ) -> None:
+        for data in input_data:
+            # Comparing the keys view with the set doesn't build any new collection. Only the examples that don't match
+            # go through the detailed checks, which raise the error describing the mismatch
+            if data.input_mappings.keys() != prompt_input_variables:
+                AbstractModel._validate_input_data(prompt_input_variables, data)
+
     def _validate_system_prompt(self, system_prompt: typing.Optional[str] = None) -> None:
         if isinstance(self, models.AzureMistralModel) and system_prompt is not None:
             raise ValueError(input_exception_message.get_system_prompt_is_not_supported_by_model())
@@ -335,14 +861,16 @@ class AbstractModel(ABC):
                 raise ValueError(input_exception_message.get_system_prompt_contains_input_variables())
 
     @staticmethod
-    def _extract_input_variables_from_prompt(prompt: str) -> typing.Set[str]:
-        input_variables_pattern = r'(?<!\{)\{([^{}]+)\}(?!\})'
-        input_variables_set = set(re.findall(input_variables_pattern, prompt))
-        return input_variables_set
+    @lru_cache(maxsize=GeneralDefaults.COMPILED_PROMPTS_CACHE_SIZE)
+    def _extract_input_variables_from_prompt(prompt: str) -> typing.FrozenSet[str]:
+        # Extracts text inside the {} but escapes the text inside {{}}
+        # This behaviour allows to pass JSON-like strings to the prompt
+        # reference: https://github.com/langchain-ai/langchain/issues/1660#issuecomment-1469320129
+        return frozenset(_INPUT_VARIABLES_PATTERN.findall(prompt))
 
     @staticmethod
     def _validate_input_data(
-            prompt_input_variables: typing.Set[str],
+            prompt_input_variables: typing.AbstractSet[str],
             input_data: typing.Optional[InputData] = None
     ) -> None:
         if len(input_data.input_mappings.keys()) > 0 and len(prompt_input_variables) == 0:
@@ -1,23 +1,265 @@
 import asyncio
+import time
 import typing
-from concurrent.futures import ThreadPoolExecutor
+import urllib.error
 
-from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun
+import httpx
+import openai
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
 from langchain_community.chat_models.azureml_endpoint import AzureMLChatOnlineEndpoint
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_openai import AzureChatOpenAI
+from pydantic import PrivateAttr
+
+from allms.defaults.azure_defaults import AzureOpenAIMultiDeploymentDefaults, AzureSelfDeployedDefaults
+from allms.defaults.general_defaults import GeneralDefaults
+from allms.domain.deployment_stats import DeploymentStats
 
 
 class AzureMLOnlineEndpointAsync(AzureMLChatOnlineEndpoint):
+    max_connections: int = AzureSelfDeployedDefaults.MAX_CONNECTIONS
+    max_keepalive_connections: int = AzureSelfDeployedDefaults.MAX_KEEPALIVE_CONNECTIONS
+    keepalive_expiry_s: float = AzureSelfDeployedDefaults.KEEPALIVE_EXPIRY_S
+
+    _async_http_client: typing.Optional[httpx.AsyncClient] = PrivateAttr(default=None)
+
+    async def _agenerate(
+            self,
+            messages: typing.List[BaseMessage],
+            stop: typing.Optional[typing.List[str]] = None,
+            run_manager: typing.Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: typing.Any,
+    ) -> ChatResult:
+        # Under the hood, langchain uses urllib.request to query the Azure ML Endpoint, which is not compatible with
+        # asyncio and opens a new connection for every request. That's why requests are sent with a pooled async
+        # client, which keeps the connections to the endpoint alive between requests
+        model_kwargs = {**(self.model_kwargs or {}), **kwargs}
+        if stop:
+            model_kwargs["stop"] = stop
+
+        request_payload = self.content_formatter.format_messages_request_payload(
+            messages, model_kwargs, self.endpoint_api_type
+        )
+        response = await self._get_async_http_client().post(
+            self.endpoint_url,
+            content=request_payload,
+            headers=self._get_request_headers()
+        )
+        if response.is_error:
+            # The same error as the one raised by the synchronous client, so that retries and error handling don't
+            # depend on the way the endpoint is queried
+            raise urllib.error.HTTPError(
+                url=self.endpoint_url,
+                code=response.status_code,
+                msg=response.reason_phrase,
+                hdrs=response.headers,
+                fp=None
+            )
+
+        generations = self.content_formatter.format_response_payload(response.content, self.endpoint_api_type)
+        return ChatResult(generations=[generations])
+
+    async def aclose(self) -> None:
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+            self._async_http_client = None
+
+    def _get_async_http_client(self) -> httpx.AsyncClient:
+        if self._async_http_client is None:
+            self._async_http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry_s
+                ),
+                # Requests waiting for a free connection from the pool shouldn't time out
+                timeout=httpx.Timeout(float(self.timeout), pool=None)
+            )
+        return self._async_http_client
+
+    def _get_request_headers(self) -> typing.Dict[str, str]:
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.endpoint_api_key.get_secret_value()}"
+        }
+        # The azureml-model-deployment header forces the request to go to a specific deployment
+        if self.deployment_name:
+            headers["azureml-model-deployment"] = self.deployment_name
+        return headers
+
+
+class AzureOpenAIDeploymentRouter(BaseChatModel):
+    """
+    Routes every request to the least loaded healthy deployment, relative to the deployment weights. A deployment that
+    responds with 429 or 5xx is taken out of rotation for the time given in the Retry-After header or for `cooldown_s`,
+    and the request is retried on another deployment. Once all the deployments are throttled, the request waits for
+    the earliest cooldown to end and is retried, at most `max_retries` times.
+    """
+    deployments: typing.List[AzureChatOpenAI]
+    weights: typing.List[float]
+    cooldown_s: float = AzureOpenAIMultiDeploymentDefaults.DEPLOYMENT_COOLDOWN_S
+    max_retries: int = GeneralDefaults.MAX_RETRIES
+
+    _stats: typing.List[DeploymentStats] = PrivateAttr()
+    _cooldown_end_times: typing.List[float] = PrivateAttr()
+
+    def __init__(self, **kwargs: typing.Any) -> None:
+        super().__init__(**kwargs)
+        if len(self.deployments) == 0:
+            raise ValueError("At least one deployment has to be provided")
+        if len(self.weights) != len(self.deployments):
+            raise ValueError("The number of weights has to be equal to the number of deployments")
+        if any(weight <= 0 for weight in self.weights):
+            raise ValueError("Weights of deployments have to be positive")
+
+        self._stats = [
+            DeploymentStats(
+                deployment=f"{deployment.azure_endpoint.rstrip('/')}/{deployment.deployment_name}", weight=weight
+            )
+            for deployment, weight in zip(self.deployments, self.weights)
+        ]
+        self._cooldown_end_times = [0.0] * len(self.deployments)
 
-    async def _acall(
+    @property
+    def _llm_type(self) -> str:
+        return "azure_openai_deployment_router"
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.deployments[0].get_num_tokens(text)
+
+    def _get_encoding_model(self) -> typing.Tuple[str, typing.Any]:
+        return self.deployments[0]._get_encoding_model()
+
+    def get_deployment_stats(self) -> typing.List[DeploymentStats]:
+        now = time.monotonic()
+        return [
+            stats.model_copy(update={"is_healthy": cooldown_end_time <= now})
+            for stats, cooldown_end_time in zip(self._stats, self._cooldown_end_times)
+        ]
+
+    async def _agenerate(
             self,
-            prompt: str,
+            messages: typing.List[BaseMessage],
             stop: typing.Optional[typing.List[str]] = None,
             run_manager: typing.Optional[AsyncCallbackManagerForLLMRun] = None,
             **kwargs: typing.Any,
-    ) -> str:
-        # Under the hood, langchain uses urllib.request to query the Azure ML Endpoint. urllib.request is not compatible
-        # with asyncio, and that's why we had to implement the function this way
-        task_executor = ThreadPoolExecutor()
-        return await asyncio.wrap_future(
-            task_executor.submit(self._call, prompt, stop, run_manager, **kwargs)
+    ) -> ChatResult:
+        await asyncio.sleep(self._get_time_until_any_deployment_is_healthy_s())
+        tried_deployments: typing.Set[int] = set()
+        number_of_retries = 0
+        while True:
+            deployment_index = self._select_deployment(excluded_deployments=tried_deployments)
+            tried_deployments.add(deployment_index)
+            self._on_request_start(deployment_index)
+            try:
+                result = await self.deployments[deployment_index]._agenerate(messages, stop=stop, **kwargs)
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as error:
+                self._on_request_failure(deployment_index, error)
+                if self._should_fail_over(error, tried_deployments):
+                    continue
+                if not self._should_retry_after_cooldown(error, number_of_retries):
+                    raise
+                number_of_retries += 1
+                tried_deployments.clear()
+                await asyncio.sleep(self._get_time_until_any_deployment_is_healthy_s())
+                continue
+            except Exception:
+                self._on_request_end(deployment_index)
+                raise
+            self._on_request_success(deployment_index)
+            return result
+
+    def _generate(
+            self,
+            messages: typing.List[BaseMessage],
+            stop: typing.Optional[typing.List[str]] = None,
+            run_manager: typing.Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: typing.Any,
+    ) -> ChatResult:
+        time.sleep(self._get_time_until_any_deployment_is_healthy_s())
+        tried_deployments: typing.Set[int] = set()
+        number_of_retries = 0
+        while True:
+            deployment_index = self._select_deployment(excluded_deployments=tried_deployments)
+            tried_deployments.add(deployment_index)
+            self._on_request_start(deployment_index)
+            try:
+                result = self.deployments[deployment_index]._generate(messages, stop=stop, **kwargs)
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as error:
+                self._on_request_failure(deployment_index, error)
+                if self._should_fail_over(error, tried_deployments):
+                    continue
+                if not self._should_retry_after_cooldown(error, number_of_retries):
+                    raise
+                number_of_retries += 1
+                tried_deployments.clear()
+                time.sleep(self._get_time_until_any_deployment_is_healthy_s())
+                continue
+            except Exception:
+                self._on_request_end(deployment_index)
+                raise
+            self._on_request_success(deployment_index)
+            return result
+
+    def _get_time_until_any_deployment_is_healthy_s(self) -> float:
+        return max(min(self._cooldown_end_times) - time.monotonic(), 0.0)
+
+    def _select_deployment(self, excluded_deployments: typing.Set[int]) -> int:
+        now = time.monotonic()
+        candidates = [index for index in range(len(self.deployments)) if index not in excluded_deployments]
+        healthy_candidates = [index for index in candidates if self._cooldown_end_times[index] <= now]
+        if not healthy_candidates:
+            # Only possible for the first try of a request, if a deployment went into a cooldown in the meantime
+            return min(candidates, key=lambda index: self._cooldown_end_times[index])
+        return min(
+            healthy_candidates,
+            key=lambda index: (self._stats[index].number_of_in_flight_requests + 1) / self.weights[index]
         )
+
+    def _should_fail_over(self, error: Exception, tried_deployments: typing.Set[int]) -> bool:
+        if isinstance(error, openai.InternalServerError) and error.code == "content_filter":
+            return False
+        now = time.monotonic()
+        return any(
+            index not in tried_deployments and cooldown_end_time <= now
+            for index, cooldown_end_time in enumerate(self._cooldown_end_times)
+        )
+
+    def _should_retry_after_cooldown(self, error: Exception, number_of_retries: int) -> bool:
+        # The deployment clients don't retry, and the errors are turned into responses before the retries of the
+        # model, so a request throttled by all the deployments would fail right away
+        return isinstance(error, openai.RateLimitError) and number_of_retries < self.max_retries
+
+    def _on_request_start(self, deployment_index: int) -> None:
+        self._stats[deployment_index].number_of_requests += 1
+        self._stats[deployment_index].number_of_in_flight_requests += 1
+
+    def _on_request_end(self, deployment_index: int) -> None:
+        self._stats[deployment_index].number_of_in_flight_requests -= 1
+
+    def _on_request_success(self, deployment_index: int) -> None:
+        self._on_request_end(deployment_index)
+        self._stats[deployment_index].number_of_successful_requests += 1
+
+    def _on_request_failure(self, deployment_index: int, error: openai.APIError) -> None:
+        self._on_request_end(deployment_index)
+        if isinstance(error, openai.InternalServerError) and error.code == "content_filter":
+            return
+        if isinstance(error, openai.RateLimitError):
+            self._stats[deployment_index].number_of_rate_limit_errors += 1
+        else:
+            self._stats[deployment_index].number_of_server_errors += 1
+        self._cooldown_end_times[deployment_index] = max(
+            self._cooldown_end_times[deployment_index],
+            time.monotonic() + self._get_cooldown_s(error)
+        )
+
+    def _get_cooldown_s(self, error: openai.APIError) -> float:
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            return self.cooldown_s
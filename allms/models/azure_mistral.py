@@ -1,5 +1,6 @@
 import typing
 from asyncio import AbstractEventLoop
+from concurrent.futures import Executor
 
 from langchain_community.chat_models.azureml_endpoint import LlamaChatContentFormatter
 
@@ -8,6 +9,8 @@ from allms.defaults.general_defaults import GeneralDefaults
 from allms.domain.configuration import AzureSelfDeployedConfiguration
 from allms.models.abstract import AbstractModel
 from allms.models.azure_base import AzureMLOnlineEndpointAsync
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter, TokenRateLimiter
+from allms.utils.response_cache_utils import ResponseCache
 
 
 class AzureMistralModel(AbstractModel):
@@ -21,7 +24,12 @@ class AzureMistralModel(AbstractModel):
             model_total_max_tokens: int = AzureMistralAIDefaults.MODEL_TOTAL_MAX_TOKENS,
             max_concurrency: int = GeneralDefaults.MAX_CONCURRENCY,
             max_retries: int = GeneralDefaults.MAX_RETRIES,
-            event_loop: typing.Optional[AbstractEventLoop] = None
+            event_loop: typing.Optional[AbstractEventLoop] = None,
+            response_cache: typing.Optional[ResponseCache] = None,
+            concurrency_limiter: typing.Optional[AdaptiveConcurrencyLimiter] = None,
+            rate_limiter: typing.Optional[TokenRateLimiter] = None,
+            response_parsing_executor: typing.Optional[Executor] = None,
+            deduplicate_prompts: bool = False
     ) -> None:
         self._top_p = top_p
         self._config = config
@@ -32,6 +40,11 @@ class AzureMistralModel(AbstractModel):
             max_output_tokens=max_output_tokens,
             max_concurrency=max_concurrency,
             max_retries=max_retries,
+            response_cache=response_cache,
+            concurrency_limiter=concurrency_limiter,
+            rate_limiter=rate_limiter,
+            response_parsing_executor=response_parsing_executor,
+            deduplicate_prompts=deduplicate_prompts,
             event_loop=event_loop
         )
 
@@ -51,5 +64,18 @@ class AzureMistralModel(AbstractModel):
             endpoint_url=self._config.endpoint_url,
             model_kwargs=model_kwargs,
             content_formatter=LlamaChatContentFormatter(),
-            deployment_name=self._config.deployment
+            deployment_name=self._config.deployment,
+            max_connections=self._config.max_connections,
+            max_keepalive_connections=self._config.max_keepalive_connections
         )
+
+    async def _aclose(self) -> None:
+        await self._llm.aclose()
+
+    def _get_model_parameters(self) -> typing.Dict[str, typing.Any]:
+        return {
+            **super()._get_model_parameters(),
+            "endpoint_url": self._config.endpoint_url,
+            "deployment": self._config.deployment,
+            "top_p": self._top_p
+        }
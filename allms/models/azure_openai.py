@@ -1,12 +1,29 @@
+import json
+import logging
+import time
 from asyncio import AbstractEventLoop
-from typing import Optional
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Type
 
+from langchain_core.messages import BaseMessage
 from langchain_openai import AzureChatOpenAI
+from openai.types import Batch
+from pydantic import BaseModel
 
-from allms.defaults.azure_defaults import AzureGptTurboDefaults
+from allms.constants.input_data import IODataConstants
+from allms.defaults.azure_defaults import AzureGptTurboDefaults, AzureOpenAIBatchDefaults
 from allms.defaults.general_defaults import GeneralDefaults
 from allms.domain.configuration import AzureOpenAIConfiguration
+from allms.domain.input_data import InputData
+from allms.domain.response import ResponseData
 from allms.models.abstract import AbstractModel
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter, TokenRateLimiter
+from allms.utils.response_cache_utils import ResponseCache
+from allms.utils.response_parsing_utils import ResponseParser
+
+logger = logging.getLogger(__name__)
+
+_MESSAGE_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
 
 
 class AzureOpenAIModel(AbstractModel):
@@ -19,7 +36,12 @@ class AzureOpenAIModel(AbstractModel):
             model_total_max_tokens: int = AzureGptTurboDefaults.MODEL_TOTAL_MAX_TOKENS,
             max_concurrency: int = GeneralDefaults.MAX_CONCURRENCY,
             max_retries: int = GeneralDefaults.MAX_RETRIES,
-            event_loop: Optional[AbstractEventLoop] = None
+            event_loop: Optional[AbstractEventLoop] = None,
+            response_cache: Optional[ResponseCache] = None,
+            concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+            rate_limiter: Optional[TokenRateLimiter] = None,
+            response_parsing_executor: Optional[Executor] = None,
+            deduplicate_prompts: bool = False
     ) -> None:
         self._request_timeout_s = request_timeout_s
         self._config = config
@@ -30,9 +52,16 @@ class AzureOpenAIModel(AbstractModel):
             max_output_tokens=max_output_tokens,
             max_concurrency=max_concurrency,
             max_retries=max_retries,
+            response_cache=response_cache,
+            concurrency_limiter=concurrency_limiter,
+            rate_limiter=rate_limiter,
+            response_parsing_executor=response_parsing_executor,
+            deduplicate_prompts=deduplicate_prompts,
             event_loop=event_loop
         )
 
+        self._is_prompt_token_counting_by_segments_enabled = True
+
     def _create_llm(self) -> AzureChatOpenAI:
         return AzureChatOpenAI(
             deployment_name=self._config.deployment,
@@ -45,3 +74,147 @@ class AzureOpenAIModel(AbstractModel):
             max_tokens=self._max_output_tokens,
             request_timeout=self._request_timeout_s
         )
+
+    def _get_model_parameters(self) -> Dict[str, Any]:
+        return {
+            **super()._get_model_parameters(),
+            "base_url": self._config.base_url,
+            "deployment": self._config.deployment,
+            "model_name": self._config.model_name
+        }
+
+    def _count_tokens_batch(self, texts: List[str]) -> List[int]:
+        # tiktoken encodes batches in parallel threads
+        _, encoding = self._llm._get_encoding_model()
+        return list(map(len, encoding.encode_batch(texts)))
+
+    def generate_batch(
+            self,
+            prompt: str,
+            input_data: Optional[List[InputData]] = None,
+            output_data_model_class: Optional[Type[BaseModel]] = None,
+            system_prompt: Optional[str] = None,
+            poll_interval_s: float = AzureOpenAIBatchDefaults.POLL_INTERVAL_S,
+            timeout_s: Optional[float] = None
+    ) -> List[ResponseData]:
+        """
+        Sends all the prompts as a single job of the Azure OpenAI Batch API, waits for it to finish and maps its results
+        back to the input data by their ids. The deployment from the configuration has to be a batch deployment.
+        Responses aren't read from nor stored in the response cache.
+        """
+        compiled_prompt = self._get_compiled_prompt(
+            prompt=prompt,
+            input_data=input_data,
+            output_data_model_class=output_data_model_class,
+            system_prompt=system_prompt
+        )
+        if input_data is None:
+            input_data = [InputData(input_mappings={}, id=IODataConstants.DEFAULT_ID)]
+        if len({example.id for example in input_data}) != len(input_data):
+            raise ValueError("Ids of the input data have to be unique to map the results of a batch job back to them")
+
+        responses_by_id: Dict[str, ResponseData] = {}
+        batch_requests = []
+        prompt_tokens_numbers = compiled_prompt.prompt_tokens_counter.count_batch(input_data)
+        for example, prompt_tokens_number in zip(input_data, prompt_tokens_numbers):
+            too_long_prompt_response = self._get_too_long_prompt_response(example, prompt_tokens_number)
+            if too_long_prompt_response:
+                responses_by_id[example.id] = too_long_prompt_response
+                continue
+            messages = compiled_prompt.prompt_template.format_messages(**example.input_mappings)
+            batch_requests.append(self._build_batch_request(example.id, messages))
+
+        if batch_requests:
+            batch_results = self._run_batch_job(batch_requests, poll_interval_s, timeout_s)
+            for example in input_data:
+                if example.id not in responses_by_id:
+                    responses_by_id[example.id] = self._get_batch_response_data(example, batch_results.get(example.id))
+
+        responses = [responses_by_id[example.id] for example in input_data]
+        if output_data_model_class:
+            return ResponseParser(self._parser).parse_model_output(responses)
+        return responses
+
+    def _build_batch_request(self, custom_id: str, messages: List[BaseMessage]) -> Dict[str, Any]:
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": AzureOpenAIBatchDefaults.ENDPOINT,
+            "body": {
+                "model": self._config.deployment,
+                "messages": [
+                    {"role": _MESSAGE_ROLES[message.type], "content": message.content} for message in messages
+                ],
+                "temperature": self._temperature,
+                "max_tokens": self._max_output_tokens
+            }
+        }
+
+    def _run_batch_job(
+            self,
+            batch_requests: List[Dict[str, Any]],
+            poll_interval_s: float,
+            timeout_s: Optional[float]
+    ) -> Dict[str, Dict[str, Any]]:
+        client = self._llm.root_client
+        batch_input = "".join(f"{json.dumps(batch_request)}\n" for batch_request in batch_requests)
+        input_file = client.files.create(file=("batch_input.jsonl", batch_input.encode("utf-8")), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=AzureOpenAIBatchDefaults.ENDPOINT,
+            completion_window=AzureOpenAIBatchDefaults.COMPLETION_WINDOW
+        )
+        logger.info(f"Submitted batch job {batch.id} with {len(batch_requests)} requests")
+
+        start_time = time.monotonic()
+        while batch.status not in AzureOpenAIBatchDefaults.TERMINAL_STATUSES:
+            if timeout_s is not None and time.monotonic() - start_time > timeout_s:
+                client.batches.cancel(batch.id)
+                raise TimeoutError(f"Batch job {batch.id} didn't finish in {timeout_s} s and was cancelled")
+            time.sleep(poll_interval_s)
+            batch = client.batches.retrieve(batch.id)
+        logger.info(f"Batch job {batch.id} finished with status {batch.status}")
+
+        batch_results: Dict[str, Dict[str, Any]] = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                for line in client.files.content(file_id).text.splitlines():
+                    if line.strip():
+                        batch_result = json.loads(line)
+                        batch_results[batch_result["custom_id"]] = batch_result
+        if batch.status != "completed":
+            for batch_request in batch_requests:
+                batch_results.setdefault(
+                    batch_request["custom_id"], {"error": {"message": self._get_batch_error_message(batch)}}
+                )
+        return batch_results
+
+    @staticmethod
+    def _get_batch_error_message(batch: Batch) -> str:
+        errors = [error.message for error in batch.errors.data or []] if batch.errors else []
+        return f"Batch job {batch.id} {batch.status}" + (f": {'; '.join(errors)}" if errors else "")
+
+    @staticmethod
+    def _get_batch_response_data(input_data: InputData, batch_result: Optional[Dict[str, Any]]) -> ResponseData:
+        response, error_message, response_body = None, None, {}
+        if batch_result is None:
+            error_message = f"{IODataConstants.ERROR_MESSAGE_STR}: No result was returned by the batch job"
+        else:
+            batch_response = batch_result.get("response") or {}
+            response_body = batch_response.get("body") or {}
+            if batch_result.get("error") or batch_response.get("status_code") != 200:
+                error = batch_result.get("error") or response_body.get("error") or {}
+                error_message = f"{IODataConstants.ERROR_MESSAGE_STR}: {error.get('message', error)}"
+            elif response_body["choices"][0].get("finish_reason") == "content_filter":
+                error_message = f"{IODataConstants.CONTENT_FILTER_MESSAGE}: The response was filtered"
+            else:
+                response = response_body["choices"][0]["message"]["content"]
+        usage = response_body.get("usage") or {}
+
+        return ResponseData(
+            input_data=None if len(input_data.input_mappings) == 0 else input_data,
+            response=response,
+            number_of_prompt_tokens=usage.get("prompt_tokens", 0),
+            number_of_generated_tokens=usage.get("completion_tokens", 0),
+            error=error_message
+        )
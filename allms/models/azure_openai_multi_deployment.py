@@ -0,0 +1,112 @@
+from asyncio import AbstractEventLoop
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Type
+
+from langchain_openai import AzureChatOpenAI
+from pydantic import BaseModel
+
+from allms.defaults.azure_defaults import (
+    AzureGptTurboDefaults, AzureOpenAIBatchDefaults, AzureOpenAIMultiDeploymentDefaults
+)
+from allms.defaults.general_defaults import GeneralDefaults
+from allms.domain.configuration import AzureOpenAIConfiguration
+from allms.domain.deployment_stats import DeploymentStats
+from allms.domain.input_data import InputData
+from allms.domain.response import ResponseData
+from allms.models.azure_base import AzureOpenAIDeploymentRouter
+from allms.models.azure_openai import AzureOpenAIModel
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter, TokenRateLimiter
+from allms.utils.response_cache_utils import ResponseCache
+
+
+class AzureOpenAIMultiDeploymentModel(AzureOpenAIModel):
+    def __init__(
+            self,
+            configs: List[AzureOpenAIConfiguration],
+            weights: Optional[List[float]] = None,
+            deployment_cooldown_s: float = AzureOpenAIMultiDeploymentDefaults.DEPLOYMENT_COOLDOWN_S,
+            temperature: float = AzureGptTurboDefaults.TEMPERATURE,
+            max_output_tokens: int = AzureGptTurboDefaults.MAX_OUTPUT_TOKENS,
+            request_timeout_s: int = AzureGptTurboDefaults.REQUEST_TIMEOUT_S,
+            model_total_max_tokens: int = AzureGptTurboDefaults.MODEL_TOTAL_MAX_TOKENS,
+            max_concurrency: int = GeneralDefaults.MAX_CONCURRENCY,
+            max_retries: int = GeneralDefaults.MAX_RETRIES,
+            event_loop: Optional[AbstractEventLoop] = None,
+            response_cache: Optional[ResponseCache] = None,
+            concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+            rate_limiter: Optional[TokenRateLimiter] = None,
+            response_parsing_executor: Optional[Executor] = None,
+            deduplicate_prompts: bool = False
+    ) -> None:
+        if len(configs) == 0:
+            raise ValueError("At least one configuration has to be provided")
+        if len({config.model_name for config in configs}) > 1:
+            raise ValueError("All deployments have to serve the same model")
+
+        self._configs = configs
+        self._weights = weights or [AzureOpenAIMultiDeploymentDefaults.DEPLOYMENT_WEIGHT] * len(configs)
+        self._deployment_cooldown_s = deployment_cooldown_s
+        self._max_retries = max_retries
+
+        super().__init__(
+            config=configs[0],
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            request_timeout_s=request_timeout_s,
+            model_total_max_tokens=model_total_max_tokens,
+            max_concurrency=max_concurrency,
+            max_retries=max_retries,
+            response_cache=response_cache,
+            concurrency_limiter=concurrency_limiter,
+            rate_limiter=rate_limiter,
+            response_parsing_executor=response_parsing_executor,
+            deduplicate_prompts=deduplicate_prompts,
+            event_loop=event_loop
+        )
+
+    def _create_llm(self) -> AzureOpenAIDeploymentRouter:
+        return AzureOpenAIDeploymentRouter(
+            deployments=[
+                AzureChatOpenAI(
+                    deployment_name=config.deployment,
+                    api_version=config.api_version,
+                    model_name=config.model_name,
+                    azure_endpoint=config.base_url,
+                    api_key=config.api_key,
+                    azure_ad_token=config.azure_ad_token,
+                    temperature=self._temperature,
+                    max_tokens=self._max_output_tokens,
+                    request_timeout=self._request_timeout_s,
+                    # Failed requests are retried on other deployments instead
+                    max_retries=0
+                )
+                for config in self._configs
+            ],
+            weights=self._weights,
+            cooldown_s=self._deployment_cooldown_s,
+            max_retries=self._max_retries
+        )
+
+    def get_deployment_stats(self) -> List[DeploymentStats]:
+        return self._llm.get_deployment_stats()
+
+    def generate_batch(
+            self,
+            prompt: str,
+            input_data: Optional[List[InputData]] = None,
+            output_data_model_class: Optional[Type[BaseModel]] = None,
+            system_prompt: Optional[str] = None,
+            poll_interval_s: float = AzureOpenAIBatchDefaults.POLL_INTERVAL_S,
+            timeout_s: Optional[float] = None
+    ) -> List[ResponseData]:
+        # A batch job is submitted to a single batch deployment, so it can't be routed between deployments
+        raise ValueError(
+            "Batch jobs need a single batch deployment, use AzureOpenAIModel with its configuration instead"
+        )
+
+    def _get_model_parameters(self) -> Dict[str, Any]:
+        return {
+            **super()._get_model_parameters(),
+            "base_url": [config.base_url for config in self._configs],
+            "deployment": [config.deployment for config in self._configs]
+        }
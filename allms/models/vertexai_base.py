@@ -1,12 +1,14 @@
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Tuple
 
 from google.cloud.aiplatform.models import Prediction
-from langchain_core.callbacks import AsyncCallbackManagerForLLMRun
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.messages import SystemMessage, get_buffer_string
 from langchain_core.outputs import LLMResult, Generation
 from langchain_google_vertexai import VertexAI, VertexAIModelGarden
 from pydash import chain
 
 from allms.constants.vertex_ai import VertexModelConstants
+from allms.utils.context_cache_utils import ContextCache
 
 
 class GCPInvalidRequestError(Exception):
@@ -14,6 +16,20 @@ class GCPInvalidRequestError(Exception):
 
 
 class CustomVertexAI(VertexAI):
+    context_cache: Optional[ContextCache] = None
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        prompts, kwargs = self._use_context_cache(prompts, kwargs)
+        result = super()._generate(prompts=prompts, stop=stop, run_manager=run_manager, **kwargs)
+        self._record_context_cache_usage(result, kwargs)
+        return result
+
     async def _agenerate(
         self,
         prompts: List[str],
@@ -28,15 +44,17 @@ class CustomVertexAI(VertexAI):
                     and generation.generation_info['is_blocked']
             )
 
+        prompts, kwargs = await self._ause_context_cache(prompts, kwargs)
         result = await super()._agenerate(
             prompts=prompts,
             stop=stop,
             run_manager=run_manager,
             **kwargs
         )
+        self._record_context_cache_usage(result, kwargs)
 
         if not all(result.generations):
-            raise GCPInvalidRequestError("The response is empty. It may have been blocked due to content filtering.")
+            raise GCPInvalidRequestError(VertexModelConstants.EMPTY_RESPONSE_ERROR_MESSAGE)
 
         return LLMResult(
             generations=(
@@ -56,6 +74,53 @@ class CustomVertexAI(VertexAI):
             run=result.run
         )
 
+    def _use_context_cache(
+        self,
+        prompts: List[str],
+        kwargs: Dict[str, Any]
+    ) -> Tuple[List[str], Dict[str, Any]]:
+        # The chain passes its system prompt, which is already rendered at the beginning of the prompts. If there's a
+        # cached content holding it, the prompts are sent without it and reference the cached content instead
+        system_prompt = kwargs.pop(VertexModelConstants.CACHED_SYSTEM_PROMPT_KWARG, None)
+        if system_prompt is None or self.context_cache is None:
+            return prompts, kwargs
+        cache_name = self.context_cache.get_cache_name(self.model_name, system_prompt)
+        return self._reference_cached_content(prompts, kwargs, system_prompt, cache_name)
+
+    async def _ause_context_cache(
+        self,
+        prompts: List[str],
+        kwargs: Dict[str, Any]
+    ) -> Tuple[List[str], Dict[str, Any]]:
+        system_prompt = kwargs.pop(VertexModelConstants.CACHED_SYSTEM_PROMPT_KWARG, None)
+        if system_prompt is None or self.context_cache is None:
+            return prompts, kwargs
+        cache_name = await self.context_cache.aget_cache_name(self.model_name, system_prompt)
+        return self._reference_cached_content(prompts, kwargs, system_prompt, cache_name)
+
+    @staticmethod
+    def _reference_cached_content(
+        prompts: List[str],
+        kwargs: Dict[str, Any],
+        system_prompt: str,
+        cache_name: Optional[str]
+    ) -> Tuple[List[str], Dict[str, Any]]:
+        if cache_name is None:
+            return prompts, kwargs
+
+        system_prompt_prefix = f"{get_buffer_string([SystemMessage(content=system_prompt)])}\n"
+        return (
+            [prompt.removeprefix(system_prompt_prefix) for prompt in prompts],
+            {**kwargs, "cached_content": cache_name}
+        )
+
+    def _record_context_cache_usage(self, result: LLMResult, kwargs: Dict[str, Any]) -> None:
+        if "cached_content" not in kwargs:
+            return
+        for generation_candidates in result.generations:
+            if generation_candidates and generation_candidates[0].generation_info:
+                self.context_cache.record_usage(generation_candidates[0].generation_info.get("usage_metadata") or {})
+
 
 class VertexAIModelGardenWrapper(VertexAIModelGarden):
     temperature: float = 0.0
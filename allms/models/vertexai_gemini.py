@@ -1,19 +1,40 @@
+import fnmatch
+import itertools
+import json
 import logging
+import time
 import typing
+import uuid
 from asyncio import AbstractEventLoop
+from concurrent.futures import Executor
 from typing import Optional
 
-from langchain_core.prompts import ChatPromptTemplate
+import fsspec
+from langchain.chains import LLMChain
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate, SystemMessagePromptTemplate
+from pydantic import BaseModel
 from vertexai.preview import tokenization
 from vertexai.tokenization._tokenizers import Tokenizer
 
+from allms.constants.input_data import IODataConstants
+from allms.constants.vertex_ai import VertexModelConstants
 from allms.defaults.general_defaults import GeneralDefaults
-from allms.defaults.vertex_ai import GeminiModelDefaults
+from allms.defaults.io_defaults import IODefaults
+from allms.defaults.token_counting import TokenCountingDefaults
+from allms.defaults.vertex_ai import GeminiBatchPredictionDefaults, GeminiModelDefaults
+from allms.domain.batch_prediction import BatchPredictionJobStatus
 from allms.domain.configuration import VertexAIConfiguration
 from allms.domain.input_data import InputData
+from allms.domain.response import ResponseData
 from allms.models.abstract import AbstractModel
-from allms.models.vertexai_base import CustomVertexAI
+from allms.models.vertexai_base import CustomVertexAI, GCPInvalidRequestError
+from allms.utils.batch_prediction_utils import BatchPredictionJobClient, VertexAIBatchPredictionJobClient
 from allms.utils.logger_utils import setup_logger
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter, TokenRateLimiter
+from allms.utils.context_cache_utils import ContextCache
+from allms.utils.response_cache_utils import ResponseCache
+from allms.utils.response_parsing_utils import ResponseParser
 
 
 logger = logging.getLogger(__name__)
@@ -39,12 +60,19 @@ class VertexAIGeminiModel(AbstractModel):
             max_concurrency: int = GeneralDefaults.MAX_CONCURRENCY,
             max_retries: int = GeneralDefaults.MAX_RETRIES,
             verbose: bool = GeminiModelDefaults.VERBOSE,
-            event_loop: Optional[AbstractEventLoop] = None
+            event_loop: Optional[AbstractEventLoop] = None,
+            response_cache: Optional[ResponseCache] = None,
+            concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+            rate_limiter: Optional[TokenRateLimiter] = None,
+            response_parsing_executor: Optional[Executor] = None,
+            deduplicate_prompts: bool = False,
+            context_cache: Optional[ContextCache] = None
     ) -> None:
         self._top_p = top_p
         self._top_k = top_k
         self._verbose = verbose
         self._config = config
+        self._context_cache = context_cache
 
         self._gcp_tokenizer = self._get_gcp_tokenizer(self._config.gemini_model_name)
 
@@ -54,6 +82,11 @@ class VertexAIGeminiModel(AbstractModel):
             max_output_tokens=max_output_tokens,
             max_concurrency=max_concurrency,
             max_retries=max_retries,
+            response_cache=response_cache,
+            concurrency_limiter=concurrency_limiter,
+            rate_limiter=rate_limiter,
+            response_parsing_executor=response_parsing_executor,
+            deduplicate_prompts=deduplicate_prompts,
             event_loop=event_loop
         )
 
@@ -71,6 +104,7 @@ class VertexAIGeminiModel(AbstractModel):
             api_endpoint=self._config.api_endpoint,
             api_transport=self._config.api_transport,
             credentials=self._config.credentials,
+            context_cache=self._context_cache,
         )
         # NOTE: this param is for some reason not passed, see: langchain_google_vertexai.llms.VertexAI.validate_environment
         # `endpoint_version` is not passed to the `ChatVertexAI` constructor
@@ -87,10 +121,15 @@ class VertexAIGeminiModel(AbstractModel):
             llm.client.default_metadata = self._config.extra_headers
         return llm
 
-    def _get_prompt_tokens_number(self, prompt: ChatPromptTemplate, input_data: InputData) -> int:
-        return self._gcp_tokenizer.count_tokens(
-            prompt.format_prompt(**input_data.input_mappings).to_string()
-        ).total_tokens
+    def _get_chain(self, prompt: ChatPromptTemplate) -> LLMChain:
+        chain = super()._get_chain(prompt)
+        system_messages = [message for message in prompt.messages if isinstance(message, SystemMessagePromptTemplate)]
+        if self._context_cache is not None and system_messages:
+            chain.llm_kwargs = {VertexModelConstants.CACHED_SYSTEM_PROMPT_KWARG: system_messages[0].format().content}
+        return chain
+
+    def _count_tokens(self, text: str) -> int:
+        return self._gcp_tokenizer.count_tokens(text).total_tokens
 
     def _get_model_response_tokens_number(self, model_response: typing.Optional[str]) -> int:
         if model_response:
@@ -118,3 +157,202 @@ class VertexAIGeminiModel(AbstractModel):
                     return tokenization.get_tokenizer_for_model(GeminiModelDefaults.GCP_MODEL_NAME)
             raise
 
+    def _get_model_parameters(self) -> typing.Dict[str, typing.Any]:
+        return {
+            **super()._get_model_parameters(),
+            "model_name": self._config.gemini_model_name,
+            "top_p": self._top_p,
+            "top_k": self._top_k
+        }
+
+    def generate_batch_prediction(
+            self,
+            prompt: str,
+            staging_uri: str,
+            input_data: Optional[typing.Iterable[InputData]] = None,
+            output_data_model_class: Optional[typing.Type[BaseModel]] = None,
+            system_prompt: Optional[str] = None,
+            job_client: Optional[BatchPredictionJobClient] = None,
+            poll_interval_s: float = GeminiBatchPredictionDefaults.POLL_INTERVAL_S,
+            timeout_s: Optional[float] = None
+    ) -> typing.Iterator[ResponseData]:
+        """
+        Runs all the prompts as a single Vertex AI batch prediction job instead of online requests. The requests are
+        staged as a JSONL file in a new directory under `staging_uri` (any fsspec-compatible location, `gs://` for
+        Vertex AI) and the job is submitted before this method returns. The returned iterator waits for the job to end
+        and yields the responses, in the order of the job output, while its prediction files are read. Responses for
+        the prompts that are too long to be submitted come first.
+        """
+        job_client = job_client or VertexAIBatchPredictionJobClient(self._config)
+        input_data_iterator = iter(input_data if input_data is not None else [
+            InputData(input_mappings={}, id=IODataConstants.DEFAULT_ID)
+        ])
+        first_input_data_batch = list(itertools.islice(input_data_iterator, TokenCountingDefaults.BATCH_SIZE))
+        compiled_prompt = self._get_compiled_prompt(
+            prompt=prompt,
+            input_data=first_input_data_batch if input_data is not None else None,
+            output_data_model_class=output_data_model_class,
+            system_prompt=system_prompt,
+            validate_input_data=False
+        )
+        response_parser = ResponseParser(compiled_prompt.parser) if output_data_model_class else None
+        prompt_input_variables = self._get_prompt_input_variables(prompt)
+
+        job_directory = f"{staging_uri.rstrip('/')}/{uuid.uuid4().hex}"
+        input_uri = f"{job_directory}/{GeminiBatchPredictionDefaults.INPUT_FILE_NAME}"
+        submitted_input_data: typing.Dict[str, InputData] = {}
+        too_long_prompt_responses: typing.List[ResponseData] = []
+        input_data_batches = itertools.chain(
+            [first_input_data_batch],
+            iter(lambda: list(itertools.islice(input_data_iterator, TokenCountingDefaults.BATCH_SIZE)), [])
+        )
+        with fsspec.open(input_uri, mode="w", encoding=IODefaults.ENCODING) as input_file:
+            for input_data_batch in input_data_batches:
+                if input_data is not None:
+                    self._validate_input_data_batch(prompt_input_variables, input_data_batch)
+                prompt_tokens_numbers = compiled_prompt.prompt_tokens_counter.count_batch(input_data_batch)
+                for example, prompt_tokens_number in zip(input_data_batch, prompt_tokens_numbers):
+                    if example.id in submitted_input_data:
+                        raise ValueError(f"Ids of the input data have to be unique, {example.id} is duplicated")
+                    too_long_prompt_response = self._get_too_long_prompt_response(example, prompt_tokens_number)
+                    if too_long_prompt_response:
+                        too_long_prompt_responses.append(too_long_prompt_response)
+                        continue
+                    messages = compiled_prompt.prompt_template.format_messages(**example.input_mappings)
+                    input_file.write(json.dumps(self._build_batch_prediction_request(example.id, messages)) + "\n")
+                    submitted_input_data[example.id] = example
+        if not submitted_input_data:
+            return iter(too_long_prompt_responses)
+
+        job_name = job_client.submit(
+            model_name=self._config.gemini_model_name,
+            input_uri=input_uri,
+            output_uri_prefix=f"{job_directory}/{GeminiBatchPredictionDefaults.OUTPUT_DIRECTORY_NAME}"
+        )
+        logger.info(f"Submitted batch prediction job {job_name} with {len(submitted_input_data)} requests")
+        return itertools.chain(
+            too_long_prompt_responses,
+            self._stream_batch_prediction_responses(
+                job_client=job_client,
+                job_name=job_name,
+                submitted_input_data=submitted_input_data,
+                response_parser=response_parser,
+                poll_interval_s=poll_interval_s,
+                timeout_s=timeout_s
+            )
+        )
+
+    def _stream_batch_prediction_responses(
+            self,
+            job_client: BatchPredictionJobClient,
+            job_name: str,
+            submitted_input_data: typing.Dict[str, InputData],
+            response_parser: Optional[ResponseParser],
+            poll_interval_s: float,
+            timeout_s: Optional[float]
+    ) -> typing.Iterator[ResponseData]:
+        job_status = self._wait_for_batch_prediction_job(job_client, job_name, poll_interval_s, timeout_s)
+
+        if job_status.has_succeeded:
+            for prediction in self._read_batch_predictions(job_status.output_uri):
+                example = submitted_input_data.pop(prediction.get(IODataConstants.ID), None)
+                if example is not None:
+                    response_data = self._get_batch_prediction_response_data(example, prediction)
+                    yield response_parser.parse_response_data(response_data) if response_parser else response_data
+            error_message = "No result was returned by the batch prediction job"
+        else:
+            error_message = f"Batch prediction job {job_name} failed: {job_status.error_message}"
+        for example in submitted_input_data.values():
+            yield ResponseData(
+                input_data=None if len(example.input_mappings) == 0 else example,
+                response=None,
+                number_of_prompt_tokens=0,
+                number_of_generated_tokens=0,
+                error=f"{IODataConstants.ERROR_MESSAGE_STR}: {error_message}"
+            )
+
+    def _build_batch_prediction_request(
+            self,
+            example_id: str,
+            messages: typing.List[BaseMessage]
+    ) -> typing.Dict[str, typing.Any]:
+        request = {
+            "contents": [
+                {"role": "user", "parts": [{"text": message.content}]}
+                for message in messages if message.type != "system"
+            ],
+            "generationConfig": {
+                "temperature": self._temperature,
+                "topP": self._top_p,
+                "topK": self._top_k,
+                "maxOutputTokens": self._max_output_tokens
+            }
+        }
+        system_messages = [message for message in messages if message.type == "system"]
+        if system_messages:
+            request["systemInstruction"] = {"parts": [{"text": message.content} for message in system_messages]}
+        if self._config.gemini_safety_settings:
+            request["safetySettings"] = [
+                {"category": category.name, "threshold": threshold.name}
+                for category, threshold in self._config.gemini_safety_settings.items()
+            ]
+        return {IODataConstants.ID: example_id, "request": request}
+
+    @staticmethod
+    def _wait_for_batch_prediction_job(
+            job_client: BatchPredictionJobClient,
+            job_name: str,
+            poll_interval_s: float,
+            timeout_s: Optional[float]
+    ) -> BatchPredictionJobStatus:
+        start_time = time.monotonic()
+        job_status = job_client.get_status(job_name)
+        while not job_status.has_ended:
+            if timeout_s is not None and time.monotonic() - start_time > timeout_s:
+                job_client.cancel(job_name)
+                raise TimeoutError(f"Batch prediction job {job_name} didn't finish in {timeout_s} s and was cancelled")
+            time.sleep(poll_interval_s)
+            job_status = job_client.get_status(job_name)
+        logger.info(f"Batch prediction job {job_name} has ended, succeeded: {job_status.has_succeeded}")
+        return job_status
+
+    @staticmethod
+    def _read_batch_predictions(output_uri: str) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+        file_system, output_path = fsspec.core.url_to_fs(output_uri)
+        prediction_paths = sorted(
+            path for path in file_system.find(output_path)
+            if fnmatch.fnmatch(path.rsplit("/", 1)[-1], GeminiBatchPredictionDefaults.PREDICTIONS_FILE_PATTERN)
+        )
+        for prediction_path in prediction_paths:
+            with file_system.open(prediction_path, mode="r", encoding=IODefaults.ENCODING) as prediction_file:
+                for line in prediction_file:
+                    if line.strip():
+                        yield json.loads(line)
+
+    @staticmethod
+    def _get_batch_prediction_response_data(
+            input_data: InputData,
+            prediction: typing.Dict[str, typing.Any]
+    ) -> ResponseData:
+        # Follows the semantics of CustomVertexAI: blocked candidates get a placeholder response, while a response
+        # without candidates is an error
+        response, error_message = None, None
+        prediction_response = prediction.get("response") or {}
+        candidates = prediction_response.get("candidates") or []
+        if prediction.get("status"):
+            error_message = f"{IODataConstants.ERROR_MESSAGE_STR}: {prediction['status']}"
+        elif not candidates:
+            error_message = f"{GCPInvalidRequestError.__name__}: {VertexModelConstants.EMPTY_RESPONSE_ERROR_MESSAGE}"
+        elif any(safety_rating.get("blocked") for safety_rating in candidates[0].get("safetyRatings") or []):
+            response = VertexModelConstants.RESPONSE_BLOCKED_STR
+        else:
+            response = "".join(part.get("text", "") for part in (candidates[0].get("content") or {}).get("parts", []))
+        usage_metadata = prediction_response.get("usageMetadata") or {}
+
+        return ResponseData(
+            input_data=None if len(input_data.input_mappings) == 0 else input_data,
+            response=response,
+            number_of_prompt_tokens=usage_metadata.get("promptTokenCount", 0),
+            number_of_generated_tokens=usage_metadata.get("candidatesTokenCount", 0),
+            error=error_message
+        )
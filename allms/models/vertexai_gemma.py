@@ -1,13 +1,16 @@
 from asyncio import AbstractEventLoop
+from concurrent.futures import Executor
 
 from langchain_google_vertexai import VertexAIModelGarden
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from allms.defaults.general_defaults import GeneralDefaults
 from allms.defaults.vertex_ai import GemmaModelDefaults
 from allms.domain.configuration import VertexAIModelGardenConfiguration
 from allms.models.vertexai_base import VertexAIModelGardenWrapper
 from allms.models.abstract import AbstractModel
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter, TokenRateLimiter
+from allms.utils.response_cache_utils import ResponseCache
 
 
 class VertexAIGemmaModel(AbstractModel):
@@ -22,7 +25,12 @@ class VertexAIGemmaModel(AbstractModel):
             max_concurrency: int = GeneralDefaults.MAX_CONCURRENCY,
             max_retries: int = GeneralDefaults.MAX_RETRIES,
             verbose: bool = GemmaModelDefaults.VERBOSE,
-            event_loop: Optional[AbstractEventLoop] = None
+            event_loop: Optional[AbstractEventLoop] = None,
+            response_cache: Optional[ResponseCache] = None,
+            concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+            rate_limiter: Optional[TokenRateLimiter] = None,
+            response_parsing_executor: Optional[Executor] = None,
+            deduplicate_prompts: bool = False
     ) -> None:
         self._top_p = top_p
         self._top_k = top_k
@@ -35,6 +43,11 @@ class VertexAIGemmaModel(AbstractModel):
             max_output_tokens=max_output_tokens,
             max_concurrency=max_concurrency,
             max_retries=max_retries,
+            response_cache=response_cache,
+            concurrency_limiter=concurrency_limiter,
+            rate_limiter=rate_limiter,
+            response_parsing_executor=response_parsing_executor,
+            deduplicate_prompts=deduplicate_prompts,
             event_loop=event_loop
         )
 
@@ -52,3 +65,11 @@ class VertexAIGemmaModel(AbstractModel):
             location=self._config.cloud_location,
             endpoint_id=self._config.endpoint_id
         )
+
+    def _get_model_parameters(self) -> Dict[str, Any]:
+        return {
+            **super()._get_model_parameters(),
+            "endpoint_id": self._config.endpoint_id,
+            "top_p": self._top_p,
+            "top_k": self._top_k
+        }
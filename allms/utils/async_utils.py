@@ -0,0 +1,66 @@
+import asyncio
+import typing
+
+T = typing.TypeVar("T")
+R = typing.TypeVar("R")
+
+_END_OF_QUEUE = object()
+
+
+async def map_as_completed(
+        function: typing.Callable[[T], typing.Awaitable[R]],
+        items: typing.Iterable[T],
+        num_workers: int
+) -> typing.AsyncIterator[typing.Tuple[int, R]]:
+    """
+    Applies `function` to every element of `items` using a fixed pool of `num_workers` worker tasks and yields
+    `(item_index, result)` tuples in the order of completion. Items are pulled lazily from `items` through a bounded
+    queue, so the number of live coroutines and pending items is proportional to `num_workers`, not to the number of
+    items.
+    """
+    if isinstance(items, typing.Sized):
+        num_workers = min(num_workers, len(items))
+    num_workers = max(num_workers, 1)
+
+    input_queue: asyncio.Queue = asyncio.Queue(maxsize=num_workers)
+    output_queue: asyncio.Queue = asyncio.Queue(maxsize=num_workers)
+
+    async def produce() -> None:
+        try:
+            for item_index, item in enumerate(items):
+                await input_queue.put((item_index, item))
+        except Exception as exception:
+            await output_queue.put(exception)
+            return
+        for _ in range(num_workers):
+            await input_queue.put(_END_OF_QUEUE)
+
+    async def work() -> None:
+        while True:
+            queue_element = await input_queue.get()
+            if queue_element is _END_OF_QUEUE:
+                await output_queue.put(_END_OF_QUEUE)
+                return
+            item_index, item = queue_element
+            try:
+                result = await function(item)
+            except Exception as exception:
+                await output_queue.put(exception)
+                return
+            await output_queue.put((item_index, result))
+
+    tasks = [asyncio.ensure_future(produce())] + [asyncio.ensure_future(work()) for _ in range(num_workers)]
+    try:
+        finished_workers = 0
+        while finished_workers < num_workers:
+            queue_element = await output_queue.get()
+            if queue_element is _END_OF_QUEUE:
+                finished_workers += 1
+            elif isinstance(queue_element, Exception):
+                raise queue_element
+            else:
+                yield queue_element
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
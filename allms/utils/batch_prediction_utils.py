@@ -0,0 +1,49 @@
+from abc import ABC, abstractmethod
+
+import vertexai
+from vertexai.batch_prediction import BatchPredictionJob
+
+from allms.domain.batch_prediction import BatchPredictionJobStatus
+from allms.domain.configuration import VertexAIConfiguration
+
+
+class BatchPredictionJobClient(ABC):
+    """Submits and tracks batch prediction jobs reading requests from and writing predictions to JSONL files."""
+
+    @abstractmethod
+    def submit(self, model_name: str, input_uri: str, output_uri_prefix: str) -> str:
+        """Submits the job and returns its name."""
+        ...
+
+    @abstractmethod
+    def get_status(self, job_name: str) -> BatchPredictionJobStatus:
+        ...
+
+    @abstractmethod
+    def cancel(self, job_name: str) -> None:
+        ...
+
+
+class VertexAIBatchPredictionJobClient(BatchPredictionJobClient):
+    def __init__(self, config: VertexAIConfiguration) -> None:
+        vertexai.init(project=config.cloud_project, location=config.cloud_location, credentials=config.credentials)
+
+    def submit(self, model_name: str, input_uri: str, output_uri_prefix: str) -> str:
+        job = BatchPredictionJob.submit(
+            source_model=model_name,
+            input_dataset=input_uri,
+            output_uri_prefix=output_uri_prefix
+        )
+        return job.resource_name
+
+    def get_status(self, job_name: str) -> BatchPredictionJobStatus:
+        job = BatchPredictionJob(job_name)
+        return BatchPredictionJobStatus(
+            has_ended=job.has_ended,
+            has_succeeded=job.has_succeeded,
+            output_uri=job.output_location or None,
+            error_message=job.error.message if job.error and job.error.message else None
+        )
+
+    def cancel(self, job_name: str) -> None:
+        BatchPredictionJob(job_name).cancel()
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import typing
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from allms.domain.response import ResponseData
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointJournal:
+    """
+    Append-only journal of `ResponseData`, one JSON line per response with the id of its example, used to resume
+    interrupted batch jobs. The id is journaled next to the response, as `ResponseData` doesn't hold the input data of
+    prompts without symbolic variables. Only the ids of the successfully completed examples are kept in memory. A
+    process killed in the middle of a write can leave only an incomplete last line, which is discarded when the journal
+    is opened again.
+    """
+
+    def __init__(self, path: typing.Union[str, Path]) -> None:
+        self._path = Path(path)
+        self._completed_ids: typing.Set[str] = set()
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._path.touch(exist_ok=True)
+        self._recover()
+        self._file = open(self._path, mode="ab")
+
+    @property
+    def completed_ids(self) -> typing.AbstractSet[str]:
+        return self._completed_ids
+
+    def is_completed(self, example_id: str) -> bool:
+        return example_id in self._completed_ids
+
+    def append(self, example_id: str, response_data: ResponseData) -> None:
+        entry = {"id": example_id, "response_data": response_data.model_dump(mode="json")}
+        # The whole line is written with a single call, so it's either fully written or cut off at the end of the file
+        self._file.write(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._file.flush()
+        if response_data.error is None:
+            self._completed_ids.add(example_id)
+
+    def read_responses(
+            self,
+            output_data_model_class: typing.Optional[typing.Type[BaseModel]] = None
+    ) -> typing.Iterator[typing.Tuple[str, ResponseData]]:
+        """Yields the ids of the examples and their journaled responses, in the order in which they were appended."""
+        self._file.flush()
+        with open(self._path, mode="rb") as journal_file:
+            for line in journal_file:
+                entry = json.loads(line)
+                response_data = ResponseData.model_validate(entry["response_data"])
+                if output_data_model_class and response_data.response is not None and response_data.error is None:
+                    response_data.response = output_data_model_class.model_validate(response_data.response)
+                yield entry["id"], response_data
+
+    def close(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def __enter__(self) -> "CheckpointJournal":
+        return self
+
+    def __exit__(self, *args: typing.Any) -> None:
+        self.close()
+
+    def _recover(self) -> None:
+        valid_size = 0
+        with open(self._path, mode="rb") as journal_file:
+            for line in journal_file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete line")
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                valid_size += len(line)
+                if entry["response_data"].get("error") is None:
+                    self._completed_ids.add(entry["id"])
+
+        if valid_size < self._path.stat().st_size:
+            logger.warning(f"Discarding an incomplete entry at the end of the checkpoint journal {self._path}")
+            os.truncate(self._path, valid_size)
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import time
+import typing
+
+import google.api_core.exceptions
+import openai
+
+from allms.defaults.general_defaults import GeneralDefaults
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Asynchronous context manager limiting the number of concurrent requests, that can be used instead of the static
+    `asyncio.Semaphore(max_concurrency)`. The limit is adjusted with the AIMD (additive increase, multiplicative
+    decrease) policy: each successful request increases the limit by `additive_increase / current_limit` (so by
+    `additive_increase` per a full window of requests), while a rate limit error (or a request slower than
+    `latency_threshold_s`, if set) multiplies it by `multiplicative_decrease`. A rate limit error additionally pauses
+    sending of all new requests for `pause_s` seconds.
+    """
+
+    def __init__(
+            self,
+            initial_limit: int = GeneralDefaults.ADAPTIVE_CONCURRENCY_INITIAL_LIMIT,
+            min_limit: int = 1,
+            max_limit: int = GeneralDefaults.MAX_CONCURRENCY,
+            additive_increase: float = 1.0,
+            multiplicative_decrease: float = 0.5,
+            pause_s: float = GeneralDefaults.ADAPTIVE_CONCURRENCY_PAUSE_S,
+            latency_threshold_s: typing.Optional[float] = None,
+            rate_limit_error_types: typing.Tuple[typing.Type[BaseException], ...] = (
+                    openai.RateLimitError, google.api_core.exceptions.ResourceExhausted
+            )
+    ) -> None:
+        if not min_limit <= initial_limit <= max_limit:
+            raise ValueError("initial_limit has to be between min_limit and max_limit")
+        if not 0 < multiplicative_decrease < 1:
+            raise ValueError("multiplicative_decrease has to be between 0 and 1")
+
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._additive_increase = additive_increase
+        self._multiplicative_decrease = multiplicative_decrease
+        self._pause_s = pause_s
+        self._latency_threshold_s = latency_threshold_s
+        self._rate_limit_error_types = rate_limit_error_types
+
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease_time = 0.0
+        self._condition: typing.Optional[asyncio.Condition] = None
+        self._request_start_times: typing.Dict[asyncio.Task, typing.List[float]] = {}
+
+    @property
+    def current_limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def __aenter__(self) -> "AdaptiveConcurrencyLimiter":
+        condition = self._get_condition()
+        async with condition:
+            while True:
+                pause_left_s = self._paused_until - time.monotonic()
+                if pause_left_s > 0:
+                    condition.release()
+                    try:
+                        await asyncio.sleep(pause_left_s)
+                    finally:
+                        await condition.acquire()
+                elif self._in_flight < self.current_limit:
+                    break
+                else:
+                    await condition.wait()
+            self._in_flight += 1
+
+        self._request_start_times.setdefault(asyncio.current_task(), []).append(time.monotonic())
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        task_start_times = self._request_start_times[asyncio.current_task()]
+        request_start_time = task_start_times.pop()
+        latency_s = time.monotonic() - request_start_time
+        if not task_start_times:
+            del self._request_start_times[asyncio.current_task()]
+
+        if exc_type is not None and issubclass(exc_type, self._rate_limit_error_types):
+            self._on_rate_limit_error(request_start_time)
+        elif self._latency_threshold_s is not None and latency_s > self._latency_threshold_s:
+            self._decrease_limit(request_start_time)
+        elif exc_type is None:
+            self._limit = min(self._limit + self._additive_increase / self._limit, self._max_limit)
+
+        condition = self._get_condition()
+        async with condition:
+            self._in_flight -= 1
+            condition.notify_all()
+
+    def _on_rate_limit_error(self, request_start_time: float) -> None:
+        if not self._decrease_limit(request_start_time):
+            return
+        self._paused_until = time.monotonic() + self._pause_s
+        logger.info(
+            f"Rate limit error has occurred. Pausing requests for {self._pause_s}s and decreasing concurrency limit to "
+            f"{self.current_limit}"
+        )
+
+    def _decrease_limit(self, request_start_time: float) -> bool:
+        # The requests sent before the last decrease were sent with the old limit, so they don't carry any information
+        # about the current one - otherwise a single burst of errors would decrease the limit many times
+        if request_start_time < self._last_decrease_time:
+            return False
+        self._limit = max(self._limit * self._multiplicative_decrease, self._min_limit)
+        self._last_decrease_time = time.monotonic()
+        return True
+
+    def _get_condition(self) -> asyncio.Condition:
+        # The condition has to be created inside the event loop it's used in
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+
+class _TokenBucket:
+    def __init__(self, capacity_per_minute: int) -> None:
+        self._capacity = float(capacity_per_minute)
+        self._refill_rate_per_s = capacity_per_minute / 60
+        self._available = self._capacity
+        self._last_refill_time = time.monotonic()
+
+    def get_wait_time_s(self, amount: float) -> float:
+        self._refill()
+        # A request larger than the whole bucket would never fit, so it waits only for the full bucket
+        missing_amount = min(amount, self._capacity) - self._available
+        return max(missing_amount, 0) / self._refill_rate_per_s
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self._available -= amount
+
+    def put(self, amount: float) -> None:
+        self._refill()
+        self._available = min(self._available + amount, self._capacity)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._available = min(self._available + (now - self._last_refill_time) * self._refill_rate_per_s, self._capacity)
+        self._last_refill_time = now
+
+
+class TokenRateLimiter:
+    """
+    Token bucket rate limiter for the quotas expressed in tokens per minute (TPM) and requests per minute (RPM). Before
+    sending a request, the number of prompt tokens plus the max number of output tokens is reserved. When the response
+    is received, the unused output tokens are refunded. Requests wait for the reservation in FIFO order.
+    """
+
+    def __init__(
+            self,
+            tokens_per_minute: typing.Optional[int] = None,
+            requests_per_minute: typing.Optional[int] = None
+    ) -> None:
+        if tokens_per_minute is None and requests_per_minute is None:
+            raise ValueError("At least one of tokens_per_minute and requests_per_minute has to be provided")
+
+        self._tokens_bucket = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._requests_bucket = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._lock: typing.Optional[asyncio.Lock] = None
+
+    async def acquire(self, number_of_tokens: int) -> None:
+        # The lock has to be created inside the event loop it's used in
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            while True:
+                wait_time_s = max(
+                    self._tokens_bucket.get_wait_time_s(number_of_tokens) if self._tokens_bucket else 0,
+                    self._requests_bucket.get_wait_time_s(1) if self._requests_bucket else 0
+                )
+                if wait_time_s <= 0:
+                    break
+                await asyncio.sleep(wait_time_s)
+
+            if self._tokens_bucket:
+                self._tokens_bucket.take(number_of_tokens)
+            if self._requests_bucket:
+                self._requests_bucket.take(1)
+
+    def refund(self, number_of_tokens: int) -> None:
+        if self._tokens_bucket and number_of_tokens > 0:
+            self._tokens_bucket.put(number_of_tokens)
@@ -0,0 +1,194 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import threading
+import time
+import typing
+import weakref
+from abc import ABC, abstractmethod
+
+import vertexai
+from vertexai.caching import CachedContent
+
+from allms.defaults.vertex_ai import GeminiContextCacheDefaults
+from allms.domain.configuration import VertexAIConfiguration
+from allms.domain.context_cache_stats import ContextCacheStats
+
+logger = logging.getLogger(__name__)
+
+
+class ContextCacheClient(ABC):
+    """Creates and maintains cached contents holding a system instruction shared by many requests."""
+
+    @abstractmethod
+    def create(self, model_name: str, system_instruction: str, ttl_s: float, display_name: str) -> str:
+        """Creates the cached content and returns its name."""
+        ...
+
+    @abstractmethod
+    def update_ttl(self, cache_name: str, ttl_s: float) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, cache_name: str) -> None:
+        ...
+
+
+class VertexAIContextCacheClient(ContextCacheClient):
+    def __init__(self, config: VertexAIConfiguration) -> None:
+        vertexai.init(project=config.cloud_project, location=config.cloud_location, credentials=config.credentials)
+
+    def create(self, model_name: str, system_instruction: str, ttl_s: float, display_name: str) -> str:
+        cached_content = CachedContent.create(
+            model_name=model_name,
+            system_instruction=system_instruction,
+            ttl=datetime.timedelta(seconds=ttl_s),
+            display_name=display_name
+        )
+        return cached_content.name
+
+    def update_ttl(self, cache_name: str, ttl_s: float) -> None:
+        CachedContent(cache_name).update(ttl=datetime.timedelta(seconds=ttl_s))
+
+    def delete(self, cache_name: str) -> None:
+        CachedContent(cache_name).delete()
+
+
+class _CacheEntry(typing.NamedTuple):
+    name: typing.Optional[str]
+    expire_time: float
+
+
+class ContextCache:
+    """
+    Keeps the cached contents of the system prompts shared by many requests. A cached content is created on the first
+    request with a given system prompt and reused by all the following ones, also in later generations and by other
+    models sharing this object, as it's looked up by the SHA-256 digest of the model name and the prompt. When a request
+    comes in less than `renewal_margin_s` before the cached content expires, its TTL is renewed. If the creation fails
+    (e.g. the prompt is shorter than the minimum size of a cached content), the failure is remembered for `ttl_s` and
+    the requests send the system prompt inline.
+    """
+
+    def __init__(
+            self,
+            client: ContextCacheClient,
+            ttl_s: float = GeminiContextCacheDefaults.TTL_S,
+            renewal_margin_s: float = GeminiContextCacheDefaults.RENEWAL_MARGIN_S
+    ) -> None:
+        if renewal_margin_s >= ttl_s:
+            raise ValueError("renewal_margin_s has to be lower than ttl_s")
+        self._client = client
+        self._ttl_s = ttl_s
+        self._renewal_margin_s = renewal_margin_s
+        self._entries: typing.Dict[str, _CacheEntry] = {}
+        self._stats = ContextCacheStats()
+        # The REST transport sends the requests from a thread pool. The lock guards only the state, the requests to
+        # create and renew the cached contents are serialized by the locks of their keys
+        self._lock = threading.Lock()
+        self._key_locks: typing.Dict[str, threading.Lock] = {}
+        # The asyncio locks are bound to the event loop, and the object can be shared by models with different loops
+        self._async_key_locks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    @property
+    def stats(self) -> ContextCacheStats:
+        return self._stats
+
+    def get_cache_name(self, model_name: str, system_prompt: str) -> typing.Optional[str]:
+        """Returns the name of a live cached content holding `system_prompt`, or None if it couldn't be created."""
+        key = self._get_key(model_name, system_prompt)
+        entry = self._get_fresh_entry(key)
+        if entry is None:
+            entry = self._refresh_entry(model_name, system_prompt, key)
+        return entry.name
+
+    async def aget_cache_name(self, model_name: str, system_prompt: str) -> typing.Optional[str]:
+        """
+        The same as `get_cache_name`, but the requests creating or renewing the cached content are sent from the
+        default executor of the event loop, so they don't block the other requests.
+        """
+        key = self._get_key(model_name, system_prompt)
+        entry = self._get_fresh_entry(key)
+        if entry is None:
+            # Only one coroutine per key waits for the executor, the other ones get the refreshed entry
+            async with self._get_async_key_lock(key):
+                entry = self._get_fresh_entry(key)
+                if entry is None:
+                    entry = await asyncio.get_running_loop().run_in_executor(
+                        None, self._refresh_entry, model_name, system_prompt, key
+                    )
+        return entry.name
+
+    def record_usage(self, usage_metadata: typing.Mapping[str, typing.Any]) -> None:
+        with self._lock:
+            self._stats.number_of_requests += 1
+            self._stats.number_of_prompt_tokens += usage_metadata.get("prompt_token_count") or 0
+            self._stats.number_of_cached_tokens += usage_metadata.get("cached_content_token_count") or 0
+
+    def delete_all(self) -> None:
+        """Deletes all the cached contents created by this object, instead of waiting for them to expire."""
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for entry in entries.values():
+            if entry.name is not None and time.monotonic() < entry.expire_time:
+                try:
+                    self._client.delete(entry.name)
+                except Exception as error:
+                    logger.warning(f"Cached content {entry.name} couldn't be deleted: {error}")
+
+    @staticmethod
+    def _get_key(model_name: str, system_prompt: str) -> str:
+        return hashlib.sha256(f"{model_name}\n{system_prompt}".encode("utf-8")).hexdigest()
+
+    def _get_fresh_entry(self, key: str) -> typing.Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and time.monotonic() < entry.expire_time - self._renewal_margin_s:
+            return entry
+        return None
+
+    def _refresh_entry(self, model_name: str, system_prompt: str, key: str) -> _CacheEntry:
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and now < entry.expire_time - self._renewal_margin_s:
+                # Refreshed by another thread in the meantime
+                return entry
+            if entry is not None and entry.name is not None and now < entry.expire_time:
+                entry = self._renew(entry, now)
+            if entry is None or entry.expire_time - self._renewal_margin_s <= now:
+                entry = self._create(model_name, system_prompt, key, now)
+            with self._lock:
+                self._entries[key] = entry
+            return entry
+
+    def _get_async_key_lock(self, key: str) -> asyncio.Lock:
+        event_loop = asyncio.get_running_loop()
+        with self._lock:
+            async_key_locks = self._async_key_locks.setdefault(event_loop, {})
+            return async_key_locks.setdefault(key, asyncio.Lock())
+
+    def _renew(self, entry: _CacheEntry, now: float) -> _CacheEntry:
+        try:
+            self._client.update_ttl(entry.name, self._ttl_s)
+        except Exception as error:
+            logger.warning(f"TTL of cached content {entry.name} couldn't be renewed, creating a new one: {error}")
+            return _CacheEntry(name=None, expire_time=now)
+        return _CacheEntry(name=entry.name, expire_time=now + self._ttl_s)
+
+    def _create(self, model_name: str, system_prompt: str, key: str, now: float) -> _CacheEntry:
+        try:
+            cache_name = self._client.create(
+                model_name=model_name,
+                system_instruction=system_prompt,
+                ttl_s=self._ttl_s,
+                display_name=f"allms-{key[:16]}"
+            )
+        except Exception as error:
+            logger.warning(f"Cached content couldn't be created, the system prompt will be sent inline: {error}")
+            return _CacheEntry(name=None, expire_time=now + self._ttl_s)
+        logger.info(f"Created cached content {cache_name} for the system prompt of model {model_name}")
+        return _CacheEntry(name=cache_name, expire_time=now + self._ttl_s)
@@ -0,0 +1,52 @@
+import asyncio
+import functools
+import hashlib
+import typing
+
+from allms.domain.deduplication_stats import DeduplicationStats
+from allms.domain.input_data import InputData
+from allms.domain.response import ResponseData
+
+
+class PromptDeduplicator:
+    """
+    Coalesces the requests with byte-identical rendered prompts within a single generation. Only the first example
+    with a given prompt sends the request, and the other ones wait for its response, which is copied with their own
+    `input_data`. Prompts are kept as SHA-256 digests, so memory doesn't grow with their length.
+    """
+
+    def __init__(self) -> None:
+        # The future of a prompt is replaced with its response (without `input_data`) once the request is done
+        self._responses: typing.Dict[bytes, typing.Union[asyncio.Future, ResponseData]] = {}
+        self._stats = DeduplicationStats()
+
+    @property
+    def stats(self) -> DeduplicationStats:
+        return self._stats
+
+    async def predict(
+            self,
+            rendered_prompt: str,
+            input_data: InputData,
+            predict_example: typing.Callable[[], typing.Awaitable[ResponseData]]
+    ) -> ResponseData:
+        prompt_key = hashlib.sha256(rendered_prompt.encode("utf-8")).digest()
+        self._stats.number_of_examples += 1
+
+        response = self._responses.get(prompt_key)
+        if response is None:
+            self._stats.number_of_unique_prompts += 1
+            response = self._responses[prompt_key] = asyncio.ensure_future(predict_example())
+            response.add_done_callback(functools.partial(self._store_response, prompt_key))
+            return await response
+
+        if isinstance(response, asyncio.Future):
+            # Shielded, so the cancellation of a duplicate doesn't cancel the request shared with the other examples
+            response = await asyncio.shield(response)
+        return response.model_copy(
+            update={"input_data": None if len(input_data.input_mappings) == 0 else input_data}
+        )
+
+    def _store_response(self, prompt_key: bytes, response: asyncio.Future) -> None:
+        if not response.cancelled() and response.exception() is None:
+            self._responses[prompt_key] = response.result().model_copy(update={"input_data": None})
@@ -1,15 +1,30 @@
 import csv
+import itertools
+import json
 import logging
+import time
+from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union, OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union, OrderedDict
 
 import fsspec
+from pydantic import BaseModel
 
 from allms.constants.input_data import IODataConstants
+from allms.defaults.io_defaults import IODefaults
 from allms.domain.input_data import InputData
+from allms.domain.response import ResponseData
 
 logger = logging.getLogger(__name__)
 
+_TOKEN_NUMBER_COLUMNS = (IODataConstants.PROMPT_TOKENS_NUMBER, IODataConstants.GENERATED_TOKENS_NUMBER)
+_RESPONSE_COLUMNS = (
+    IODataConstants.ID,
+    IODataConstants.RESPONSE_STR_NAME,
+    *_TOKEN_NUMBER_COLUMNS,
+    IODataConstants.ERROR_STR_NAME
+)
+
 
 def load_csv(
         path: str,
@@ -33,6 +48,270 @@ def load_csv_to_input_data(path: str, limit: Optional[int] = None) -> List[Input
     )
 
 
+def stream_csv_to_input_data(
+        path: str,
+        chunk_size: int = IODefaults.CHUNK_SIZE,
+        limit: Optional[int] = None,
+        encoding: str = IODefaults.ENCODING
+) -> Iterator[List[InputData]]:
+    logger.info(f"Streaming input data from {path}")
+    with fsspec.open(path, mode="r", encoding=encoding, newline="", compression="infer") as csv_file:
+        yield from _chunk_rows_to_input_data(csv.DictReader(csv_file), chunk_size=chunk_size, limit=limit)
+
+
+def stream_jsonl_to_input_data(
+        path: str,
+        chunk_size: int = IODefaults.CHUNK_SIZE,
+        limit: Optional[int] = None,
+        encoding: str = IODefaults.ENCODING
+) -> Iterator[List[InputData]]:
+    logger.info(f"Streaming input data from {path}")
+    with fsspec.open(path, mode="r", encoding=encoding, compression="infer") as jsonl_file:
+        rows = (json.loads(line) for line in jsonl_file if line.strip())
+        yield from _chunk_rows_to_input_data(rows, chunk_size=chunk_size, limit=limit)
+
+
+def stream_parquet_to_input_data(
+        path: str,
+        chunk_size: int = IODefaults.CHUNK_SIZE,
+        limit: Optional[int] = None
+) -> Iterator[List[InputData]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as import_error:
+        raise ImportError(
+            "Reading Parquet files requires pyarrow. Install it with `pip install allms[parquet]`."
+        ) from import_error
+
+    logger.info(f"Streaming input data from {path}")
+    with fsspec.open(path, mode="rb") as parquet_file:
+        rows = (
+            row
+            for record_batch in pq.ParquetFile(parquet_file).iter_batches(batch_size=chunk_size)
+            for row in record_batch.to_pylist()
+        )
+        yield from _chunk_rows_to_input_data(rows, chunk_size=chunk_size, limit=limit)
+
+
+def _chunk_rows_to_input_data(
+        rows: Iterable[Dict[str, Any]],
+        chunk_size: int,
+        limit: Optional[int]
+) -> Iterator[List[InputData]]:
+    rows = itertools.islice(rows, limit)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        yield [_row_to_input_data(row) for row in chunk]
+
+
+def _row_to_input_data(row: Dict[str, Any]) -> InputData:
+    return InputData(
+        input_mappings={
+            key: _to_input_mapping_value(value) for key, value in drop_dict_key(row, IODataConstants.ID).items()
+        },
+        id=str(row[IODataConstants.ID])
+    )
+
+
+def _to_input_mapping_value(value: Any) -> str:
+    # Missing values (nulls in JSONL and Parquet, missing cells of short CSV rows) are empty, as empty CSV cells are
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else str(value)
+
+
+class ResponseSink(ABC):
+    """
+    Writes `ResponseData` to a file as the responses arrive. Rows are buffered in memory and written when `buffer_size`
+    rows are collected or `flush_interval_s` seconds have passed since the last write, so memory usage doesn't depend
+    on the number of responses.
+    """
+    # Whether all the rows have to have the columns of the first one, e.g. because they are written in the CSV header
+    _HAS_FIXED_COLUMNS = True
+
+    def __init__(
+            self,
+            buffer_size: int = IODefaults.SINK_BUFFER_SIZE,
+            flush_interval_s: float = IODefaults.SINK_FLUSH_INTERVAL_S
+    ) -> None:
+        self._buffer_size = buffer_size
+        self._flush_interval_s = flush_interval_s
+        self._buffer: List[Dict[str, Any]] = []
+        self._last_flush_time = time.monotonic()
+        self._number_of_written_rows = 0
+        self._columns: Optional[List[str]] = None
+
+    @property
+    def number_of_written_rows(self) -> int:
+        return self._number_of_written_rows
+
+    def write(self, response_data: ResponseData) -> None:
+        row = self._response_data_to_row(response_data)
+        if self._HAS_FIXED_COLUMNS:
+            self._check_columns(row)
+        self._buffer.append(row)
+        if (
+                len(self._buffer) >= self._buffer_size
+                or time.monotonic() - self._last_flush_time >= self._flush_interval_s
+        ):
+            self.flush()
+
+    def write_many(self, responses: Iterable[ResponseData]) -> None:
+        for response_data in responses:
+            self.write(response_data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._write_rows(self._buffer)
+            self._number_of_written_rows += len(self._buffer)
+            self._buffer = []
+        self._last_flush_time = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        self._close()
+
+    def __enter__(self) -> "ResponseSink":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @abstractmethod
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    def _close(self) -> None:
+        ...
+
+    def _check_columns(self, row: Dict[str, Any]) -> None:
+        if self._columns is None:
+            self._columns = list(row.keys())
+        elif row.keys() != set(self._columns):
+            raise ValueError(
+                f"The row with id {row[IODataConstants.ID]} has columns {list(row.keys())}, but the file has columns "
+                f"{self._columns}. All examples should have the same input variables"
+            )
+
+    @staticmethod
+    def _response_data_to_row(response_data: ResponseData) -> Dict[str, Any]:
+        input_data = response_data.input_data
+        response = response_data.response
+        input_mappings = input_data.input_mappings if input_data else {}
+        colliding_columns = [column for column in _RESPONSE_COLUMNS if column in input_mappings]
+        if colliding_columns:
+            raise ValueError(
+                f"The input variables {colliding_columns} of the example with id {input_data.id} would be overwritten "
+                f"by the response columns, rename them"
+            )
+        return {
+            **input_mappings,
+            IODataConstants.ID: input_data.id if input_data else IODataConstants.DEFAULT_ID,
+            IODataConstants.RESPONSE_STR_NAME: (
+                response.model_dump(mode="json") if isinstance(response, BaseModel) else response
+            ),
+            IODataConstants.PROMPT_TOKENS_NUMBER: response_data.number_of_prompt_tokens,
+            IODataConstants.GENERATED_TOKENS_NUMBER: response_data.number_of_generated_tokens,
+            IODataConstants.ERROR_STR_NAME: response_data.error
+        }
+
+    @staticmethod
+    def _serialize_response(row: Dict[str, Any]) -> Dict[str, Any]:
+        response = row[IODataConstants.RESPONSE_STR_NAME]
+        if response is None or isinstance(response, str):
+            return row
+        return {**row, IODataConstants.RESPONSE_STR_NAME: json.dumps(response, ensure_ascii=False)}
+
+
+class JsonlResponseSink(ResponseSink):
+    _HAS_FIXED_COLUMNS = False
+
+    def __init__(
+            self,
+            path: str,
+            buffer_size: int = IODefaults.SINK_BUFFER_SIZE,
+            flush_interval_s: float = IODefaults.SINK_FLUSH_INTERVAL_S,
+            encoding: str = IODefaults.ENCODING
+    ) -> None:
+        super().__init__(buffer_size=buffer_size, flush_interval_s=flush_interval_s)
+        logger.info(f"Writing responses to {path}")
+        self._file = fsspec.open(path, mode="w", encoding=encoding, compression="infer").open()
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        self._file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+        self._file.flush()
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class CsvResponseSink(ResponseSink):
+    def __init__(
+            self,
+            path: str,
+            buffer_size: int = IODefaults.SINK_BUFFER_SIZE,
+            flush_interval_s: float = IODefaults.SINK_FLUSH_INTERVAL_S,
+            encoding: str = IODefaults.ENCODING
+    ) -> None:
+        super().__init__(buffer_size=buffer_size, flush_interval_s=flush_interval_s)
+        logger.info(f"Writing responses to {path}")
+        self._file = fsspec.open(path, mode="w", encoding=encoding, newline="", compression="infer").open()
+        self._csv_writer: Optional[csv.DictWriter] = None
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        if self._csv_writer is None:
+            self._csv_writer = csv.DictWriter(self._file, fieldnames=self._columns)
+            self._csv_writer.writeheader()
+        self._csv_writer.writerows(map(self._serialize_response, rows))
+        self._file.flush()
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class ParquetResponseSink(ResponseSink):
+    """Every flush of the buffer is written as a separate row group."""
+
+    def __init__(
+            self,
+            path: str,
+            buffer_size: int = IODefaults.SINK_BUFFER_SIZE,
+            flush_interval_s: float = IODefaults.SINK_FLUSH_INTERVAL_S
+    ) -> None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as import_error:
+            raise ImportError(
+                "Writing Parquet files requires pyarrow. Install it with `pip install allms[parquet]`."
+            ) from import_error
+
+        super().__init__(buffer_size=buffer_size, flush_interval_s=flush_interval_s)
+        logger.info(f"Writing responses to {path}")
+        self._pyarrow = pyarrow
+        self._file = fsspec.open(path, mode="wb").open()
+        self._parquet_writer: Optional[pyarrow.parquet.ParquetWriter] = None
+
+    def _write_rows(self, rows: List[Dict[str, Any]]) -> None:
+        if self._parquet_writer is None:
+            schema = self._pyarrow.schema([
+                (column, self._pyarrow.int64() if column in _TOKEN_NUMBER_COLUMNS else self._pyarrow.string())
+                for column in self._columns
+            ])
+            self._parquet_writer = self._pyarrow.parquet.ParquetWriter(self._file, schema)
+        self._parquet_writer.write_table(
+            self._pyarrow.Table.from_pylist(
+                list(map(self._serialize_response, rows)),
+                schema=self._parquet_writer.schema
+            )
+        )
+
+    def _close(self) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        self._file.close()
+
+
 def drop_dict_key(dictionary: Dict[Any, Any], key: Any) -> Dict[Any, Any]:
     dict_copy = dictionary.copy()
     dict_copy.pop(key)
@@ -1,10 +1,18 @@
-from typing import List
+import bisect
+import itertools
+import re
+from typing import Callable, Dict, List, Tuple
 
 from langchain import BasePromptTemplate
 from langchain.base_language import BaseLanguageModel
 from langchain.schema import Document
 
 from allms.defaults.long_text_chain import LongTextChainDefaults
+from allms.domain.input_data import InputData
+from allms.utils.token_counting_utils import TokenCounter
+
+_WORD_WITH_PRECEDING_WHITESPACES_PATTERN = re.compile(r"\s*\S+")
+_SENTENCE_END_CHARACTERS = frozenset(".!?")
 
 
 def truncate_text_to_max_size(
@@ -13,52 +21,122 @@ def truncate_text_to_max_size(
         text: str,
         model_total_max_tokens: int,
         max_output_tokens: int,
+        max_tokenizer_calls: int = LongTextChainDefaults.MAX_TRUNCATION_TOKENIZER_CALLS
 ) -> str:
     """
     This function is supposed to truncate the input to fit the maximum context size of a model. The problem is that
     the max context size is in tokens and in our code we operate on raw, un-tokenized strings. We can only calculate
-    how many tokens given string has. So to find the point on which we should truncate, this function calculates in
-    tokens how many times the current `text` is longer than the allowed limit. Then it assumes that the ration is true
-    also when reasoning on words instead of tokens. And based on this the `split_point_index` is calculated.
-    This is only an approximation (ration calculated on tokens is only similar to the ratio calculated on words, but in
-    most of the cases it won't be the same). That's why this function is used in a recursive way. It calculates the
-    split point, truncates the text and checks again if the total prompt length is lower than the max context size of
-    a model. If not it reruns itself again and if yes, then it returns the truncated text.
+    how many tokens given string has. So to find the point on which we should truncate, this function searches for
+    the longest prefix of `text` (cut on a word boundary) for which the whole prompt fits the limit. The first probe
+    is estimated from the ratio of the allowed to the current number of tokens, and the next ones follow the binary
+    search over the number of words. Every probe costs one tokenizer call, and there are never more than
+    `max_tokenizer_calls` of them - if the budget runs out, the longest prefix found so far that fits the limit is
+    returned.
 
     Another possibility would be to implement this function using tokenizer to tokenize text to tokens, then truncate
     the text, detokenize it to string and return truncated text. But for this solution, first we'd need to have a list
     of tokenizers used by every model we'd like to support (now it's provided inside langchain) and second, the
     tokenization and de-tokenization steps could change the input prompt by introducing some artifacts.
     """
+    return _truncate_texts_to_max_size(
+        llm=llm,
+        texts=[text],
+        render_prompt=lambda _, truncated_text: prompt_template.format(text=truncated_text),
+        model_total_max_tokens=model_total_max_tokens,
+        max_output_tokens=max_output_tokens,
+        max_tokenizer_calls=max_tokenizer_calls
+    )[0]
+
+
+def truncate_input_data_to_max_size(
+        llm: BaseLanguageModel,
+        prompt_template: BasePromptTemplate,
+        input_data: List[InputData],
+        input_variable: str,
+        model_total_max_tokens: int,
+        max_output_tokens: int,
+        max_tokenizer_calls: int = LongTextChainDefaults.MAX_TRUNCATION_TOKENIZER_CALLS
+) -> List[InputData]:
+    """
+    Vectorized version of `truncate_text_to_max_size`, which truncates the `input_variable` field of every example from
+    `input_data`. The search steps are made for all the examples at once, so the prompts of each step are tokenized in
+    a single batch.
+    """
+    return [
+        data if truncated_text is data.input_mappings[input_variable] else InputData(
+            input_mappings={**data.input_mappings, input_variable: truncated_text},
+            id=data.id
+        )
+        for data, truncated_text in zip(input_data, _truncate_texts_to_max_size(
+            llm=llm,
+            texts=[data.input_mappings[input_variable] for data in input_data],
+            render_prompt=lambda data_index, truncated_text: prompt_template.format(
+                **{**input_data[data_index].input_mappings, input_variable: truncated_text}
+            ),
+            model_total_max_tokens=model_total_max_tokens,
+            max_output_tokens=max_output_tokens,
+            max_tokenizer_calls=max_tokenizer_calls
+        ))
+    ]
+
+
+def _truncate_texts_to_max_size(
+        llm: BaseLanguageModel,
+        texts: List[str],
+        render_prompt: Callable[[int, str], str],
+        model_total_max_tokens: int,
+        max_output_tokens: int,
+        max_tokenizer_calls: int
+) -> List[str]:
     max_token_limit = get_max_allowed_number_of_tokens(model_total_max_tokens, max_output_tokens)
-    num_tokens = int(llm.get_num_tokens(prompt_template.format(text=text)))
+    token_counter = TokenCounter(count_tokens=llm.get_num_tokens)
 
-    if num_tokens <= max_token_limit:
-        return text
+    prompts_tokens = token_counter.count_batch([render_prompt(text_index, text) for text_index, text in enumerate(texts)])
+    truncated_texts = list(texts)
 
-    # We add `text="text"` and not empty string, because the empty string may be tokenized together with the whitespaces
-    # that are around it in the prompt. But when joining the actual `{text}` with the prompt instructions we get one
-    # additional token
-    num_tokens_prompt_wo_text = int(llm.get_num_tokens(prompt_template.format(text="text")))
-    num_tokens_text = int(llm.get_num_tokens(text))
-    num_tokens_left_for_text = max_token_limit - num_tokens_prompt_wo_text
-    if num_tokens_left_for_text <= 0:
-        raise ValueError("Prompt instruction (without the actual text) is longer than the allowed model input length")
+    # For each text that is too long: the end offsets of its words and the binary search bounds - the number of words
+    # that is known to fit the limit and the number of words that is known to exceed it
+    words_ends: Dict[int, List[int]] = {}
+    search_bounds: Dict[int, Tuple[int, int]] = {}
+    next_probes: Dict[int, int] = {}
+    for text_index, (text, prompt_tokens) in enumerate(zip(texts, prompts_tokens)):
+        if prompt_tokens > max_token_limit:
+            words_ends[text_index] = [word_match.end() for word_match in _WORD_WITH_PRECEDING_WHITESPACES_PATTERN.finditer(text)]
+            search_bounds[text_index] = (0, len(words_ends[text_index]))
+            next_probes[text_index] = int(len(words_ends[text_index]) * max_token_limit / prompt_tokens)
 
-    # How many times the current text is longer than the allowed length
-    current_to_allowed_length_ration = num_tokens_text / num_tokens_left_for_text
-    words = text.split()
-    split_point_index = int(len(words) / current_to_allowed_length_ration)
+    # One call is used for the whole prompt and one is reserved for checking the prompt without the text
+    for _ in range(max_tokenizer_calls - 2):
+        next_probes = {
+            text_index: min(max(probe, search_bounds[text_index][0] + 1), search_bounds[text_index][1] - 1)
+            for text_index, probe in next_probes.items()
+            if search_bounds[text_index][1] - search_bounds[text_index][0] > 1
+        }
+        if not next_probes:
+            break
 
-    text_truncated = " ".join(words[:split_point_index])
+        probes_tokens = token_counter.count_batch([
+            render_prompt(text_index, texts[text_index][:words_ends[text_index][probe - 1]])
+            for text_index, probe in next_probes.items()
+        ])
+        for (text_index, probe), probe_tokens in zip(next_probes.items(), probes_tokens):
+            lower_bound, upper_bound = search_bounds[text_index]
+            search_bounds[text_index] = (probe, upper_bound) if probe_tokens <= max_token_limit else (lower_bound, probe)
+            next_probes[text_index] = sum(search_bounds[text_index]) // 2
 
-    return truncate_text_to_max_size(
-        llm=llm,
-        prompt_template=prompt_template,
-        text=text_truncated,
-        model_total_max_tokens=model_total_max_tokens,
-        max_output_tokens=max_output_tokens
-    )
+    texts_without_fitting_prefix = [text_index for text_index, (lower_bound, _) in search_bounds.items() if lower_bound == 0]
+    if texts_without_fitting_prefix:
+        prompts_without_text_tokens = token_counter.count_batch(
+            [render_prompt(text_index, "") for text_index in texts_without_fitting_prefix]
+        )
+        if any(prompt_tokens > max_token_limit for prompt_tokens in prompts_without_text_tokens):
+            raise ValueError("Prompt instruction (without the actual text) is longer than the allowed model input length")
+
+    for text_index, (number_of_fitting_words, _) in search_bounds.items():
+        truncated_texts[text_index] = texts[text_index][:words_ends[text_index][number_of_fitting_words - 1]] \
+            if number_of_fitting_words > 0 else ""
+
+    return truncated_texts
 
 
 def split_text_to_max_size(
@@ -67,28 +145,120 @@ def split_text_to_max_size(
         text: str,
         model_total_max_tokens: int,
         max_output_tokens: int,
-        overlap_size: int = LongTextChainDefaults.OVERLAP_SIZE
+        overlap_size: int = LongTextChainDefaults.OVERLAP_SIZE,
+        snap_to_sentence_boundary: bool = True
 ) -> List[Document]:
+    """
+    Splits `text` into the smallest number of chunks, such that each chunk inserted into the `prompt_template` fits the
+    maximum context size of a model. The text is tokenized only once: it's split into words (together with the
+    preceding whitespaces) and the tokens of every unique word are counted. Chunk boundaries are then computed from the
+    prefix sums of these counts - each chunk takes as many words as fit the limit and the consecutive chunks overlap by
+    at most `overlap_size` tokens. If `snap_to_sentence_boundary` is set, a chunk is shortened to end on the last
+    paragraph or sentence end, as long as it keeps at least half of its tokens. The sum of the words' counts is only an
+    estimate for the subword tokenizers, which merge characters across the word boundaries, so the prompt with every
+    chunk is tokenized once more and the chunk is shortened until it fits the limit.
+    """
     max_token_limit = get_max_allowed_number_of_tokens(model_total_max_tokens, max_output_tokens)
     if int(llm.get_num_tokens(prompt_template.format(text=text))) < max_token_limit:
         return [Document(page_content=text)]
 
-    words = text.split()
-    middle_word_index = len(words) // 2
+    max_tokens_per_chunk = _get_number_of_tokens_left_for_text(llm, prompt_template, max_token_limit)
+    words_offsets, words_prefix_tokens = _get_words_offsets_and_prefix_tokens(llm, text)
+    number_of_words = len(words_offsets)
+
+    chunks = []
+    chunk_start = 0
+    while chunk_start < number_of_words:
+        chunk_end = bisect.bisect_right(
+            words_prefix_tokens, words_prefix_tokens[chunk_start] + max_tokens_per_chunk, lo=chunk_start + 1
+        ) - 1
+        # A single word longer than the limit can't be split, so it becomes a separate chunk
+        chunk_end = max(chunk_end, chunk_start + 1)
+
+        if snap_to_sentence_boundary and chunk_end < number_of_words:
+            chunk_end = _snap_chunk_end_to_sentence_boundary(
+                text, words_offsets, words_prefix_tokens, chunk_start, chunk_end
+            )
+
+        while True:
+            chunk = text[words_offsets[chunk_start][0]:words_offsets[chunk_end - 1][1]].strip()
+            chunk_tokens = int(llm.get_num_tokens(prompt_template.format(text=chunk))) - (
+                max_token_limit - max_tokens_per_chunk
+            )
+            if chunk_tokens <= max_tokens_per_chunk or chunk_end == chunk_start + 1:
+                break
+            # The words are taken in the proportion of the allowed to the actual number of tokens of the chunk
+            estimated_chunk_tokens = words_prefix_tokens[chunk_end] - words_prefix_tokens[chunk_start]
+            chunk_end = max(min(
+                bisect.bisect_right(
+                    words_prefix_tokens,
+                    words_prefix_tokens[chunk_start] + estimated_chunk_tokens * max_tokens_per_chunk // chunk_tokens,
+                    lo=chunk_start + 1
+                ) - 1,
+                chunk_end - 1
+            ), chunk_start + 1)
+
+        chunks.append(Document(page_content=chunk))
+        if chunk_end == number_of_words:
+            break
+
+        next_chunk_start = bisect.bisect_left(
+            words_prefix_tokens, words_prefix_tokens[chunk_end] - overlap_size, lo=chunk_start + 1, hi=chunk_end
+        )
+        chunk_start = next_chunk_start
+
+    return chunks
+
+
+def _get_number_of_tokens_left_for_text(
+        llm: BaseLanguageModel,
+        prompt_template: BasePromptTemplate,
+        max_token_limit: int
+) -> int:
+    # We add `text="text"` and not empty string, because the empty string may be tokenized together with the whitespaces
+    # that are around it in the prompt. But when joining the actual `{text}` with the prompt instructions we get one
+    # additional token
+    num_tokens_prompt_wo_text = int(llm.get_num_tokens(prompt_template.format(text="text")))
+    num_tokens_left_for_text = max_token_limit - num_tokens_prompt_wo_text
+    if num_tokens_left_for_text <= 0:
+        raise ValueError("Prompt instruction (without the actual text) is longer than the allowed model input length")
+    return num_tokens_left_for_text
 
-    overlap_left = overlap_size // 2
-    overlap_right = overlap_size - overlap_left
-    data_left_half = " ".join(words[:middle_word_index + overlap_left])
-    data_right_half = " ".join(words[middle_word_index - overlap_right:])
 
+def _get_words_offsets_and_prefix_tokens(
+        llm: BaseLanguageModel,
+        text: str
+) -> Tuple[List[Tuple[int, int]], List[int]]:
+    words_matches = list(_WORD_WITH_PRECEDING_WHITESPACES_PATTERN.finditer(text))
+    words_tokens = TokenCounter(count_tokens=llm.get_num_tokens).count_batch(
+        [word_match.group() for word_match in words_matches]
+    )
     return (
-            split_text_to_max_size(llm=llm, prompt_template=prompt_template, text=data_left_half,
-                                   model_total_max_tokens=model_total_max_tokens, max_output_tokens=max_output_tokens)
-            + split_text_to_max_size(llm=llm, prompt_template=prompt_template, text=data_right_half,
-                                     model_total_max_tokens=model_total_max_tokens, max_output_tokens=max_output_tokens)
+        [word_match.span() for word_match in words_matches],
+        [0] + list(itertools.accumulate(words_tokens))
     )
 
 
+def _snap_chunk_end_to_sentence_boundary(
+        text: str,
+        words_offsets: List[Tuple[int, int]],
+        words_prefix_tokens: List[int],
+        chunk_start: int,
+        chunk_end: int
+) -> int:
+    min_chunk_tokens = (words_prefix_tokens[chunk_end] - words_prefix_tokens[chunk_start]) / 2
+    sentence_end = None
+    for word_index in range(chunk_end, chunk_start, -1):
+        if words_prefix_tokens[word_index] - words_prefix_tokens[chunk_start] < min_chunk_tokens:
+            break
+        next_word = text[words_offsets[word_index][0]:words_offsets[word_index][1]]
+        if "\n\n" in next_word[:len(next_word) - len(next_word.lstrip())]:
+            return word_index
+        if sentence_end is None and text[words_offsets[word_index - 1][1] - 1] in _SENTENCE_END_CHARACTERS:
+            sentence_end = word_index
+    return sentence_end or chunk_end
+
+
 def get_max_allowed_number_of_tokens(model_total_max_tokens: int, max_output_tokens: int) -> int:
     buffer = 50  # for things like BOS, EOS and other unexpected things
     return model_total_max_tokens - max_output_tokens - buffer
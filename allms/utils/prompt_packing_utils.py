@@ -0,0 +1,82 @@
+import typing
+from functools import lru_cache
+
+from langchain_core.prompts.prompt import PromptTemplate
+from pydantic import BaseModel, Field, create_model
+
+from allms.constants.prompt import PromptConstants
+from allms.domain.input_data import InputData
+
+_PACKED_TASK_INSTRUCTION = (
+    "The task above is described for a single example, where the values in curly braces are placeholders. Perform "
+    "the task independently for each of the examples below. Each example consists of its key and the values of the "
+    "placeholders. Return one output for every key."
+)
+
+
+@lru_cache(maxsize=None)
+def get_packed_output_data_model_class(
+        output_data_model_class: typing.Type[BaseModel]
+) -> typing.Type[BaseModel]:
+    """Creates (once per class) the model of a keyed list of `output_data_model_class` outputs."""
+    packed_output_class = create_model(
+        f"Packed{output_data_model_class.__name__}",
+        key=(str, Field(description="Key of the example")),
+        output=(output_data_model_class, Field(description="Output for the example"))
+    )
+    return create_model(
+        f"Packed{output_data_model_class.__name__}List",
+        outputs=(typing.List[packed_output_class], Field(description="Outputs for all the examples"))
+    )
+
+
+def build_packed_prompt(
+        prompt: str,
+        input_variables: typing.Iterable[str],
+        format_instructions: typing.Optional[str] = None
+) -> str:
+    """
+    Returns the template of a prompt for many examples. The task from `prompt` is stated once, with its input variables
+    left as placeholders, and it's followed by the examples passed in the `PACKED_EXAMPLES` variable. If provided,
+    `format_instructions` are added at the end, for the models that don't get them injected into the prompt.
+    """
+    task = PromptTemplate.from_template(prompt).format(**{variable: f"{{{variable}}}" for variable in input_variables})
+    packed_prompt = f"{_escape_braces(task)}\n\n{_PACKED_TASK_INSTRUCTION}\n\n{{{PromptConstants.PACKED_EXAMPLES}}}"
+    if format_instructions is not None:
+        packed_prompt += f"{PromptConstants.OUTPUT_DATA_MODEL_CLASS_SEPARATOR}{_escape_braces(format_instructions)}"
+    return packed_prompt
+
+
+def _escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def render_packed_example(key: str, input_data: InputData) -> str:
+    values = "\n".join(f"{variable}: {value}" for variable, value in input_data.input_mappings.items())
+    return f"### Example {key}\n{values}\n"
+
+
+def pack_examples(
+        numbers_of_tokens: typing.Sequence[int],
+        max_number_of_tokens: int,
+        max_examples_per_request: int
+) -> typing.List[typing.List[int]]:
+    """
+    Greedily groups consecutive examples, so that every group has at most `max_examples_per_request` examples and at
+    most `max_number_of_tokens` tokens in total. An example exceeding the limit on its own is put in a separate group.
+    """
+    packs: typing.List[typing.List[int]] = []
+    current_pack: typing.List[int] = []
+    current_number_of_tokens = 0
+    for example_index, number_of_tokens in enumerate(numbers_of_tokens):
+        if current_pack and (
+                current_number_of_tokens + number_of_tokens > max_number_of_tokens
+                or len(current_pack) == max_examples_per_request
+        ):
+            packs.append(current_pack)
+            current_pack, current_number_of_tokens = [], 0
+        current_pack.append(example_index)
+        current_number_of_tokens += number_of_tokens
+    if current_pack:
+        packs.append(current_pack)
+    return packs
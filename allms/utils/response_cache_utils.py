@@ -0,0 +1,127 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+import typing
+import zlib
+from pathlib import Path
+
+from allms.defaults.response_cache import ResponseCacheDefaults
+from allms.domain.response import ResponseData
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Persistent, SQLite-backed cache of model responses. Values are stored zlib-compressed together with the token
+    counts of the response. Entries older than `ttl_s` are treated as missing, and when the total size of the stored
+    values exceeds `max_size_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(
+            self,
+            path: typing.Union[str, Path],
+            ttl_s: typing.Optional[float] = ResponseCacheDefaults.TTL_S,
+            max_size_bytes: typing.Optional[int] = ResponseCacheDefaults.MAX_SIZE_BYTES,
+            compression_level: int = ResponseCacheDefaults.COMPRESSION_LEVEL
+    ) -> None:
+        self._ttl_s = ttl_s
+        self._max_size_bytes = max_size_bytes
+        self._compression_level = compression_level
+        self._hits = 0
+        self._misses = 0
+
+        self._connection = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._size_bytes = self._connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses"
+        ).fetchone()[0]
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    @staticmethod
+    def build_key(**key_params: typing.Any) -> str:
+        serialized_params = json.dumps(key_params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized_params.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> typing.Optional[ResponseData]:
+        row = self._connection.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+
+        if row is None or self._is_expired(created_at=row[1], now=now):
+            self._misses += 1
+            return None
+
+        self._hits += 1
+        self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        return ResponseData.model_validate_json(zlib.decompress(row[0]))
+
+    def set(self, key: str, response_data: ResponseData) -> None:
+        value = zlib.compress(
+            response_data.model_dump_json(exclude={"input_data"}).encode("utf-8"),
+            self._compression_level
+        )
+        now = time.time()
+
+        previous_row = self._connection.execute("SELECT LENGTH(value) FROM responses WHERE key = ?", (key,)).fetchone()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+            (key, value, now, now)
+        )
+        self._size_bytes += len(value) - (previous_row[0] if previous_row else 0)
+        self._evict_if_too_large()
+
+    def clear(self) -> None:
+        self._connection.execute("DELETE FROM responses")
+        self._size_bytes = 0
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self._ttl_s is not None and now - created_at > self._ttl_s
+
+    def _evict_if_too_large(self) -> None:
+        if self._max_size_bytes is None:
+            return
+
+        if self._ttl_s is not None and self._size_bytes > self._max_size_bytes:
+            self._connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self._ttl_s,))
+            self._size_bytes = self._connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM responses"
+            ).fetchone()[0]
+
+        while self._size_bytes > self._max_size_bytes:
+            least_recently_used_rows = self._connection.execute(
+                "SELECT key, LENGTH(value) FROM responses ORDER BY accessed_at LIMIT ?",
+                (ResponseCacheDefaults.EVICTION_BATCH_SIZE,)
+            ).fetchall()
+            if not least_recently_used_rows:
+                self._size_bytes = 0
+                return
+
+            keys_to_evict = []
+            for key, value_size in least_recently_used_rows:
+                keys_to_evict.append((key,))
+                self._size_bytes -= value_size
+                if self._size_bytes <= self._max_size_bytes:
+                    break
+            self._connection.executemany("DELETE FROM responses WHERE key = ?", keys_to_evict)
+            logger.debug(f"Evicted {len(keys_to_evict)} entries from the response cache")
@@ -1,17 +1,65 @@
+import json
 import re
 import typing
 
 from langchain.output_parsers import PydanticOutputParser
 from langchain.schema import OutputParserException
-from pydantic import ValidationError
+from pydantic import BaseModel, ValidationError
 
 from allms.domain.response import ResponseData, ResponseParsingOutput
 
+_CODE_FENCE_PATTERN = re.compile(r"```[^\n`]*\n?(.*?)```", re.DOTALL)
+# Whole JSON strings (with escaped characters) are matched as single tokens, so the braces inside them are skipped.
+# A lone quote is only matched when a string is never closed.
+_JSON_TOKENS_PATTERN = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]"]', re.DOTALL)
+# Bounds the number of scanned start positions, so that extraction stays linear in the length of the response
+_MAX_JSON_CANDIDATE_START_POSITIONS = 8
+_CLOSING_CHARACTERS = {"{": "}", "[": "]"}
+
+
+def iterate_json_candidates(text: str) -> typing.Iterator[str]:
+    """
+    Yields the balanced `{...}` substrings of `text`, starting with the ones inside Markdown code fences. Braces and
+    brackets inside JSON strings (including escaped quotes) are skipped.
+    """
+    for code_block in _CODE_FENCE_PATTERN.findall(text):
+        yield from _iterate_balanced_objects(code_block)
+    yield from _iterate_balanced_objects(text)
+
+
+def _iterate_balanced_objects(text: str) -> typing.Iterator[str]:
+    start = text.find("{")
+    for _ in range(_MAX_JSON_CANDIDATE_START_POSITIONS):
+        if start == -1:
+            return
+        end = _find_balanced_object_end(text, start)
+        if end is not None:
+            yield text[start:end]
+        start = text.find("{", start + 1)
+
+
+def _find_balanced_object_end(text: str, start: int) -> typing.Optional[int]:
+    expected_closing_characters: typing.List[str] = []
+    for match in _JSON_TOKENS_PATTERN.finditer(text, start):
+        character = text[match.start()]
+        if character == '"':
+            if match.end() - match.start() == 1:
+                return None
+            continue
+        if character in _CLOSING_CHARACTERS:
+            expected_closing_characters.append(_CLOSING_CHARACTERS[character])
+        elif character != expected_closing_characters.pop():
+            # A `]` closing a `{` (or the other way round) means that the object isn't balanced
+            return None
+        elif not expected_closing_characters:
+            return match.end()
+    return None
+
 
 class ResponseParser:
     def __init__(self, parser: PydanticOutputParser) -> None:
-        self._json_pattern = re.compile(r"{.*?}", re.DOTALL)
         self._parser = parser
+        self._output_data_model_class: typing.Type[BaseModel] = parser.pydantic_object
 
     def _clean_extracted_json(self, extracted_json: str) -> str:
         json_without_newlines = extracted_json.replace("\\n", "")
@@ -19,62 +67,84 @@ class ResponseParser:
 
         return json_without_backslashes
 
-    def _extract_json_from_response(self, model_response_data: ResponseData) -> str:
-        search_results = self._json_pattern.findall(model_response_data.response)
-        
-        if len(search_results) == 0:
-            return model_response_data.response
+    def _validate_json(self, candidate: str) -> BaseModel:
+        try:
+            return self._output_data_model_class.model_validate_json(candidate)
+        except ValidationError as validation_error:
+            if validation_error.errors()[0]["type"] != "json_invalid":
+                raise
+            strict_validation_error = validation_error
+        # Models often put raw newlines or tabs inside strings, which only the non-strict decoder accepts
+        try:
+            json_object = json.loads(candidate, strict=False)
+        except json.JSONDecodeError as json_decode_error:
+            raise ValueError(
+                f"Invalid json output: {json_decode_error}\n{strict_validation_error}"
+            ) from strict_validation_error
+        return self._output_data_model_class.model_validate(json_object)
 
-        return self._clean_extracted_json(search_results[0])
-        
     def _parse_response(
-        self, 
+        self,
         model_response_data: ResponseData
     ) -> ResponseParsingOutput:
-        raw_response = self._extract_json_from_response(model_response_data)
+        raw_response = model_response_data.response or ""
+        first_failed_candidate, first_error = None, None
 
-        try:
-            return ResponseParsingOutput(
-                response=self._parser.parse(raw_response), 
-                error_message=None
-            )
-        except OutputParserException as output_parser_exception:
-            return ResponseParsingOutput(
-                response=None, 
-                error_message=f"""
-                    An OutputParserException has occurred for the model response: {raw_response}
-                    The exception message: {output_parser_exception}
-                    """
-            )
-        except ValidationError as validation_error:
-            return ResponseParsingOutput(
-                response=None,
-                error_message=f"""
-                    A ValidationError has occurred for the model response: {model_response_data.response}
-                    The exception message: {validation_error}
-                    """
-            )
-
-        
-    def parse_model_output(
-        self, 
-        model_responses_data: typing.List[ResponseData]
-    ) -> typing.List[ResponseData]:
-        parsed_responses = []
+        stripped_response = raw_response.strip()
+        if stripped_response.startswith("{") and stripped_response.endswith("}"):
+            # Fast path for responses that are just the JSON object
+            try:
+                return ResponseParsingOutput(response=self._validate_json(stripped_response), error_message=None)
+            except ValueError:
+                pass
 
-        for model_response_data in model_responses_data:
-            if not model_response_data.error:
-                response_with_error = self._parse_response(model_response_data)
+        cleaned_response = self._clean_extracted_json(raw_response)
+        if cleaned_response == raw_response:
+            texts_to_search = [raw_response]
+        elif '\\"' in raw_response:
+            # The whole JSON was escaped by the model, so its cleaned version is much more likely to be parsed
+            texts_to_search = [cleaned_response, raw_response]
+        else:
+            texts_to_search = [raw_response, cleaned_response]
+        for text in texts_to_search:
+            for candidate in iterate_json_candidates(text):
+                try:
+                    return ResponseParsingOutput(response=self._validate_json(candidate), error_message=None)
+                except ValueError as error:
+                    if first_error is None:
+                        # Only the message is kept, as the exception would keep the frames of the whole loop alive
+                        first_failed_candidate, first_error = candidate, str(error)
 
-                parsed_responses.append(ResponseData(
-                    input_data=model_response_data.input_data,
-                    response=response_with_error.response,
-                    error=response_with_error.error_message,
-                    number_of_prompt_tokens=model_response_data.number_of_prompt_tokens,
-                    number_of_generated_tokens=model_response_data.number_of_generated_tokens
+        if first_error is None:
+            first_failed_candidate, first_error = raw_response, "No JSON object was found in the model response"
+        output_parser_exception = OutputParserException(
+            f"Failed to parse {self._output_data_model_class.__name__} from completion {first_failed_candidate}. "
+            f"Got: {first_error}"
+        )
+        return ResponseParsingOutput(
+            response=None,
+            error_message=f"""
+                An OutputParserException has occurred for the model response: {first_failed_candidate}
+                The exception message: {output_parser_exception}
+                """
+        )
 
-                ))
-            else:
-                parsed_responses.append(model_response_data)
+    def parse_response_data(self, model_response_data: ResponseData) -> ResponseData:
+        if model_response_data.error:
+            return model_response_data
 
-        return parsed_responses
\ No newline at end of file
+        response_with_error = self._parse_response(model_response_data)
+
+        return ResponseData(
+            input_data=model_response_data.input_data,
+            response=response_with_error.response,
+            error=response_with_error.error_message,
+            number_of_prompt_tokens=model_response_data.number_of_prompt_tokens,
+            number_of_generated_tokens=model_response_data.number_of_generated_tokens
+        )
+
+    def parse_model_output(
+        self,
+        model_responses_data: typing.List[ResponseData]
+    ) -> typing.List[ResponseData]:
+        return [self.parse_response_data(model_response_data) for model_response_data in model_responses_data]
@@ -0,0 +1,117 @@
+import re
+import typing
+from collections import OrderedDict
+
+from langchain_core.prompts import BasePromptTemplate
+
+from allms.defaults.token_counting import TokenCountingDefaults
+from allms.domain.input_data import InputData
+
+_VARIABLE_PLACEHOLDER_PATTERN = re.compile("\x00([0-9]+)\x00")
+# A position right after a single newline surrounded by non-whitespace characters is a pre-tokenization boundary for
+# the regex-based BPE tokenizers (tiktoken, GPT-2), so the text before and after it can be tokenized separately without
+# changing the total number of tokens. The exception is "/" after the newline, which the `o200k_base` encoding keeps
+# in the same piece as the punctuation and the newlines before it.
+_TOKENIZATION_BOUNDARY_PATTERN = re.compile(r"(?<=[^\s\x00]\n)(?=[^\s\x00/])")
+
+
+class TokenCounter:
+    def __init__(
+            self,
+            count_tokens: typing.Callable[[str], int],
+            count_tokens_batch: typing.Optional[typing.Callable[[typing.List[str]], typing.List[int]]] = None,
+            cache_size: int = TokenCountingDefaults.CACHE_SIZE
+    ) -> None:
+        self._count_tokens = count_tokens
+        self._count_tokens_batch = count_tokens_batch or (lambda texts: list(map(count_tokens, texts)))
+        self._cache_size = cache_size
+        self._cache: typing.OrderedDict[str, int] = OrderedDict()
+
+    def count(self, text: str) -> int:
+        return self.count_batch([text])[0]
+
+    def count_batch(self, texts: typing.List[str], use_cache: bool = True) -> typing.List[int]:
+        if not use_cache:
+            return self._count_tokens_batch(texts) if texts else []
+        texts_to_count = list({text: None for text in texts if text not in self._cache})
+        counted_tokens = dict(zip(texts_to_count, self._count_tokens_batch(texts_to_count))) if texts_to_count else {}
+
+        tokens_numbers = []
+        for text in texts:
+            tokens_number = counted_tokens[text] if text in counted_tokens else self._cache[text]
+            self._cache[text] = tokens_number
+            self._cache.move_to_end(text)
+            tokens_numbers.append(tokens_number)
+
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+        return tokens_numbers
+
+
+class PromptTokenCounter:
+    """
+    Counts the number of tokens of the prompts rendered from `prompt_template`, in batches. If `count_by_segments` is
+    set, the rendered template is split into segments on tokenization boundaries. The segments without any input
+    variables are tokenized only once, and for each example only the segments containing the input variables are
+    tokenized - with the LRU cache of the `token_counter`. The sum of the segments' counts is equal to the count of the
+    whole prompt only for the regex-based BPE tokenizers (tiktoken, GPT-2), so for the other ones (e.g. SentencePiece)
+    the whole rendered prompts are tokenized.
+    """
+
+    def __init__(
+            self,
+            prompt_template: BasePromptTemplate,
+            input_variables: typing.List[str],
+            token_counter: TokenCounter,
+            count_by_segments: bool = False
+    ) -> None:
+        self._prompt_template = prompt_template
+        self._input_variables = input_variables
+        self._token_counter = token_counter
+        self._count_by_segments = count_by_segments
+        if not count_by_segments:
+            return
+
+        template_with_placeholders = prompt_template.format_prompt(**{
+            input_variable: f"\x00{variable_index}\x00" for variable_index, input_variable in enumerate(input_variables)
+        }).to_string()
+
+        static_segments = []
+        self._variable_segments: typing.List[typing.List[typing.Union[str, int]]] = []
+        for segment in _TOKENIZATION_BOUNDARY_PATTERN.split(template_with_placeholders):
+            if _VARIABLE_PLACEHOLDER_PATTERN.search(segment):
+                self._variable_segments.append([
+                    int(part) if part_index % 2 else part
+                    for part_index, part in enumerate(_VARIABLE_PLACEHOLDER_PATTERN.split(segment))
+                ])
+            elif segment:
+                static_segments.append(segment)
+
+        self._static_tokens_number = sum(token_counter.count_batch(static_segments)) if static_segments else 0
+
+    def count_batch(self, input_data: typing.List[InputData]) -> typing.List[int]:
+        if not self._count_by_segments:
+            # Whole prompts are rarely repeated, so they aren't kept in the cache
+            return self._token_counter.count_batch(
+                [self._prompt_template.format_prompt(**data.input_mappings).to_string() for data in input_data],
+                use_cache=False
+            )
+        rendered_segments = [
+            self._render_segment(segment, data) for data in input_data for segment in self._variable_segments
+        ]
+        segments_tokens_numbers = self._token_counter.count_batch(rendered_segments) if rendered_segments else []
+
+        number_of_segments = len(self._variable_segments)
+        return [
+            self._static_tokens_number + sum(
+                segments_tokens_numbers[data_index * number_of_segments:(data_index + 1) * number_of_segments]
+            )
+            for data_index in range(len(input_data))
+        ]
+
+    def _render_segment(self, segment: typing.List[typing.Union[str, int]], input_data: InputData) -> str:
+        return "".join(
+            input_data.input_mappings[self._input_variables[part]] if isinstance(part, int) else part
+            for part in segment
+        )
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of ResponseParser: parse throughput and success rate on synthetic model responses in the formats
+models return in practice (plain JSON, JSON surrounded by text, code fences, nested objects, escaped JSON).
+
+Usage, from the root of the repository: python -m benchmarks.response_parsing_benchmark [number_of_responses]
+"""
+import json
+import random
+import sys
+import time
+import typing
+
+from langchain.output_parsers import PydanticOutputParser
+
+from allms.domain.prompt_dto import AggregateOutputClass
+from allms.domain.response import ResponseData
+from allms.utils.response_parsing_utils import ResponseParser
+
+
+def generate_response(rng: random.Random) -> typing.Tuple[str, AggregateOutputClass]:
+    """Returns the model response together with the output that should be parsed from it."""
+    output = json.dumps({
+        "summaries": [
+            {"summary": f"Summary {rng.randint(0, 10 ** 6)} with {{braces}}"},
+            {"keywords": [f"keyword {idx}" for idx in range(rng.randint(1, 10))]}
+        ]
+    })
+    expected_output = AggregateOutputClass.model_validate_json(output)
+    response_format = rng.randrange(5)
+    if response_format == 0:
+        return output, expected_output
+    if response_format == 1:
+        return f"Sure! Here's the JSON you wanted: {output} Have a nice day!", expected_output
+    if response_format == 2:
+        return f"Here it is:\n```json\n{json.dumps(json.loads(output), indent=2)}\n```", expected_output
+    if response_format == 3:
+        return json.dumps(output)[1:-1], expected_output
+    return output.replace("Summary", "Summary\n"), AggregateOutputClass.model_validate(
+        json.loads(output.replace("Summary", "Summary\n"), strict=False)
+    )
+
+
+def main(number_of_responses: int) -> None:
+    rng = random.Random(0)
+    responses, expected_outputs = zip(*(generate_response(rng) for _ in range(number_of_responses)))
+    responses = [ResponseData(response=response) for response in responses]
+    response_parser = ResponseParser(PydanticOutputParser(pydantic_object=AggregateOutputClass))
+
+    start_time = time.perf_counter()
+    parsed_responses = response_parser.parse_model_output(responses)
+    elapsed_time_s = time.perf_counter() - start_time
+
+    # A response counts as parsed only if it's equal to the expected output, not just if it has no error
+    number_of_parsed_responses = sum(
+        response.response == expected_output
+        for response, expected_output in zip(parsed_responses, expected_outputs)
+    )
+    print(f"Parsed {number_of_responses} responses in {elapsed_time_s:.2f} s "
+          f"({number_of_responses / elapsed_time_s:,.0f} responses/s)")
+    print(f"Success rate: {number_of_parsed_responses / number_of_responses:.2%}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
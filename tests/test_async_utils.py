@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from allms.utils.async_utils import map_as_completed
+
+
+class TestMapAsCompleted:
+
+    def test_number_of_in_flight_items_is_bounded_by_number_of_workers(self):
+        # GIVEN
+        num_workers = 4
+        in_flight, max_in_flight, max_consumed_ahead = 0, 0, 0
+        consumed_items, yielded_results = 0, 0
+
+        def items():
+            nonlocal consumed_items
+            for item in range(100):
+                consumed_items += 1
+                yield item
+
+        async def function(item: int) -> int:
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            return item * 2
+
+        async def consume():
+            nonlocal yielded_results, max_consumed_ahead
+            results = {}
+            async for item_index, result in map_as_completed(function, items(), num_workers=num_workers):
+                yielded_results += 1
+                max_consumed_ahead = max(max_consumed_ahead, consumed_items - yielded_results)
+                results[item_index] = result
+            return results
+
+        # WHEN
+        results = asyncio.new_event_loop().run_until_complete(consume())
+
+        # THEN
+        assert results == {item: item * 2 for item in range(100)}
+        assert max_in_flight <= num_workers
+        assert max_consumed_ahead <= 4 * num_workers
+
+    def test_exception_raised_by_function_is_propagated(self):
+        # GIVEN
+        async def function(item: int) -> int:
+            if item == 3:
+                raise ValueError("Some error")
+            return item
+
+        async def consume():
+            return [result async for result in map_as_completed(function, range(10), num_workers=2)]
+
+        # WHEN & THEN
+        with pytest.raises(ValueError, match="Some error"):
+            asyncio.new_event_loop().run_until_complete(consume())
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import urllib.error
+from unittest.mock import patch
+
+import pytest
+import respx
+from httpx import Response
+from langchain_community.chat_models.azureml_endpoint import LlamaChatContentFormatter
+from langchain_core.messages import HumanMessage
+
+from allms.domain.configuration import AzureSelfDeployedConfiguration
+from allms.domain.input_data import InputData
+from allms.models import AzureLlama2Model
+from allms.models.azure_base import AzureMLOnlineEndpointAsync
+
+ENDPOINT_URL = "https://dummy-endpoint.westeurope.inference.ml.azure.com/score"
+
+
+def get_endpoint(**kwargs) -> AzureMLOnlineEndpointAsync:
+    return AzureMLOnlineEndpointAsync(
+        endpoint_api_key="dummy-api-key",
+        endpoint_url=ENDPOINT_URL,
+        model_kwargs={"max_new_tokens": 16},
+        content_formatter=LlamaChatContentFormatter(),
+        deployment_name="dummy-deployment",
+        **kwargs
+    )
+
+
+class TestAzureMLOnlineEndpointAsync:
+
+    def test_request_is_sent_with_async_client_and_response_is_parsed(self):
+        # GIVEN
+        endpoint = get_endpoint()
+        event_loop = asyncio.new_event_loop()
+
+        # WHEN
+        with respx.mock:
+            route = respx.post(ENDPOINT_URL).mock(return_value=Response(status_code=200, json={"output": " 4 "}))
+            result = event_loop.run_until_complete(endpoint.ainvoke([HumanMessage(content="2+2 is?")]))
+
+        # THEN
+        assert result.content == "4"
+        request = route.calls.last.request
+        assert request.headers["Authorization"] == "Bearer dummy-api-key"
+        assert request.headers["azureml-model-deployment"] == "dummy-deployment"
+        assert json.loads(request.content) == {
+            "input_data": {
+                "input_string": [{"role": "user", "content": "2+2 is?"}],
+                "parameters": {"max_new_tokens": 16}
+            }
+        }
+
+    def test_http_client_is_created_once_with_configured_limits(self):
+        # GIVEN
+        endpoint = get_endpoint(max_connections=10, max_keepalive_connections=5)
+        event_loop = asyncio.new_event_loop()
+
+        async def send_requests():
+            await asyncio.gather(*[endpoint.ainvoke([HumanMessage(content="2+2 is?")]) for _ in range(20)])
+
+        # WHEN
+        with respx.mock:
+            route = respx.post(ENDPOINT_URL).mock(return_value=Response(status_code=200, json={"output": "4"}))
+            event_loop.run_until_complete(send_requests())
+            http_client = endpoint._get_async_http_client()
+
+        # THEN
+        assert route.call_count == 20
+        assert http_client is endpoint._async_http_client
+        assert http_client._transport._pool._max_connections == 10
+        assert http_client._transport._pool._max_keepalive_connections == 5
+
+        event_loop.run_until_complete(endpoint.aclose())
+        assert endpoint._async_http_client is None
+
+    def test_error_response_raises_http_error(self):
+        # GIVEN
+        endpoint = get_endpoint()
+        event_loop = asyncio.new_event_loop()
+
+        # WHEN & THEN
+        with respx.mock:
+            respx.post(ENDPOINT_URL).mock(return_value=Response(status_code=424))
+            with pytest.raises(urllib.error.HTTPError) as error:
+                event_loop.run_until_complete(endpoint.ainvoke([HumanMessage(content="2+2 is?")]))
+
+        assert error.value.code == 424
+
+    @patch("allms.models.azure_base.AzureMLOnlineEndpointAsync.get_num_tokens")
+    def test_model_queries_endpoint_with_async_client(self, tokens_mock):
+        # GIVEN
+        tokens_mock.return_value = 1
+        model = AzureLlama2Model(
+            config=AzureSelfDeployedConfiguration(
+                api_key="dummy-api-key",
+                endpoint_url=ENDPOINT_URL,
+                deployment="dummy-deployment"
+            ),
+            event_loop=asyncio.new_event_loop()
+        )
+        input_data = [InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx)) for idx in range(3)]
+
+        # WHEN
+        with respx.mock:
+            route = respx.post(ENDPOINT_URL).mock(return_value=Response(status_code=200, json={"output": "Model output"}))
+            responses = model.generate("Some Dummy Prompt {text}", input_data)
+
+        # THEN
+        assert route.call_count == 3
+        assert [response.response for response in responses] == ["Model output"] * 3
+        assert [response.error for response in responses] == [None] * 3
+
+    @patch("allms.models.azure_base.AzureMLOnlineEndpointAsync.get_num_tokens")
+    def test_model_closes_http_client(self, tokens_mock):
+        # GIVEN
+        tokens_mock.return_value = 1
+        model = AzureLlama2Model(
+            config=AzureSelfDeployedConfiguration(
+                api_key="dummy-api-key",
+                endpoint_url=ENDPOINT_URL,
+                deployment="dummy-deployment"
+            ),
+            event_loop=asyncio.new_event_loop()
+        )
+        with respx.mock:
+            respx.post(ENDPOINT_URL).mock(return_value=Response(status_code=200, json={"output": "Model output"}))
+            model.generate("Some Dummy Prompt")
+        http_client = model._llm._async_http_client
+
+        # WHEN
+        model.close()
+
+        # THEN
+        assert http_client.is_closed
+        assert model._llm._async_http_client is None
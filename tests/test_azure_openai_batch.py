@@ -0,0 +1,169 @@
+import asyncio
+import json
+import typing
+
+import pytest
+import respx
+from httpx import Request, Response
+
+from allms.domain.configuration import AzureOpenAIConfiguration
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import SummaryOutputClass
+from allms.models import AzureOpenAIModel
+
+BASE_URL = "https://dummy-endpoint.openai.azure.com/openai"
+
+
+class BatchEndpointsStub:
+    """Local stub of the files and batches endpoints of the Azure OpenAI Batch API."""
+
+    def __init__(self, final_status: str = "completed", failing_ids: typing.Collection[str] = ()) -> None:
+        self.final_status = final_status
+        self.failing_ids = failing_ids
+        self.requests: typing.List[typing.Dict[str, typing.Any]] = []
+        self.number_of_polls = 0
+        self.files: typing.Dict[str, str] = {}
+
+    def register(self, router: respx.MockRouter) -> None:
+        router.post(url__startswith=f"{BASE_URL}/files").mock(side_effect=self.create_file)
+        router.post(url__startswith=f"{BASE_URL}/batches").mock(side_effect=self.create_batch)
+        router.get(url__startswith=f"{BASE_URL}/batches/batch-1").mock(side_effect=self.retrieve_batch)
+        router.get(url__regex=rf"{BASE_URL}/files/[\w-]+/content").mock(side_effect=self.get_file_content)
+
+    def create_file(self, request: Request) -> Response:
+        body = request.content.decode("utf-8")
+        self.requests = [json.loads(line) for line in body.splitlines() if line.startswith("{\"custom_id\"")]
+        return Response(status_code=200, json={
+            "id": "file-input", "object": "file", "bytes": len(body), "created_at": 0,
+            "filename": "batch_input.jsonl", "purpose": "batch", "status": "processed"
+        })
+
+    def create_batch(self, request: Request) -> Response:
+        assert json.loads(request.content)["input_file_id"] == "file-input"
+        return Response(status_code=200, json=self.get_batch("validating"))
+
+    def retrieve_batch(self, request: Request) -> Response:
+        self.number_of_polls += 1
+        return Response(status_code=200, json=self.get_batch("in_progress" if self.number_of_polls < 2 else None))
+
+    def get_file_content(self, request: Request) -> Response:
+        file_id = request.url.path.split("/")[-2]
+        return Response(status_code=200, text=self.files[file_id])
+
+    def get_batch(self, status: typing.Optional[str]) -> typing.Dict[str, typing.Any]:
+        batch = {
+            "id": "batch-1", "object": "batch", "endpoint": "/chat/completions", "input_file_id": "file-input",
+            "completion_window": "24h", "created_at": 0, "status": status or self.final_status,
+            "output_file_id": None, "error_file_id": None, "errors": None
+        }
+        if status is None and self.final_status == "completed":
+            successful_requests = [request for request in self.requests if request["custom_id"] not in self.failing_ids]
+            failed_requests = [request for request in self.requests if request["custom_id"] in self.failing_ids]
+            self.files["file-output"] = "\n".join(map(json.dumps, map(self.get_result, successful_requests)))
+            self.files["file-errors"] = "\n".join(map(json.dumps, map(self.get_error, failed_requests)))
+            batch.update(output_file_id="file-output", error_file_id="file-errors")
+        elif status is None:
+            batch["errors"] = {"object": "list", "data": [{"code": "invalid_file", "message": "Some batch error"}]}
+        return batch
+
+    @staticmethod
+    def get_result(request: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        user_message = request["body"]["messages"][-1]["content"]
+        return {
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "choices": [{
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": json.dumps({"summary": user_message[:21]})}
+                    }],
+                    "usage": {"prompt_tokens": 11, "completion_tokens": 7, "total_tokens": 18}
+                }
+            },
+            "error": None
+        }
+
+    @staticmethod
+    def get_error(request: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        return {
+            "custom_id": request["custom_id"],
+            "response": {"status_code": 400, "body": {"error": {"message": "Some request error"}}},
+            "error": None
+        }
+
+
+@pytest.fixture
+def model() -> AzureOpenAIModel:
+    return AzureOpenAIModel(
+        config=AzureOpenAIConfiguration(
+            api_key="dummy_api_key",
+            base_url="https://dummy-endpoint.openai.azure.com/",
+            api_version="dummy-api-version",
+            deployment="dummy-batch-deployment",
+            model_name="gpt-4"
+        ),
+        event_loop=asyncio.new_event_loop()
+    )
+
+
+class TestAzureOpenAIBatchMode:
+
+    def test_results_are_mapped_back_to_input_data_by_id(self, model):
+        # GIVEN
+        input_data = [InputData(input_mappings={"text": f"Some text {idx}"}, id=f"id-{idx}") for idx in range(3)]
+        batch_endpoints_stub = BatchEndpointsStub(failing_ids={"id-1"})
+
+        # WHEN
+        with respx.mock as router:
+            batch_endpoints_stub.register(router)
+            responses = model.generate_batch(
+                "Summarize {text}", input_data, output_data_model_class=SummaryOutputClass,
+                system_prompt="Some system prompt", poll_interval_s=0
+            )
+
+        # THEN
+        assert [request["custom_id"] for request in batch_endpoints_stub.requests] == ["id-0", "id-1", "id-2"]
+        first_request_body = batch_endpoints_stub.requests[0]["body"]
+        assert first_request_body["model"] == "dummy-batch-deployment"
+        assert [message["role"] for message in first_request_body["messages"]] == ["system", "user"]
+        assert first_request_body["messages"][1]["content"].startswith("Summarize Some text 0")
+        assert batch_endpoints_stub.number_of_polls == 2
+
+        assert [response.input_data for response in responses] == input_data
+        assert responses[0].response == SummaryOutputClass(summary="Summarize Some text 0")
+        assert (responses[0].number_of_prompt_tokens, responses[0].number_of_generated_tokens) == (11, 7)
+        assert responses[1].response is None
+        assert "Some request error" in responses[1].error
+        assert responses[2].response == SummaryOutputClass(summary="Summarize Some text 2")
+
+    def test_all_examples_get_error_if_batch_job_fails(self, model):
+        # GIVEN
+        input_data = [InputData(input_mappings={"text": f"Some text {idx}"}, id=str(idx)) for idx in range(2)]
+
+        # WHEN
+        with respx.mock as router:
+            BatchEndpointsStub(final_status="failed").register(router)
+            responses = model.generate_batch("Summarize {text}", input_data, poll_interval_s=0)
+
+        # THEN
+        assert [response.response for response in responses] == [None, None]
+        assert all("Batch job batch-1 failed: Some batch error" in response.error for response in responses)
+
+    def test_too_long_prompts_are_not_submitted(self, model):
+        # GIVEN
+        input_data = [
+            InputData(input_mappings={"text": "Some text"}, id="short"),
+            InputData(input_mappings={"text": "word " * 5000}, id="long")
+        ]
+        batch_endpoints_stub = BatchEndpointsStub()
+
+        # WHEN
+        with respx.mock as router:
+            batch_endpoints_stub.register(router)
+            responses = model.generate_batch("Summarize {text}", input_data, poll_interval_s=0)
+
+        # THEN
+        assert [request["custom_id"] for request in batch_endpoints_stub.requests] == ["short"]
+        assert responses[0].error is None
+        assert "Prompt is too long" in responses[1].error
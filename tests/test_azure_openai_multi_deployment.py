@@ -0,0 +1,189 @@
+import asyncio
+
+import pytest
+import respx
+from httpx import Response
+
+from allms.domain.configuration import AzureOpenAIConfiguration
+from allms.domain.input_data import InputData
+from allms.models import AzureOpenAIMultiDeploymentModel
+
+MODEL_RESPONSE = {
+    "choices": [{"message": {"content": "Some model output", "role": "assistant"}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+}
+
+
+def get_config(name: str) -> AzureOpenAIConfiguration:
+    return AzureOpenAIConfiguration(
+        api_key="dummy_api_key",
+        base_url=f"https://{name}.openai.azure.com/",
+        api_version="dummy-api-version",
+        deployment=f"{name}-deployment",
+        model_name="gpt-4"
+    )
+
+
+def get_completions_url(name: str) -> str:
+    return f"https://{name}.openai.azure.com/openai/deployments/{name}-deployment/chat/completions"
+
+
+class TestAzureOpenAIMultiDeploymentModel:
+
+    def test_requests_are_routed_to_least_loaded_deployment_relative_to_weights(self):
+        # GIVEN
+        model = AzureOpenAIMultiDeploymentModel(
+            configs=[get_config("first"), get_config("second")],
+            weights=[3.0, 1.0],
+            event_loop=asyncio.new_event_loop()
+        )
+        input_data = [InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx)) for idx in range(8)]
+
+        async def delayed_response(request):
+            await asyncio.sleep(0.05)
+            return Response(status_code=200, json=MODEL_RESPONSE)
+
+        # WHEN
+        with respx.mock:
+            first_route = respx.post(url__startswith=get_completions_url("first")).mock(side_effect=delayed_response)
+            second_route = respx.post(url__startswith=get_completions_url("second")).mock(side_effect=delayed_response)
+            responses = model.generate("Some Dummy Prompt {text}", input_data)
+
+        # THEN
+        assert [response.response for response in responses] == ["Some model output"] * 8
+        assert first_route.call_count == 6
+        assert second_route.call_count == 2
+
+        deployment_stats = model.get_deployment_stats()
+        assert [stats.number_of_successful_requests for stats in deployment_stats] == [6, 2]
+        assert [stats.number_of_in_flight_requests for stats in deployment_stats] == [0, 0]
+
+    def test_deployment_returning_rate_limit_error_is_taken_out_of_rotation(self):
+        # GIVEN
+        model = AzureOpenAIMultiDeploymentModel(
+            configs=[get_config("first"), get_config("second")],
+            weights=[10.0, 1.0],
+            event_loop=asyncio.new_event_loop()
+        )
+        input_data = [InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx)) for idx in range(5)]
+
+        # WHEN
+        with respx.mock:
+            first_route = respx.post(url__startswith=get_completions_url("first")).mock(
+                return_value=Response(status_code=429, headers={"retry-after": "60"}, json={"error": {}})
+            )
+            second_route = respx.post(url__startswith=get_completions_url("second")).mock(
+                return_value=Response(status_code=200, json=MODEL_RESPONSE)
+            )
+            first_batch_responses = model.generate("Some Dummy Prompt {text}", input_data)
+            number_of_first_batch_rate_limit_errors = first_route.call_count
+            second_batch_responses = model.generate("Some Dummy Prompt {text}", input_data)
+
+        # THEN
+        for responses in [first_batch_responses, second_batch_responses]:
+            assert [response.response for response in responses] == ["Some model output"] * 5
+            assert [response.error for response in responses] == [None] * 5
+        # Only the requests sent before the first rate limit error was received reach the first deployment
+        assert first_route.call_count == number_of_first_batch_rate_limit_errors
+        assert second_route.call_count == 10
+
+        first_deployment_stats, second_deployment_stats = model.get_deployment_stats()
+        assert first_deployment_stats.deployment == "https://first.openai.azure.com/first-deployment"
+        assert first_deployment_stats.number_of_rate_limit_errors == number_of_first_batch_rate_limit_errors
+        assert first_deployment_stats.number_of_successful_requests == 0
+        assert not first_deployment_stats.is_healthy
+        assert second_deployment_stats.number_of_successful_requests == 10
+        assert second_deployment_stats.is_healthy
+
+    def test_deployment_returning_server_error_fails_over_to_other_deployment(self):
+        # GIVEN
+        model = AzureOpenAIMultiDeploymentModel(
+            configs=[get_config("first"), get_config("second")],
+            event_loop=asyncio.new_event_loop()
+        )
+
+        # WHEN
+        with respx.mock:
+            respx.post(url__startswith=get_completions_url("first")).mock(
+                return_value=Response(status_code=503, json={"error": {}})
+            )
+            respx.post(url__startswith=get_completions_url("second")).mock(
+                return_value=Response(status_code=200, json=MODEL_RESPONSE)
+            )
+            response = model.generate("Some Dummy Prompt")[0]
+
+        # THEN
+        assert response.response == "Some model output"
+        assert [stats.number_of_server_errors for stats in model.get_deployment_stats()] == [1, 0]
+
+    def test_request_is_retried_after_cooldown_when_all_deployments_are_throttled(self):
+        # GIVEN
+        model = AzureOpenAIMultiDeploymentModel(
+            configs=[get_config("first"), get_config("second")],
+            event_loop=asyncio.new_event_loop()
+        )
+        rate_limit_response = Response(status_code=429, headers={"retry-after": "0.1"}, json={"error": {}})
+        success_response = Response(status_code=200, json=MODEL_RESPONSE)
+
+        # WHEN
+        with respx.mock:
+            first_route = respx.post(url__startswith=get_completions_url("first")).mock(
+                side_effect=[rate_limit_response, success_response]
+            )
+            second_route = respx.post(url__startswith=get_completions_url("second")).mock(
+                side_effect=[rate_limit_response, success_response]
+            )
+            response = model.generate("Some Dummy Prompt")[0]
+
+        # THEN
+        assert response.response == "Some model output"
+        assert response.error is None
+        assert first_route.call_count + second_route.call_count == 3
+        deployment_stats = model.get_deployment_stats()
+        assert [stats.number_of_rate_limit_errors for stats in deployment_stats] == [1, 1]
+        assert sum(stats.number_of_successful_requests for stats in deployment_stats) == 1
+
+    def test_request_fails_when_deployments_are_throttled_after_all_retries(self):
+        # GIVEN
+        model = AzureOpenAIMultiDeploymentModel(
+            configs=[get_config("first"), get_config("second")],
+            max_retries=2,
+            event_loop=asyncio.new_event_loop()
+        )
+
+        # WHEN
+        with respx.mock:
+            respx.post(url__startswith=get_completions_url("first")).mock(
+                return_value=Response(status_code=429, headers={"retry-after": "0"}, json={"error": {}})
+            )
+            respx.post(url__startswith=get_completions_url("second")).mock(
+                return_value=Response(status_code=429, headers={"retry-after": "0"}, json={"error": {}})
+            )
+            response = model.generate("Some Dummy Prompt")[0]
+
+        # THEN
+        assert response.response is None
+        assert response.error.startswith("RateLimitError")
+        assert [stats.number_of_rate_limit_errors for stats in model.get_deployment_stats()] == [3, 3]
+
+    def test_number_of_weights_has_to_match_number_of_configs(self):
+        # WHEN & THEN
+        with pytest.raises(ValueError):
+            AzureOpenAIMultiDeploymentModel(
+                configs=[get_config("first"), get_config("second")],
+                weights=[1.0],
+                event_loop=asyncio.new_event_loop()
+            )
+
+    def test_batch_jobs_need_single_deployment(self):
+        # GIVEN
+        model = AzureOpenAIMultiDeploymentModel(
+            configs=[get_config("first"), get_config("second")],
+            event_loop=asyncio.new_event_loop()
+        )
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+
+        # WHEN & THEN
+        with respx.mock:
+            with pytest.raises(ValueError, match="single batch deployment"):
+                model.generate_batch("Some Dummy Prompt {text}", input_data)
@@ -0,0 +1,132 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import SummaryOutputClass
+from allms.domain.response import ResponseData
+from allms.utils.checkpoint_utils import CheckpointJournal
+
+
+def get_response_data(example_id: str, error: str = None) -> ResponseData:
+    return ResponseData(
+        input_data=InputData(input_mappings={"text": f"text {example_id}"}, id=example_id),
+        response=None if error else f"response {example_id}",
+        number_of_prompt_tokens=1,
+        number_of_generated_tokens=1,
+        error=error
+    )
+
+
+class TestCheckpointJournal:
+
+    def test_only_successful_responses_are_completed(self, tmp_path):
+        # GIVEN
+        path = tmp_path / "checkpoint.jsonl"
+
+        # WHEN
+        with CheckpointJournal(path) as journal:
+            journal.append("1", get_response_data("1"))
+            journal.append("2", get_response_data("2", error="Some error"))
+
+        # THEN
+        reopened_journal = CheckpointJournal(path)
+        assert reopened_journal.completed_ids == {"1"}
+        assert [example_id for example_id, _ in reopened_journal.read_responses()] == ["1", "2"]
+        reopened_journal.close()
+
+    def test_incomplete_last_entry_is_discarded(self, tmp_path):
+        # GIVEN
+        path = tmp_path / "checkpoint.jsonl"
+        with CheckpointJournal(path) as journal:
+            journal.append("1", get_response_data("1"))
+        valid_size = path.stat().st_size
+        with open(path, "ab") as journal_file:
+            journal_file.write(path.read_bytes()[:-10])
+
+        # WHEN
+        with CheckpointJournal(path) as journal:
+            completed_ids = set(journal.completed_ids)
+            size_after_recovery = path.stat().st_size
+            journal.append("3", get_response_data("3"))
+            responses = list(journal.read_responses())
+
+        # THEN
+        assert completed_ids == {"1"}
+        assert size_after_recovery == valid_size
+        assert [(example_id, response.response) for example_id, response in responses] == [
+            ("1", "response 1"), ("3", "response 3")
+        ]
+        assert [json.loads(line)["id"] for line in path.read_text().splitlines()] == ["1", "3"]
+
+
+class TestGenerateWithCheckpoint:
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_generation_is_resumed_from_checkpoint(self, tokens_mock, chain_run_mock, models, tmp_path):
+        # GIVEN
+        tokens_mock.return_value = 1
+        input_data = [InputData(input_mappings={"text": f"text {idx}"}, id=str(idx)) for idx in range(4)]
+        prompt = "Some Dummy Prompt {text}"
+
+        def fail_for_second_example(**kwargs):
+            if kwargs["text"] == "text 1":
+                raise ValueError("Some error")
+            return json.dumps({"summary": f"summary of {kwargs['text']}"})
+
+        for model_name, model in models.items():
+            checkpoint_path = tmp_path / f"{model_name}.jsonl"
+            chain_run_mock.reset_mock()
+            chain_run_mock.side_effect = fail_for_second_example
+
+            # WHEN
+            first_run_responses = model.generate_with_checkpoint(
+                prompt, input_data[:3], checkpoint_path, output_data_model_class=SummaryOutputClass
+            )
+            chain_run_mock.reset_mock()
+            chain_run_mock.side_effect = lambda **kwargs: json.dumps({"summary": f"summary of {kwargs['text']}"})
+            second_run_responses = model.generate_with_checkpoint(
+                prompt, input_data, checkpoint_path, output_data_model_class=SummaryOutputClass
+            )
+
+            # THEN
+            assert [response.error is None for response in first_run_responses] == [True, False, True]
+            assert sorted(call.kwargs["text"] for call in chain_run_mock.call_args_list) == ["text 1", "text 3"]
+            assert [response.input_data.id for response in second_run_responses] == ["0", "1", "2", "3"]
+            assert [response.response for response in second_run_responses] == [
+                SummaryOutputClass(summary=f"summary of text {idx}") for idx in range(4)
+            ]
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_generation_is_resumed_for_prompt_without_symbolic_variables(
+            self, tokens_mock, chain_run_mock, models, tmp_path
+    ):
+        # GIVEN
+        tokens_mock.return_value = 1
+        chain_run_mock.return_value = "Some model output"
+        input_data = [InputData(input_mappings={}, id=str(idx)) for idx in range(3)]
+
+        for model_name, model in models.items():
+            checkpoint_path = tmp_path / f"{model_name}.jsonl"
+            chain_run_mock.reset_mock()
+
+            # WHEN
+            model.generate_with_checkpoint("Some Dummy Prompt", input_data[:2], checkpoint_path)
+            responses = model.generate_with_checkpoint("Some Dummy Prompt", input_data, checkpoint_path)
+
+            # THEN
+            assert chain_run_mock.call_count == 3
+            assert [response.response for response in responses] == ["Some model output"] * 3
+            with CheckpointJournal(checkpoint_path) as journal:
+                assert journal.completed_ids == {"0", "1", "2"}
+
+    def test_ids_of_input_data_have_to_be_unique(self, models, tmp_path):
+        # GIVEN
+        input_data = [InputData(input_mappings={"text": "text"}, id="1")] * 2
+
+        # WHEN & THEN
+        with pytest.raises(ValueError):
+            models["azure_open_ai"].generate_with_checkpoint("{text}", input_data, tmp_path / "checkpoint.jsonl")
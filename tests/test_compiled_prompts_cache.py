@@ -0,0 +1,48 @@
+from unittest.mock import patch
+
+from allms.defaults.general_defaults import GeneralDefaults
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import KeywordsOutputClass, SummaryOutputClass
+
+
+class TestCompiledPromptsCache:
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_compiled_prompt_is_reused_for_the_same_prompt(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.return_value = "{\"summary\": \"Some summary\"}"
+        tokens_mock.return_value = 1
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+        prompt = "Some Dummy Prompt {text}"
+
+        for model in models.values():
+            with patch.object(model, "_get_chain", wraps=model._get_chain) as get_chain_mock:
+                # WHEN
+                first_responses = model.generate(prompt, input_data, SummaryOutputClass)
+                second_responses = model.generate(prompt, input_data, SummaryOutputClass)
+                model.generate(prompt, input_data, KeywordsOutputClass)
+                model.generate(f"Other {prompt}", input_data, SummaryOutputClass)
+
+                # THEN
+                assert get_chain_mock.call_count == 3
+                assert first_responses == second_responses
+                assert second_responses[0].response == SummaryOutputClass(summary="Some summary")
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_number_of_compiled_prompts_is_bounded(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.return_value = "Some model output"
+        tokens_mock.return_value = 1
+        model = models["azure_open_ai"]
+        number_of_prompts = GeneralDefaults.COMPILED_PROMPTS_CACHE_SIZE + 10
+
+        # WHEN
+        for idx in range(number_of_prompts):
+            model.generate(f"Some Dummy Prompt {idx}")
+
+        # THEN
+        assert len(model._compiled_prompts) == GeneralDefaults.COMPILED_PROMPTS_CACHE_SIZE
+        assert ("Some Dummy Prompt 0", None, None, ()) not in model._compiled_prompts
+        assert (f"Some Dummy Prompt {number_of_prompts - 1}", None, None, ()) in model._compiled_prompts
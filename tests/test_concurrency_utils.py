@@ -0,0 +1,169 @@
+import asyncio
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+
+from allms.domain.input_data import InputData
+from allms.utils.concurrency_utils import AdaptiveConcurrencyLimiter, TokenRateLimiter
+
+
+class TestAdaptiveConcurrencyLimiter:
+
+    def test_limit_is_increased_additively_when_requests_succeed(self):
+        # GIVEN
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=10)
+
+        async def make_request():
+            async with limiter:
+                await asyncio.sleep(0)
+
+        async def make_requests():
+            await asyncio.gather(*[make_request() for _ in range(5)])
+
+        # WHEN
+        asyncio.new_event_loop().run_until_complete(make_requests())
+
+        # THEN
+        assert limiter.current_limit == 3
+        assert limiter.in_flight == 0
+
+    def test_limit_is_decreased_multiplicatively_and_requests_are_paused_on_rate_limit_error(self):
+        # GIVEN
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=8, pause_s=0.2)
+        request_start_times = []
+
+        async def make_request(raise_rate_limit_error: bool):
+            try:
+                async with limiter:
+                    request_start_times.append(asyncio.get_running_loop().time())
+                    await asyncio.sleep(0.01)
+                    if raise_rate_limit_error:
+                        raise ResourceExhausted("Quota exceeded")
+            except ResourceExhausted:
+                pass
+
+        async def make_requests():
+            await asyncio.gather(*[make_request(raise_rate_limit_error=True) for _ in range(3)])
+            await make_request(raise_rate_limit_error=False)
+
+        # WHEN
+        asyncio.new_event_loop().run_until_complete(make_requests())
+
+        # THEN
+        assert limiter.current_limit == 4
+        assert request_start_times[-1] - request_start_times[0] >= 0.15
+
+    def test_number_of_in_flight_requests_does_not_exceed_the_limit(self):
+        # GIVEN
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=3, max_limit=3)
+        max_in_flight = 0
+
+        async def make_request():
+            nonlocal max_in_flight
+            async with limiter:
+                max_in_flight = max(max_in_flight, limiter.in_flight)
+                await asyncio.sleep(0.001)
+
+        async def make_requests():
+            await asyncio.gather(*[make_request() for _ in range(50)])
+
+        # WHEN
+        asyncio.new_event_loop().run_until_complete(make_requests())
+
+        # THEN
+        assert max_in_flight == 3
+
+
+class TestTokenRateLimiter:
+
+    def test_requests_wait_when_tokens_budget_is_exhausted(self):
+        # GIVEN
+        rate_limiter = TokenRateLimiter(tokens_per_minute=6000)
+        event_loop = asyncio.new_event_loop()
+
+        # WHEN
+        start_time = time.monotonic()
+        event_loop.run_until_complete(rate_limiter.acquire(6000))
+        budget_exhausted_time = time.monotonic()
+        event_loop.run_until_complete(rate_limiter.acquire(20))
+        end_time = time.monotonic()
+
+        # THEN
+        assert budget_exhausted_time - start_time < 0.1
+        assert end_time - budget_exhausted_time >= 0.15
+
+    def test_refunded_tokens_can_be_reused_immediately(self):
+        # GIVEN
+        rate_limiter = TokenRateLimiter(tokens_per_minute=6000)
+        event_loop = asyncio.new_event_loop()
+
+        # WHEN
+        start_time = time.monotonic()
+        event_loop.run_until_complete(rate_limiter.acquire(6000))
+        rate_limiter.refund(3000)
+        event_loop.run_until_complete(rate_limiter.acquire(3000))
+
+        # THEN
+        assert time.monotonic() - start_time < 0.1
+
+    def test_requests_wait_when_requests_budget_is_exhausted(self):
+        # GIVEN
+        rate_limiter = TokenRateLimiter(requests_per_minute=300)
+        event_loop = asyncio.new_event_loop()
+
+        async def make_requests():
+            for _ in range(301):
+                await rate_limiter.acquire(1)
+
+        # WHEN
+        start_time = time.monotonic()
+        event_loop.run_until_complete(make_requests())
+
+        # THEN
+        assert time.monotonic() - start_time >= 0.15
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_model_reserves_prompt_and_output_tokens_and_refunds_unused_ones(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.return_value = "Some model output"
+        tokens_mock.return_value = 1
+
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            rate_limiter_mock = Mock(wraps=TokenRateLimiter(tokens_per_minute=10 ** 6))
+            model._rate_limiter = rate_limiter_mock
+
+            response = model.generate(prompt, input_data)[0]
+
+            rate_limiter_mock.acquire.assert_called_once_with(
+                response.number_of_prompt_tokens + model._max_output_tokens
+            )
+            rate_limiter_mock.refund.assert_called_once_with(
+                model._max_output_tokens - response.number_of_generated_tokens
+            )
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_model_refunds_reserved_output_tokens_on_unhandled_error(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.side_effect = RuntimeError("Some unexpected error")
+        tokens_mock.return_value = 1
+
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            rate_limiter_mock = Mock(wraps=TokenRateLimiter(tokens_per_minute=10 ** 6))
+            model._rate_limiter = rate_limiter_mock
+
+            with pytest.raises(RuntimeError):
+                model.generate(prompt, input_data)
+
+            rate_limiter_mock.refund.assert_called_once_with(model._max_output_tokens)
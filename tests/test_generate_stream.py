@@ -0,0 +1,74 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import SummaryOutputClass
+from allms.domain.response import ResponseData
+
+
+class TestGenerateStream:
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_generate_stream_yields_parsed_response_for_each_example(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.return_value = json.dumps({"summary": "This is the model output"})
+        tokens_mock.return_value = 1
+
+        input_data = [InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx)) for idx in range(5)]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            responses = list(model.generate_stream(prompt, input_data, SummaryOutputClass))
+
+            assert sorted(response.input_data.id for response in responses) == [data.id for data in input_data]
+            for response in responses:
+                assert isinstance(response, ResponseData)
+                assert response.response == SummaryOutputClass(summary="This is the model output")
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_generate_stream_yields_responses_in_completion_order(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        async def delayed_response(**kwargs):
+            await asyncio.sleep(0.1 if kwargs["text"] == "slow" else 0)
+            return kwargs["text"]
+
+        chain_run_mock.side_effect = delayed_response
+        tokens_mock.return_value = 1
+
+        input_data = [
+            InputData(input_mappings={"text": "slow"}, id="0"),
+            InputData(input_mappings={"text": "fast"}, id="1")
+        ]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            streamed_responses = list(model.generate_stream(prompt, input_data))
+            generated_responses = model.generate(prompt, input_data)
+
+            assert [response.response for response in streamed_responses] == ["fast", "slow"]
+            assert [response.response for response in generated_responses] == ["slow", "fast"]
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_agenerate_stream_can_be_consumed_asynchronously(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.return_value = "Some model output"
+        tokens_mock.return_value = 1
+
+        model = models["azure_open_ai"]
+
+        async def consume_stream():
+            return [response async for response in model.agenerate_stream("Some Dummy Prompt without input variable")]
+
+        # WHEN
+        responses = model._event_loop.run_until_complete(consume_stream())
+
+        # THEN
+        assert len(responses) == 1
+        assert responses[0].response == "Some model output"
+        assert responses[0].input_data is None
@@ -0,0 +1,246 @@
+import csv
+import gzip
+import json
+import typing
+
+import fsspec
+import pytest
+
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import SummaryOutputClass
+from allms.domain.response import ResponseData
+from allms.utils import io_utils
+
+
+class TestStreamingInputDataReaders:
+
+    def test_csv_is_streamed_in_chunks_of_input_data(self):
+        # GIVEN
+        expected_input_data = io_utils.load_csv_to_input_data("./tests/resources/test_input_data.csv")
+
+        # WHEN
+        chunks = list(io_utils.stream_csv_to_input_data("./tests/resources/test_input_data.csv", chunk_size=2))
+
+        # THEN
+        assert [len(chunk) for chunk in chunks[:-1]] == [2] * (len(chunks) - 1)
+        assert 0 < len(chunks[-1]) <= 2
+        assert [input_data for chunk in chunks for input_data in chunk] == expected_input_data
+
+    def test_readers_are_lazy(self, tmp_path):
+        # GIVEN
+        path = tmp_path / "input_data.jsonl"
+        path.write_text("\n".join(json.dumps({"id": idx, "text": f"text {idx}"}) for idx in range(10)) + "\n{broken")
+
+        # WHEN
+        chunks = io_utils.stream_jsonl_to_input_data(str(path), chunk_size=3)
+        first_chunk = next(chunks)
+
+        # THEN
+        assert [input_data.id for input_data in first_chunk] == ["0", "1", "2"]
+        with pytest.raises(json.JSONDecodeError):
+            list(chunks)
+
+    def test_jsonl_values_are_converted_to_strings_and_limit_is_applied(self, tmp_path):
+        # GIVEN
+        path = tmp_path / "input_data.jsonl.gz"
+        with gzip.open(path, "wt") as jsonl_file:
+            for idx in range(5):
+                jsonl_file.write(json.dumps({"id": idx, "text": f"text {idx}", "price": idx * 1.5}) + "\n\n")
+
+        # WHEN
+        chunks = list(io_utils.stream_jsonl_to_input_data(str(path), chunk_size=2, limit=3))
+
+        # THEN
+        assert chunks == [
+            [
+                InputData(input_mappings={"text": "text 0", "price": "0.0"}, id="0"),
+                InputData(input_mappings={"text": "text 1", "price": "1.5"}, id="1")
+            ],
+            [InputData(input_mappings={"text": "text 2", "price": "3.0"}, id="2")]
+        ]
+
+    def test_csv_is_streamed_from_remote_filesystem(self):
+        # GIVEN
+        with fsspec.open("memory://bucket/input_data.csv", "w") as csv_file:
+            csv_file.write("id,text\n1,\"first, text\"\n2,second text\n")
+
+        # WHEN
+        chunks = list(io_utils.stream_csv_to_input_data("memory://bucket/input_data.csv"))
+
+        # THEN
+        assert chunks == [[
+            InputData(input_mappings={"text": "first, text"}, id="1"),
+            InputData(input_mappings={"text": "second text"}, id="2")
+        ]]
+
+    def test_missing_values_are_read_as_empty_strings(self, tmp_path):
+        # GIVEN
+        csv_path = tmp_path / "input_data.csv"
+        csv_path.write_text("id,text,title\n1,,first title\n2,second text\n")
+        jsonl_path = tmp_path / "input_data.jsonl"
+        jsonl_path.write_text(json.dumps({"id": 1, "text": None, "title": "first title"}) + "\n")
+
+        # WHEN
+        csv_chunks = list(io_utils.stream_csv_to_input_data(str(csv_path)))
+        jsonl_chunks = list(io_utils.stream_jsonl_to_input_data(str(jsonl_path)))
+
+        # THEN
+        assert csv_chunks == [[
+            InputData(input_mappings={"text": "", "title": "first title"}, id="1"),
+            InputData(input_mappings={"text": "second text", "title": ""}, id="2")
+        ]]
+        assert jsonl_chunks == [[InputData(input_mappings={"text": "", "title": "first title"}, id="1")]]
+
+    def test_parquet_is_streamed_in_chunks_of_input_data(self, tmp_path):
+        # GIVEN
+        pa = pytest.importorskip("pyarrow")
+        pq = pytest.importorskip("pyarrow.parquet")
+
+        path = tmp_path / "input_data.parquet"
+        pq.write_table(
+            pa.table({"id": list(range(5)), "text": [f"text {idx}" for idx in range(5)]}),
+            path,
+            row_group_size=2
+        )
+
+        # WHEN
+        chunks = list(io_utils.stream_parquet_to_input_data(str(path), chunk_size=3))
+
+        # THEN
+        assert [[input_data.id for input_data in chunk] for chunk in chunks] == [["0", "1", "2"], ["3", "4"]]
+        assert chunks[0][0] == InputData(input_mappings={"text": "text 0"}, id="0")
+
+
+def get_responses(number_of_responses: int) -> typing.List[ResponseData]:
+    return [
+        ResponseData(
+            input_data=InputData(input_mappings={"text": f"text {idx}"}, id=str(idx)),
+            response=SummaryOutputClass(summary=f"summary {idx}") if idx % 2 == 0 else None,
+            number_of_prompt_tokens=10,
+            number_of_generated_tokens=5 if idx % 2 == 0 else 0,
+            error=None if idx % 2 == 0 else "Some error"
+        )
+        for idx in range(number_of_responses)
+    ]
+
+
+class TestResponseSinks:
+
+    def test_jsonl_sink_writes_buffered_responses(self, tmp_path):
+        # GIVEN
+        path = tmp_path / "responses.jsonl"
+        responses = get_responses(5)
+
+        # WHEN
+        with io_utils.JsonlResponseSink(str(path), buffer_size=2) as sink:
+            sink.write_many(responses[:3])
+            number_of_rows_written_before_flush = len(path.read_text().splitlines())
+            sink.write_many(responses[3:])
+
+        # THEN
+        assert number_of_rows_written_before_flush == 2
+        assert sink.number_of_written_rows == 5
+        rows = [json.loads(line) for line in path.read_text().splitlines()]
+        assert rows[0] == {
+            "text": "text 0",
+            "id": "0",
+            "response": {"summary": "summary 0"},
+            "number_of_prompt_tokens": 10,
+            "number_of_generated_tokens": 5,
+            "error": None
+        }
+        assert rows[1]["response"] is None
+        assert rows[1]["error"] == "Some error"
+        assert [row["id"] for row in rows] == ["0", "1", "2", "3", "4"]
+
+    def test_sink_flushes_after_flush_interval(self, tmp_path):
+        # GIVEN
+        path = tmp_path / "responses.jsonl"
+        sink = io_utils.JsonlResponseSink(str(path), buffer_size=100, flush_interval_s=0.0)
+
+        # WHEN
+        sink.write(get_responses(1)[0])
+
+        # THEN
+        assert len(path.read_text().splitlines()) == 1
+        sink.close()
+
+    def test_csv_sink_writes_responses_to_remote_filesystem(self):
+        # GIVEN
+        path = "memory://bucket/responses.csv"
+
+        # WHEN
+        with io_utils.CsvResponseSink(path, buffer_size=2) as sink:
+            sink.write_many(get_responses(3))
+
+        # THEN
+        with fsspec.open(path, "r") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        assert [row["id"] for row in rows] == ["0", "1", "2"]
+        assert json.loads(rows[0]["response"]) == {"summary": "summary 0"}
+        assert rows[1]["response"] == ""
+        assert rows[1]["error"] == "Some error"
+        assert rows[2]["number_of_generated_tokens"] == "5"
+
+    def test_parquet_sink_writes_row_group_per_flush(self, tmp_path):
+        # GIVEN
+        pq = pytest.importorskip("pyarrow.parquet")
+        path = tmp_path / "responses.parquet"
+
+        # WHEN
+        with io_utils.ParquetResponseSink(str(path), buffer_size=2) as sink:
+            sink.write_many(get_responses(5))
+
+        # THEN
+        parquet_file = pq.ParquetFile(path)
+        assert parquet_file.metadata.num_row_groups == 3
+        rows = parquet_file.read().to_pylist()
+        assert [row["id"] for row in rows] == ["0", "1", "2", "3", "4"]
+        assert json.loads(rows[0]["response"]) == {"summary": "summary 0"}
+        assert rows[0]["number_of_prompt_tokens"] == 10
+        assert rows[1]["error"] == "Some error"
+
+    @pytest.mark.parametrize("sink_class", [io_utils.JsonlResponseSink, io_utils.CsvResponseSink])
+    def test_sink_raises_error_if_input_variable_collides_with_response_column(self, tmp_path, sink_class):
+        # GIVEN
+        response_data = ResponseData(
+            input_data=InputData(input_mappings={"text": "text 0", "error": "input error"}, id="0"),
+            response="Some model output"
+        )
+
+        # WHEN & THEN
+        with sink_class(str(tmp_path / "responses"), buffer_size=1) as sink:
+            with pytest.raises(ValueError, match=r"\['error'\]"):
+                sink.write(response_data)
+        assert sink.number_of_written_rows == 0
+
+    @pytest.mark.parametrize("sink_class", [io_utils.CsvResponseSink, io_utils.ParquetResponseSink])
+    def test_sink_raises_error_if_row_has_different_columns_than_first_row(self, tmp_path, sink_class):
+        # GIVEN
+        if sink_class is io_utils.ParquetResponseSink:
+            pytest.importorskip("pyarrow")
+        responses = get_responses(2) + [
+            ResponseData(input_data=InputData(input_mappings={"other_text": "text 2"}, id="2"), response="output")
+        ]
+
+        # WHEN & THEN
+        with sink_class(str(tmp_path / "responses"), buffer_size=10) as sink:
+            with pytest.raises(ValueError, match="The row with id 2 has columns"):
+                sink.write_many(responses)
+        assert sink.number_of_written_rows == 2
+
+    def test_jsonl_sink_accepts_rows_with_different_columns(self, tmp_path):
+        # GIVEN
+        path = tmp_path / "responses.jsonl"
+        responses = get_responses(1) + [
+            ResponseData(input_data=InputData(input_mappings={"other_text": "text 1"}, id="1"), response="output")
+        ]
+
+        # WHEN
+        with io_utils.JsonlResponseSink(str(path)) as sink:
+            sink.write_many(responses)
+
+        # THEN
+        rows = [json.loads(line) for line in path.read_text().splitlines()]
+        assert rows[1]["other_text"] == "text 1"
+        assert "text" not in rows[1]
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import typing
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.prompts.prompt import PromptTemplate
+
+from allms.chains.long_text_processing_chain import load_long_text_processing_chain
+from allms.defaults.long_text_chain import LongTextChainDefaults
+from allms.domain.enumerables import AggregationLogicForLongInputData, LanguageModelTask
+from allms.domain.input_data import InputData
+from allms.utils.long_text_processing_utils import get_max_allowed_number_of_tokens
+
+
+class ConcurrencyTrackingLLM(LLM):
+    """Counts the concurrent requests. Tokens are whitespace-separated words."""
+    in_flight: int = 0
+    max_in_flight: int = 0
+    prompts: typing.List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "concurrency-tracking"
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
+
+    def _call(self, prompt: str, stop: typing.Optional[typing.List[str]] = None, **kwargs: typing.Any) -> str:
+        raise AssertionError("The event loop was blocked by a synchronous request")
+
+    async def _acall(self, prompt: str, stop: typing.Optional[typing.List[str]] = None, **kwargs: typing.Any) -> str:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.prompts.append(prompt)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return json.dumps({"summary": "Some summary"})
+
+
+def is_reduce_prompt(prompt: str) -> bool:
+    return prompt.startswith("You're an AI agent that combines product summaries")
+
+
+def get_long_text_chain(llm: LLM, concurrency_limiter: typing.Optional[asyncio.Semaphore] = None):
+    return load_long_text_processing_chain(
+        task=LanguageModelTask.SUMMARY,
+        llm=llm,
+        model_total_max_tokens=100,
+        max_output_tokens=10,
+        map_prompt=PromptTemplate.from_template("Summarize: {text}"),
+        reduce_prompt=PromptTemplate(
+            template=LongTextChainDefaults.AGGREGATION_PROMPT,
+            input_variables=["text"],
+            partial_variables={"output_data_model": ""}
+        ),
+        aggregation_strategy=AggregationLogicForLongInputData.REDUCE_BY_LLM_PROMPTING,
+        concurrency_limiter=concurrency_limiter
+    )
+
+
+class TestLongTextProcessingChain:
+
+    def test_requests_for_chunks_share_concurrency_limiter(self):
+        # GIVEN
+        llm = ConcurrencyTrackingLLM()
+        chain = get_long_text_chain(llm, concurrency_limiter=asyncio.Semaphore(2))
+        text = " ".join(f"word{idx}." for idx in range(200))
+
+        # WHEN
+        response, _ = asyncio.run(chain.acombine_docs(text))
+
+        # THEN
+        assert json.loads(response) == {"summary": "Some summary"}
+        assert len(llm.prompts) > 3
+        assert llm.max_in_flight == 2
+        assert is_reduce_prompt(llm.prompts[-1])
+
+    def test_responses_for_chunks_are_reduced_in_tree_fitting_the_limit(self):
+        # GIVEN
+        llm = ConcurrencyTrackingLLM()
+        chain = get_long_text_chain(llm)
+        text = " ".join(f"word{idx}." for idx in range(100))
+
+        # WHEN
+        outputs = asyncio.run(chain.ainvoke({"text": text}))
+
+        # THEN
+        reduce_prompts = [prompt for prompt in llm.prompts if is_reduce_prompt(prompt)]
+        number_of_chunks = len(llm.prompts) - len(reduce_prompts)
+        assert json.loads(outputs[chain.output_key]) == {"summary": "Some summary"}
+        assert outputs["reduce_depth"] == len(outputs["reduce_fan_outs"]) > 1
+        assert outputs["reduce_fan_outs"][0] > 1
+        assert number_of_chunks > len(reduce_prompts) > outputs["reduce_depth"]
+        assert all(
+            llm.get_num_tokens(prompt) <= get_max_allowed_number_of_tokens(
+                chain.model_total_max_tokens, chain.max_output_tokens
+            )
+            for prompt in reduce_prompts
+        )
+
+    def test_long_examples_do_not_deadlock_on_concurrency_limiter(self, models):
+        # GIVEN
+        llm = ConcurrencyTrackingLLM()
+        model = models["vertex_palm"]
+        model._llm = llm
+        model._is_long_text_bypass_enabled = True
+        model._task = LanguageModelTask.SUMMARY
+        model._aggregation_strategy = AggregationLogicForLongInputData.REDUCE_BY_LLM_PROMPTING
+        model._concurrency_limiter = asyncio.Semaphore(1)
+        model._model_total_max_tokens, model._max_output_tokens = 200, 10
+        input_data = [
+            InputData(input_mappings={"text": " ".join(["word."] * 145)}, id="long"),
+            InputData(input_mappings={"text": "Some short text"}, id="short")
+        ]
+
+        # WHEN
+        responses = model.generate("Summarize: {text}", input_data)
+
+        # THEN
+        assert [response.error for response in responses] == [None, None]
+        assert [response.response for response in responses] == [json.dumps({"summary": "Some summary"})] * 2
+        assert len(llm.prompts) > 2
+        assert llm.max_in_flight == 1
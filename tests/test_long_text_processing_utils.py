@@ -0,0 +1,216 @@
+from unittest.mock import Mock
+
+import pytest
+from langchain.prompts import PromptTemplate
+
+from allms.domain.input_data import InputData
+from allms.utils.long_text_processing_utils import (
+    get_max_allowed_number_of_tokens,
+    split_text_to_max_size,
+    truncate_input_data_to_max_size,
+    truncate_text_to_max_size
+)
+
+
+def get_llm_mock() -> Mock:
+    llm_mock = Mock()
+    llm_mock.get_num_tokens.side_effect = lambda text: len(text.split())
+    return llm_mock
+
+
+class TestSplitTextToMaxSize:
+
+    def test_text_shorter_than_limit_is_not_split(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+
+        # WHEN
+        chunks = split_text_to_max_size(
+            llm=llm_mock,
+            prompt_template=PromptTemplate.from_template("Summarize: {text}"),
+            text="Some short text",
+            model_total_max_tokens=300,
+            max_output_tokens=100
+        )
+
+        # THEN
+        assert [chunk.page_content for chunk in chunks] == ["Some short text"]
+
+    def test_text_is_split_to_minimal_number_of_overlapping_chunks_fitting_the_limit(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+        prompt_template = PromptTemplate.from_template("Summarize: {text}")
+        words = [f"word{idx}" for idx in range(1000)]
+
+        # WHEN
+        chunks = split_text_to_max_size(
+            llm=llm_mock,
+            prompt_template=prompt_template,
+            text=" ".join(words),
+            model_total_max_tokens=300,
+            max_output_tokens=100,
+            overlap_size=10,
+            snap_to_sentence_boundary=False
+        )
+
+        # THEN
+        max_token_limit = get_max_allowed_number_of_tokens(model_total_max_tokens=300, max_output_tokens=100)
+        chunks_words = [chunk.page_content.split() for chunk in chunks]
+        assert len(chunks) == 8
+        assert all(
+            llm_mock.get_num_tokens(prompt_template.format(text=chunk.page_content)) <= max_token_limit
+            for chunk in chunks
+        )
+        assert all(first[-10:] == second[:10] for first, second in zip(chunks_words, chunks_words[1:]))
+        assert chunks_words[0][0] == words[0] and chunks_words[-1][-1] == words[-1]
+
+    def test_each_unique_word_is_tokenized_only_once(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+
+        # WHEN
+        chunks = split_text_to_max_size(
+            llm=llm_mock,
+            prompt_template=PromptTemplate.from_template("Summarize: {text}"),
+            text=" ".join(["some", "repeated", "words"] * 500),
+            model_total_max_tokens=300,
+            max_output_tokens=100
+        )
+
+        # THEN
+        # one call for the whole prompt, one for the prompt without the text, one per unique word and one per chunk
+        assert llm_mock.get_num_tokens.call_count == 2 + 4 + len(chunks)
+
+    def test_chunks_fit_the_limit_if_tokens_are_merged_across_words(self):
+        # GIVEN
+        llm_mock = Mock()
+        # Every space between the words is a separate token, so the words counted one by one have fewer tokens in total
+        llm_mock.get_num_tokens.side_effect = lambda text: max(2 * len(text.split()) - 1, 0)
+        prompt_template = PromptTemplate.from_template("Summarize: {text}")
+        words = [f"word{idx}" for idx in range(1000)]
+
+        # WHEN
+        chunks = split_text_to_max_size(
+            llm=llm_mock,
+            prompt_template=prompt_template,
+            text=" ".join(words),
+            model_total_max_tokens=300,
+            max_output_tokens=100,
+            overlap_size=0
+        )
+
+        # THEN
+        max_token_limit = get_max_allowed_number_of_tokens(model_total_max_tokens=300, max_output_tokens=100)
+        assert all(
+            llm_mock.get_num_tokens(prompt_template.format(text=chunk.page_content)) <= max_token_limit
+            for chunk in chunks
+        )
+        assert " ".join(chunk.page_content for chunk in chunks).split() == words
+
+    def test_chunks_are_snapped_to_sentence_ends(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+        sentence = "This is a sentence with exactly ten words in it."
+
+        # WHEN
+        chunks = split_text_to_max_size(
+            llm=llm_mock,
+            prompt_template=PromptTemplate.from_template("Summarize: {text}"),
+            text=" ".join([sentence] * 100),
+            model_total_max_tokens=300,
+            max_output_tokens=100,
+            overlap_size=0
+        )
+
+        # THEN
+        assert len(chunks) == 8
+        assert all(chunk.page_content.endswith("in it.") for chunk in chunks)
+        assert all(chunk.page_content.startswith("This is") for chunk in chunks)
+
+
+class TestTruncateTextToMaxSize:
+
+    def test_text_is_truncated_to_the_longest_prefix_fitting_the_limit(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+        prompt_template = PromptTemplate.from_template("Summarize: {text}")
+        text = " ".join(f"word{idx}" for idx in range(10000))
+
+        # WHEN
+        truncated_text = truncate_text_to_max_size(
+            llm=llm_mock,
+            prompt_template=prompt_template,
+            text=text,
+            model_total_max_tokens=300,
+            max_output_tokens=100
+        )
+
+        # THEN
+        max_token_limit = get_max_allowed_number_of_tokens(model_total_max_tokens=300, max_output_tokens=100)
+        assert text.startswith(truncated_text)
+        assert llm_mock.get_num_tokens(prompt_template.format(text=truncated_text)) == max_token_limit
+
+    def test_number_of_tokenizer_calls_is_bounded(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+        prompt_template = PromptTemplate.from_template("Summarize: {text}")
+        text = " ".join(f"word{idx}" for idx in range(100000))
+
+        # WHEN
+        truncated_text = truncate_text_to_max_size(
+            llm=llm_mock,
+            prompt_template=prompt_template,
+            text=text,
+            model_total_max_tokens=300,
+            max_output_tokens=100,
+            max_tokenizer_calls=5
+        )
+
+        # THEN
+        max_token_limit = get_max_allowed_number_of_tokens(model_total_max_tokens=300, max_output_tokens=100)
+        assert llm_mock.get_num_tokens.call_count <= 5
+        assert llm_mock.get_num_tokens(prompt_template.format(text=truncated_text)) <= max_token_limit
+
+    def test_exception_is_raised_when_prompt_without_text_is_too_long(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+        prompt_template = PromptTemplate.from_template("Summarize: " + "very " * 300 + "{text}")
+
+        # WHEN & THEN
+        with pytest.raises(ValueError, match="Prompt instruction"):
+            truncate_text_to_max_size(
+                llm=llm_mock,
+                prompt_template=prompt_template,
+                text="Some text",
+                model_total_max_tokens=300,
+                max_output_tokens=100
+            )
+
+    def test_input_data_fields_are_truncated_in_batches(self):
+        # GIVEN
+        llm_mock = get_llm_mock()
+        prompt_template = PromptTemplate.from_template("Summarize {title}: {text}")
+        input_data = [
+            InputData(input_mappings={"title": "short", "text": "Some short text"}, id="0"),
+            InputData(input_mappings={"title": "long", "text": "word " * 1000}, id="1"),
+            InputData(input_mappings={"title": "longer", "text": "word " * 100000}, id="2")
+        ]
+
+        # WHEN
+        truncated_input_data = truncate_input_data_to_max_size(
+            llm=llm_mock,
+            prompt_template=prompt_template,
+            input_data=input_data,
+            input_variable="text",
+            model_total_max_tokens=300,
+            max_output_tokens=100
+        )
+
+        # THEN
+        max_token_limit = get_max_allowed_number_of_tokens(model_total_max_tokens=300, max_output_tokens=100)
+        assert truncated_input_data[0] == input_data[0]
+        assert [data.id for data in truncated_input_data] == ["0", "1", "2"]
+        assert all(
+            llm_mock.get_num_tokens(prompt_template.format(**data.input_mappings)) == max_token_limit
+            for data in truncated_input_data[1:]
+        )
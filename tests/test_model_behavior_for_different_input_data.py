@@ -8,6 +8,7 @@ import pytest
 from allms.domain.input_data import InputData
 from allms.domain.response import ResponseData
 import allms.models as llm_models
+from allms.models.abstract import AbstractModel
 
 
 class TestModelBehaviorForDifferentInput:
@@ -161,3 +162,48 @@ class TestModelBehaviorForDifferentInput:
                         ValueError, match=input_validation_messages.get_system_prompt_contains_input_variables()
                 ) as expected_value_exception:
                     model.generate(prompt, system_prompt="This is a system prompt with {additional} field")
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_invalid_input_data_in_later_example_raises_exception(self, tokens_mock, chain_run_mock, models):
+        for model in models.values():
+            chain_run_mock.return_value = "{}"
+            tokens_mock.return_value = 1
+
+            input_data = [InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx)) for idx in range(5)]
+            input_data.append(InputData(input_mappings={"text_2": "Another dummy text"}, id="5"))
+
+            prompt = "Some Dummy Prompt {text}"
+
+            with pytest.raises(ValueError, match=input_validation_messages.get_different_input_keys_message(
+                    input_data[-1].id)):
+                model.generate(prompt, input_data)
+            chain_run_mock.assert_not_called()
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    @patch("allms.defaults.token_counting.TokenCountingDefaults.BATCH_SIZE", 2)
+    def test_input_data_is_validated_lazily_in_batches_when_streaming(self, tokens_mock, chain_run_mock, models):
+        for model in models.values():
+            chain_run_mock.return_value = "{}"
+            tokens_mock.return_value = 1
+
+            input_data = [InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx)) for idx in range(5)]
+            invalid_input_data = input_data + [InputData(input_mappings={"text_2": "Another dummy text"}, id="5")]
+
+            prompt = "Some Dummy Prompt {text}"
+
+            with patch.object(
+                    AbstractModel, "_validate_input_data_batch", wraps=AbstractModel._validate_input_data_batch
+            ) as validate_batch_mock:
+                list(model.generate_stream(prompt, input_data))
+                streamed_batches_sizes = [len(call.args[1]) for call in validate_batch_mock.call_args_list]
+                validate_batch_mock.reset_mock()
+                model.generate(prompt, input_data)
+                generated_batches_sizes = [len(call.args[1]) for call in validate_batch_mock.call_args_list]
+
+            assert streamed_batches_sizes == [2, 2, 1]
+            assert generated_batches_sizes == [5]
+            with pytest.raises(ValueError, match=input_validation_messages.get_different_input_keys_message(
+                    invalid_input_data[-1].id)):
+                list(model.generate_stream(prompt, invalid_input_data))
@@ -1,10 +1,15 @@
+import asyncio
 import json
+from concurrent.futures import ProcessPoolExecutor
 from unittest.mock import patch
 
 import pytest
 
+from allms.domain.configuration import AzureOpenAIConfiguration
 from allms.domain.input_data import InputData
-from allms.domain.prompt_dto import SummaryOutputClass, KeywordsOutputClass
+from allms.domain.prompt_dto import AggregateOutputClass, SummaryOutputClass, KeywordsOutputClass
+from allms.models import AzureOpenAIModel
+from allms.utils.response_parsing_utils import ResponseParser, iterate_json_candidates
 
 
 class TestOutputModelParserForDifferentModelOutputs:
@@ -81,6 +86,24 @@ class TestOutputModelParserForDifferentModelOutputs:
             assert "OutputParserException" in model_response[0].error
             assert model_response[0].response is None
 
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_output_parser_keeps_validation_error_when_json_is_invalid(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.return_value = "{\"summary\": \"text\",}"
+        tokens_mock.return_value = 1
+
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            model_response = model.generate(prompt, input_data, SummaryOutputClass)
+            assert "Invalid json output" in model_response[0].error
+            assert "validation error for SummaryOutputClass" in model_response[0].error
+            assert "trailing comma" in model_response[0].error
+            assert model_response[0].response is None
+
     @patch("langchain.chains.base.Chain.arun")
     @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
     def test_output_parser_returns_parsed_class_when_model_output_returns_too_many_fields(self, tokens_mock, chain_run_mock, models):
@@ -131,4 +154,128 @@ class TestOutputModelParserForDifferentModelOutputs:
         for model in models.values():
             model_response = model.generate(prompt, None, KeywordsOutputClass)
             assert model_response[0].response is None
-            assert "OutputParserException" in model_response[0].error
\ No newline at end of file
+            assert "OutputParserException" in model_response[0].error
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    @pytest.mark.parametrize("json_response", [
+        ("{\"summaries\": [{\"summary\": \"First\"}, {\"keywords\": [\"a\", \"b\"]}]}"),
+        ("Here it is:\n```json\n{\"summaries\": [{\"summary\": \"First\"}, {\"keywords\": [\"a\", \"b\"]}]}\n```"),
+        ("{\"note\": \"not this one\"} ```\n{\"summaries\": [{\"summary\": \"First\"}, {\"keywords\": [\"a\", \"b\"]}]}```"),
+        ("{\"summaries\": [{\"summary\": \"First\"}, {\"keywords\": [\"a\", \"b\"]}], \"comment\": \"braces } in \\\" text\"}")
+    ])
+    def test_output_parser_extracts_nested_json_from_response(self, tokens_mock, chain_run_mock, models, json_response):
+        # GIVEN
+        chain_run_mock.return_value = json_response
+        tokens_mock.return_value = 1
+
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            model_response = model.generate(prompt, input_data, AggregateOutputClass)
+            assert model_response[0].error is None
+            assert model_response[0].response == AggregateOutputClass(
+                summaries=[SummaryOutputClass(summary="First"), KeywordsOutputClass(keywords=["a", "b"])]
+            )
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_output_parser_accepts_control_characters_inside_strings(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.return_value = "{\"summary\": \"First line\nSecond line\"}"
+        tokens_mock.return_value = 1
+
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            model_response = model.generate(prompt, input_data, SummaryOutputClass)
+            assert model_response[0].response == SummaryOutputClass(summary="First line\nSecond line")
+
+
+class TestJsonCandidatesExtraction:
+
+    @pytest.mark.parametrize("text,expected_candidates", [
+        ("no json here", []),
+        ("{\"a\": {\"b\": [1, {\"c\": 2}]}} tail", ["{\"a\": {\"b\": [1, {\"c\": 2}]}}", "{\"b\": [1, {\"c\": 2}]}", "{\"c\": 2}"]),
+        ("{\"a\": \"} and { in a string\"}", ["{\"a\": \"} and { in a string\"}"]),
+        ("{\"a\": \"escaped \\\" quote }\"}", ["{\"a\": \"escaped \\\" quote }\"}"]),
+        ("{\"unterminated\": {\"b\": 1}", ["{\"b\": 1}"]),
+        ("{\"a\": [1}, \"b\": 2} {\"c\": 3}", ["{\"c\": 3}"]),
+        ("text ```json\n{\"a\": 1}\n``` {\"b\": 2}", ["{\"a\": 1}", "{\"a\": 1}", "{\"b\": 2}"])
+    ])
+    def test_balanced_objects_are_extracted(self, text, expected_candidates):
+        # WHEN
+        candidates = list(iterate_json_candidates(text))
+
+        # THEN
+        assert candidates == expected_candidates
+
+
+class TestIncrementalResponseParsing:
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_responses_are_parsed_before_all_requests_are_completed(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        tokens_mock.return_value = 1
+        input_data = [InputData(input_mappings={"text": f"text {idx}"}, id=str(idx)) for idx in range(2)]
+        model = models["azure_open_ai"]
+        first_response_parsed = asyncio.Event()
+        parse_response_data = ResponseParser.parse_response_data
+
+        def parse_and_notify(response_parser, model_response):
+            first_response_parsed.set()
+            return parse_response_data(response_parser, model_response)
+
+        async def respond(text):
+            if text == "text 1":
+                # Completes only after the response to the first example was parsed
+                await asyncio.wait_for(first_response_parsed.wait(), timeout=5)
+            return json.dumps({"summary": f"summary of {text}"})
+
+        chain_run_mock.side_effect = respond
+
+        # WHEN
+        with patch.object(ResponseParser, "parse_response_data", parse_and_notify):
+            model_response = model.generate("Some Dummy Prompt {text}", input_data, SummaryOutputClass)
+
+        # THEN
+        assert [response.response for response in model_response] == [
+            SummaryOutputClass(summary="summary of text 0"), SummaryOutputClass(summary="summary of text 1")
+        ]
+
+    @patch("langchain.chains.base.Chain.arun")
+    def test_responses_are_parsed_in_process_pool(self, chain_run_mock):
+        # GIVEN
+        chain_run_mock.side_effect = lambda text: json.dumps({"summary": f"summary of {text}"})
+        input_data = [InputData(input_mappings={"text": f"text {idx}"}, id=str(idx)) for idx in range(5)]
+
+        with ProcessPoolExecutor(max_workers=2) as response_parsing_executor:
+            model = AzureOpenAIModel(
+                config=AzureOpenAIConfiguration(
+                    api_key="dummy_api_key",
+                    base_url="https://dummy-endpoint.openai.azure.com/",
+                    api_version="dummy-api-version",
+                    deployment="dummy-deployment-name",
+                    model_name="gpt-4"
+                ),
+                response_parsing_executor=response_parsing_executor,
+                event_loop=asyncio.new_event_loop()
+            )
+
+            # WHEN
+            model_response = model.generate("Some Dummy Prompt {text}", input_data, SummaryOutputClass)
+            streamed_responses = list(model.generate_stream("Some Dummy Prompt {text}", input_data, SummaryOutputClass))
+
+        # THEN
+        assert [response.response for response in model_response] == [
+            SummaryOutputClass(summary=f"summary of text {idx}") for idx in range(5)
+        ]
+        assert all(response.error is None for response in model_response)
+        assert sorted(response.response.summary for response in streamed_responses) == [
+            f"summary of text {idx}" for idx in range(5)
+        ]
@@ -0,0 +1,121 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import SummaryOutputClass
+from allms.domain.response import ResponseData
+from allms.utils.deduplication_utils import PromptDeduplicator
+
+
+def get_input_data_with_duplicates():
+    texts = ["first text", "second text", "first text", "first text", "second text"]
+    return [InputData(input_mappings={"text": text}, id=f"offer-{idx}") for idx, text in enumerate(texts)]
+
+
+class TestPromptDeduplication:
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_each_unique_prompt_is_sent_once(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        tokens_mock.return_value = 1
+        chain_run_mock.side_effect = lambda text: json.dumps({"summary": f"summary of {text}"})
+        input_data = get_input_data_with_duplicates()
+
+        for model in models.values():
+            model._deduplicate_prompts = True
+            chain_run_mock.reset_mock()
+
+            # WHEN
+            responses = model.generate("Some Dummy Prompt {text}", input_data, SummaryOutputClass)
+
+            # THEN
+            assert chain_run_mock.call_count == 2
+            assert [response.input_data for response in responses] == input_data
+            assert [response.response.summary for response in responses] == [
+                f"summary of {example.input_mappings['text']}" for example in input_data
+            ]
+            assert responses[2].number_of_prompt_tokens == responses[0].number_of_prompt_tokens
+            assert responses[2].number_of_generated_tokens == responses[0].number_of_generated_tokens
+
+            deduplication_stats = model.get_deduplication_stats()
+            assert deduplication_stats.number_of_examples == 5
+            assert deduplication_stats.number_of_unique_prompts == 2
+            assert deduplication_stats.deduplication_ratio == pytest.approx(0.6)
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_error_is_fanned_out_to_all_duplicates(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        tokens_mock.return_value = 1
+        model = models["azure_open_ai"]
+        model._deduplicate_prompts = True
+
+        def fail_for_first_text(text):
+            if text == "first text":
+                raise ValueError("Some error")
+            return "Some model output"
+
+        chain_run_mock.side_effect = fail_for_first_text
+
+        # WHEN
+        responses = list(model.generate_stream("Some Dummy Prompt {text}", get_input_data_with_duplicates()))
+
+        # THEN
+        assert chain_run_mock.call_count == 2
+        responses_by_id = {response.input_data.id: response for response in responses}
+        assert [responses_by_id[f"offer-{idx}"].error for idx in (0, 2, 3)] == ["ValueError: Some error"] * 3
+        assert [responses_by_id[f"offer-{idx}"].response for idx in (1, 4)] == ["Some model output"] * 2
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_prompts_are_not_deduplicated_by_default(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        tokens_mock.return_value = 1
+        chain_run_mock.return_value = "Some model output"
+        model = models["azure_open_ai"]
+
+        # WHEN
+        model.generate("Some Dummy Prompt {text}", get_input_data_with_duplicates())
+
+        # THEN
+        assert chain_run_mock.call_count == 5
+        assert model.get_deduplication_stats() is None
+
+    def test_responses_are_kept_without_input_data_for_the_whole_generation(self):
+        # GIVEN
+        prompt_deduplicator = PromptDeduplicator()
+        input_data = get_input_data_with_duplicates()
+        number_of_requests = 0
+
+        async def predict_example() -> ResponseData:
+            nonlocal number_of_requests
+            number_of_requests += 1
+            await asyncio.sleep(0.01)
+            return ResponseData(response="Some model output", input_data=input_data[0])
+
+        async def predict_examples():
+            responses = await asyncio.gather(*[
+                prompt_deduplicator.predict(example.input_mappings["text"], example, predict_example)
+                for example in input_data
+            ])
+            later_response = await prompt_deduplicator.predict("first text", input_data[3], predict_example)
+            return responses + [later_response]
+
+        # WHEN
+        responses = asyncio.run(predict_examples())
+
+        # THEN
+        assert [response.response for response in responses] == ["Some model output"] * 6
+        assert responses[-1].input_data == input_data[3]
+        assert number_of_requests == 2
+        assert prompt_deduplicator.stats.number_of_examples == 6
+        assert prompt_deduplicator.stats.number_of_unique_prompts == 2
+        assert len(prompt_deduplicator._responses) == 2
+        assert all(
+            isinstance(response, ResponseData) and response.input_data is None
+            for response in prompt_deduplicator._responses.values()
+        )
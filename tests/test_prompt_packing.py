@@ -0,0 +1,154 @@
+import json
+import re
+from unittest.mock import patch
+
+import pytest
+
+from allms.constants.prompt import PromptConstants
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import SummaryOutputClass
+from allms.utils.prompt_packing_utils import build_packed_prompt, pack_examples
+
+_PACKED_EXAMPLE_PATTERN = re.compile(r"### Example (\d+)\ntext: (.*)\n")
+
+
+def get_input_data(number_of_examples: int):
+    return [InputData(input_mappings={"text": f"review {idx}"}, id=f"id-{idx}") for idx in range(number_of_examples)]
+
+
+def respond_to_packed_examples(skipped_texts=()):
+    def respond(**input_mappings):
+        if PromptConstants.PACKED_EXAMPLES not in input_mappings:
+            return json.dumps({"summary": f"single {input_mappings['text']}"})
+        return json.dumps({"outputs": [
+            {"key": key, "output": {"summary": f"packed {text}"}}
+            for key, text in _PACKED_EXAMPLE_PATTERN.findall(input_mappings[PromptConstants.PACKED_EXAMPLES])
+            if text not in skipped_texts
+        ]})
+    return respond
+
+
+class TestPromptPacking:
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_examples_are_packed_into_requests(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        tokens_mock.return_value = 1
+        chain_run_mock.side_effect = respond_to_packed_examples()
+        input_data = get_input_data(5)
+
+        for model in models.values():
+            chain_run_mock.reset_mock()
+
+            # WHEN
+            responses = model.generate_packed(
+                "Summarize the review: {text}", input_data, SummaryOutputClass, max_examples_per_request=2
+            )
+
+            # THEN
+            assert chain_run_mock.call_count == 3
+            assert all(PromptConstants.PACKED_EXAMPLES in call.kwargs for call in chain_run_mock.call_args_list)
+            assert [response.input_data for response in responses] == input_data
+            assert [response.response for response in responses] == [
+                SummaryOutputClass(summary=f"packed review {idx}") for idx in range(5)
+            ]
+            assert all(response.error is None for response in responses)
+
+    @patch("langchain.chains.base.Chain.arun", autospec=True)
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_packed_prompt_contains_packed_output_format(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        tokens_mock.return_value = 1
+        chain_run_mock.side_effect = lambda chain, **input_mappings: respond_to_packed_examples()(**input_mappings)
+
+        for model_name, model in models.items():
+            chain_run_mock.reset_mock()
+
+            # WHEN
+            model.generate_packed("Summarize the review: {text}", get_input_data(2), SummaryOutputClass)
+
+            # THEN
+            chain, input_mappings = chain_run_mock.call_args.args[0], chain_run_mock.call_args.kwargs
+            packed_prompt = chain.prompt.format(**input_mappings)
+            assert '"outputs"' in packed_prompt, model_name
+            assert '"key"' in packed_prompt, model_name
+            assert "### Example 1\ntext: review 1" in packed_prompt, model_name
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_examples_without_valid_packed_output_are_sent_one_by_one(self, tokens_mock, chain_run_mock, models):
+        # GIVEN
+        tokens_mock.return_value = 1
+        model = models["azure_open_ai"]
+        input_data = get_input_data(4)
+        respond = respond_to_packed_examples(skipped_texts={"review 1"})
+
+        def respond_with_broken_last_pack(**input_mappings):
+            if "review 3" in input_mappings.get(PromptConstants.PACKED_EXAMPLES, ""):
+                return "Some broken output"
+            return respond(**input_mappings)
+
+        chain_run_mock.side_effect = respond_with_broken_last_pack
+
+        # WHEN
+        responses = model.generate_packed(
+            "Summarize the review: {text}", input_data, SummaryOutputClass, max_examples_per_request=2
+        )
+
+        # THEN
+        assert [response.response.summary for response in responses] == [
+            "packed review 0", "single review 1", "single review 2", "single review 3"
+        ]
+        assert sorted(
+            call.kwargs["text"] for call in chain_run_mock.call_args_list if "text" in call.kwargs
+        ) == ["review 1", "review 2", "review 3"]
+
+    @patch("langchain.chains.base.Chain.arun")
+    def test_token_counts_of_request_are_apportioned_between_examples(self, chain_run_mock, models):
+        # GIVEN
+        chain_run_mock.side_effect = respond_to_packed_examples()
+        model = models["azure_open_ai"]
+        input_data = [
+            InputData(input_mappings={"text": "short"}, id="1"),
+            InputData(input_mappings={"text": "a much longer review with many more words in it"}, id="2")
+        ]
+
+        # WHEN
+        responses = model.generate_packed("Summarize the review: {text}", input_data, SummaryOutputClass)
+
+        # THEN
+        assert 0 < responses[0].number_of_prompt_tokens < responses[1].number_of_prompt_tokens
+        assert responses[0].number_of_generated_tokens == responses[1].number_of_generated_tokens > 0
+
+
+class TestPromptPackingUtils:
+
+    @pytest.mark.parametrize("numbers_of_tokens,max_number_of_tokens,max_examples_per_request,expected_packs", [
+        ([5, 5, 5], 100, 2, [[0, 1], [2]]),
+        ([5, 5, 5, 20, 1, 1], 12, 10, [[0, 1], [2], [3], [4, 5]]),
+        ([], 10, 2, [])
+    ])
+    def test_examples_are_packed_greedily(
+            self, numbers_of_tokens, max_number_of_tokens, max_examples_per_request, expected_packs
+    ):
+        # WHEN
+        packs = pack_examples(numbers_of_tokens, max_number_of_tokens, max_examples_per_request)
+
+        # THEN
+        assert packs == expected_packs
+
+    def test_task_is_stated_once_with_placeholders(self):
+        # WHEN
+        packed_prompt = build_packed_prompt("Translate {{literally}} the {text} to {language}", ["text", "language"])
+
+        # THEN
+        assert packed_prompt.startswith("Translate {{literally}} the {{text}} to {{language}}\n\n")
+        assert packed_prompt.endswith(f"{{{PromptConstants.PACKED_EXAMPLES}}}")
+
+    def test_format_instructions_are_added_to_packed_prompt(self):
+        # WHEN
+        packed_prompt = build_packed_prompt("Summarize the {text}", ["text"], format_instructions='{"outputs": []}')
+
+        # THEN
+        assert packed_prompt.endswith(f"{{{PromptConstants.PACKED_EXAMPLES}}}\n\n{{{{\"outputs\": []}}}}")
@@ -0,0 +1,81 @@
+import time
+from unittest.mock import patch
+
+from allms.domain.input_data import InputData
+from allms.domain.response import ResponseData
+from allms.utils.response_cache_utils import ResponseCache
+
+
+class TestResponseCache:
+
+    def test_cached_response_is_returned_with_token_counts(self, tmp_path):
+        # GIVEN
+        cache = ResponseCache(path=tmp_path / "cache.sqlite")
+        key = ResponseCache.build_key(provider="SomeModel", prompt="Some prompt")
+
+        # WHEN
+        missing_response = cache.get(key)
+        cache.set(key, ResponseData(response="Some response", number_of_prompt_tokens=3, number_of_generated_tokens=2))
+        cached_response = cache.get(key)
+
+        # THEN
+        assert missing_response is None
+        assert cached_response == ResponseData(
+            response="Some response", number_of_prompt_tokens=3, number_of_generated_tokens=2
+        )
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_cache_is_persisted_between_instances(self, tmp_path):
+        # GIVEN
+        ResponseCache(path=tmp_path / "cache.sqlite").set("key", ResponseData(response="Some response"))
+
+        # WHEN
+        cached_response = ResponseCache(path=tmp_path / "cache.sqlite").get("key")
+
+        # THEN
+        assert cached_response.response == "Some response"
+
+    def test_expired_entries_are_not_returned(self, tmp_path):
+        # GIVEN
+        cache = ResponseCache(path=tmp_path / "cache.sqlite", ttl_s=0.01)
+        cache.set("key", ResponseData(response="Some response"))
+
+        # WHEN
+        time.sleep(0.05)
+
+        # THEN
+        assert cache.get("key") is None
+
+    def test_least_recently_used_entries_are_evicted_when_cache_is_too_large(self, tmp_path):
+        # GIVEN
+        cache = ResponseCache(path=tmp_path / "cache.sqlite", max_size_bytes=1)
+        cache.set("first_key", ResponseData(response="First response"))
+
+        # WHEN
+        cache.set("second_key", ResponseData(response="Second response"))
+
+        # THEN
+        assert cache.get("first_key") is None
+        assert cache.size_bytes <= 1
+
+    @patch("langchain.chains.base.Chain.arun")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_model_does_not_query_llm_for_cached_prompts(self, tokens_mock, chain_run_mock, models, tmp_path):
+        # GIVEN
+        chain_run_mock.return_value = "Some model output"
+        tokens_mock.return_value = 1
+
+        input_data = [InputData(input_mappings={"text": "Some dummy text"}, id="1")]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN & THEN
+        for model in models.values():
+            model._response_cache = ResponseCache(path=tmp_path / f"{type(model).__name__}.sqlite")
+            chain_run_mock.reset_mock()
+
+            first_response = model.generate(prompt, input_data)[0]
+            second_response = model.generate(prompt, input_data)[0]
+
+            assert chain_run_mock.call_count == 1
+            assert first_response == second_response
+            assert (model._response_cache.hits, model._response_cache.misses) == (1, 1)
@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+import typing
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import pytest
+from langchain_core.language_models.llms import LLM
+
+from allms.domain.input_data import InputData
+
+STUB_SERVER_RESPONSE_TIME_S = 0.2
+
+
+class StubServerRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(STUB_SERVER_RESPONSE_TIME_S)
+        response = json.dumps({"output": f"Response to: {json.loads(body)['prompt']}"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServerRestLLM(LLM):
+    url: str
+    api_transport: str = "rest"
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-server-rest"
+
+    def _call(self, prompt: str, stop: typing.Optional[typing.List[str]] = None, **kwargs: typing.Any) -> str:
+        request = urllib.request.Request(self.url, data=json.dumps({"prompt": prompt}).encode(), method="POST")
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())["output"]
+
+
+@pytest.fixture
+def stub_server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubServerRequestHandler)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+class TestRestTransport:
+
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_rest_transport_requests_are_sent_concurrently(self, tokens_mock, models, stub_server_url):
+        # GIVEN
+        tokens_mock.return_value = 1
+        number_of_examples = 10
+
+        model = models["vertex_gemini"]
+        model._llm = StubServerRestLLM(url=stub_server_url)
+
+        input_data = [
+            InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx))
+            for idx in range(number_of_examples)
+        ]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN
+        start_time = time.monotonic()
+        responses = model.generate(prompt, input_data)
+        elapsed_time_s = time.monotonic() - start_time
+
+        # THEN
+        assert [response.error for response in responses] == [None] * number_of_examples
+        assert [response.response for response in responses] == [
+            f"Response to: Human: Some Dummy Prompt Some dummy text {idx}" for idx in range(number_of_examples)
+        ]
+        # Sequential requests would take number_of_examples * STUB_SERVER_RESPONSE_TIME_S = 2s
+        assert elapsed_time_s < 3 * STUB_SERVER_RESPONSE_TIME_S
+
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_rest_transport_threads_are_bounded_by_max_concurrency(self, tokens_mock, models, stub_server_url):
+        # GIVEN
+        tokens_mock.return_value = 1
+
+        model = models["vertex_gemini"]
+        model._llm = StubServerRestLLM(url=stub_server_url)
+        model._max_concurrency = 2
+
+        input_data = [InputData(input_mappings={"text": f"Some dummy text {idx}"}, id=str(idx)) for idx in range(4)]
+        prompt = "Some Dummy Prompt {text}"
+
+        # WHEN
+        model.generate(prompt, input_data)
+
+        # THEN
+        assert model._rest_transport_executor._max_workers == 2
+
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_rest_transport_threads_are_shut_down_on_close(self, tokens_mock, models, stub_server_url):
+        # GIVEN
+        tokens_mock.return_value = 1
+
+        model = models["vertex_gemini"]
+        model._llm = StubServerRestLLM(url=stub_server_url)
+        model.generate("Some Dummy Prompt {text}", [InputData(input_mappings={"text": "Some dummy text"}, id="1")])
+        rest_transport_executor = model._rest_transport_executor
+
+        # WHEN
+        model.close()
+
+        # THEN
+        assert rest_transport_executor._shutdown
+        assert model._rest_transport_executor is None
+        assert not any(thread.is_alive() for thread in rest_transport_executor._threads)
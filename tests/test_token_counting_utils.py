@@ -0,0 +1,172 @@
+import re
+from unittest.mock import Mock
+
+import pytest
+import tiktoken
+from langchain.output_parsers import PydanticOutputParser
+from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, PromptTemplate, \
+    SystemMessagePromptTemplate
+
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import KeywordsOutputClass
+from allms.utils.token_counting_utils import PromptTokenCounter, TokenCounter
+
+# Simplified pre-tokenization patterns of the tiktoken encodings, where each piece is counted as one token
+CL100K_LIKE_PATTERN = re.compile(
+    r"""'s|'t|'re|'ve|'m|'ll|'d|[^\r\n\w]?[^\W\d_]+|\d{1,3}| ?[^\s\w]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+O200K_LIKE_PATTERN = re.compile(
+    r"""[^\r\n\w]?[^\W\d_]+(?:'s|'t|'re|'ve|'m|'ll|'d)?|\d{1,3}| ?[^\s\w]+[\r\n/]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+
+
+def count_tokens(text: str) -> int:
+    return len(CL100K_LIKE_PATTERN.findall(text))
+
+
+def get_prompt_template() -> ChatPromptTemplate:
+    parser = PydanticOutputParser(pydantic_object=KeywordsOutputClass)
+    return ChatPromptTemplate.from_messages([
+        SystemMessagePromptTemplate.from_template("This is a system prompt."),
+        HumanMessagePromptTemplate(prompt=PromptTemplate(
+            template="Extract keywords.\n\n{text}\nCategory: {category}\n\n{output_data_model}",
+            input_variables=["text", "category"],
+            partial_variables={"output_data_model": parser.get_format_instructions()}
+        ))
+    ])
+
+
+def get_input_data():
+    return [
+        InputData(input_mappings={"text": "Some dummy text\n\nwith lines", "category": " Some category "}, id="0"),
+        InputData(input_mappings={"text": "\n Other dummy text's end.\n", "category": ""}, id="1"),
+        InputData(input_mappings={"text": "", "category": "1234 {}\r\n"}, id="2"),
+        InputData(input_mappings={"text": "Zażółć gęślą jaźń\n\t- punkt\n", "category": "x\ny"}, id="3")
+    ]
+
+
+class TestTokenCounting:
+
+    def test_prompt_tokens_number_is_equal_to_tokens_number_of_rendered_prompt(self):
+        # GIVEN
+        prompt_template = get_prompt_template()
+        input_data = get_input_data()
+
+        # WHEN
+        prompt_tokens_numbers = PromptTokenCounter(
+            prompt_template=prompt_template,
+            input_variables=["text", "category"],
+            token_counter=TokenCounter(count_tokens=count_tokens),
+            count_by_segments=True
+        ).count_batch(input_data)
+
+        # THEN
+        assert prompt_tokens_numbers == [
+            count_tokens(prompt_template.format_prompt(**data.input_mappings).to_string()) for data in input_data
+        ]
+
+    @pytest.mark.parametrize("pattern", [CL100K_LIKE_PATTERN, O200K_LIKE_PATTERN], ids=["cl100k", "o200k"])
+    def test_prompt_tokens_counted_by_segments_are_equal_for_newline_followed_by_slash(self, pattern):
+        # GIVEN
+        prompt_template = PromptTemplate.from_template("Open the URL.\n//{path}\nUser:\n{text}")
+        input_data = [InputData(input_mappings={"path": "example.com/index.html", "text": "Some dummy text."}, id="0")]
+
+        # WHEN
+        prompt_tokens_numbers = PromptTokenCounter(
+            prompt_template=prompt_template,
+            input_variables=["path", "text"],
+            token_counter=TokenCounter(count_tokens=lambda text: len(pattern.findall(text))),
+            count_by_segments=True
+        ).count_batch(input_data)
+
+        # THEN
+        assert prompt_tokens_numbers == [
+            len(pattern.findall(prompt_template.format(**data.input_mappings))) for data in input_data
+        ]
+
+    @pytest.mark.parametrize("encoding_name", ["cl100k_base", "o200k_base"])
+    def test_prompt_tokens_counted_by_segments_are_equal_for_tiktoken_encodings(self, encoding_name):
+        # GIVEN
+        encoding = tiktoken.get_encoding(encoding_name)
+        prompt_template = get_prompt_template()
+        input_data = get_input_data()
+
+        # WHEN
+        prompt_tokens_numbers = PromptTokenCounter(
+            prompt_template=prompt_template,
+            input_variables=["text", "category"],
+            token_counter=TokenCounter(count_tokens=lambda text: len(encoding.encode(text))),
+            count_by_segments=True
+        ).count_batch(input_data)
+
+        # THEN
+        assert prompt_tokens_numbers == [
+            len(encoding.encode(prompt_template.format_prompt(**data.input_mappings).to_string()))
+            for data in input_data
+        ]
+
+    def test_whole_prompts_are_tokenized_if_counting_by_segments_is_disabled(self):
+        # GIVEN
+        count_tokens_batch_mock = Mock(side_effect=lambda texts: [len(text) for text in texts])
+        prompt_template = get_prompt_template()
+        input_data = get_input_data()
+
+        # WHEN
+        prompt_tokens_numbers = PromptTokenCounter(
+            prompt_template=prompt_template,
+            input_variables=["text", "category"],
+            token_counter=TokenCounter(count_tokens=len, count_tokens_batch=count_tokens_batch_mock)
+        ).count_batch(input_data)
+
+        # THEN
+        rendered_prompts = [prompt_template.format_prompt(**data.input_mappings).to_string() for data in input_data]
+        assert count_tokens_batch_mock.call_args_list[0].args[0] == rendered_prompts
+        assert prompt_tokens_numbers == list(map(len, rendered_prompts))
+
+    def test_only_models_with_bpe_tokenizers_count_prompt_tokens_by_segments(self, models):
+        # WHEN
+        models_counting_by_segments = {
+            model_name for model_name, model in models.items() if model._is_prompt_token_counting_by_segments_enabled
+        }
+
+        # THEN
+        assert models_counting_by_segments == {"azure_open_ai"}
+
+    def test_static_segments_are_tokenized_only_once(self):
+        # GIVEN
+        count_tokens_batch_mock = Mock(side_effect=lambda texts: list(map(count_tokens, texts)))
+        prompt_template = ChatPromptTemplate.from_messages([
+            HumanMessagePromptTemplate.from_template("Static first line.\nStatic second line.\nText: {text}")
+        ])
+        prompt_tokens_counter = PromptTokenCounter(
+            prompt_template=prompt_template,
+            input_variables=["text"],
+            token_counter=TokenCounter(count_tokens=count_tokens, count_tokens_batch=count_tokens_batch_mock),
+            count_by_segments=True
+        )
+        input_data = [InputData(input_mappings={"text": f"Text {idx % 2}"}, id=str(idx)) for idx in range(10)]
+
+        # WHEN
+        prompt_tokens_counter.count_batch(input_data)
+        prompt_tokens_counter.count_batch(input_data)
+
+        # THEN
+        assert count_tokens_batch_mock.call_count == 2
+        assert count_tokens_batch_mock.call_args_list[0].args[0] == ["Human: Static first line.\n", "Static second line.\n"]
+        assert count_tokens_batch_mock.call_args_list[1].args[0] == ["Text: Text 0", "Text: Text 1"]
+
+    def test_token_counter_evicts_least_recently_used_texts(self):
+        # GIVEN
+        count_tokens_mock = Mock(side_effect=count_tokens)
+        token_counter = TokenCounter(count_tokens=count_tokens_mock, cache_size=2)
+
+        # WHEN
+        token_counter.count_batch(["first text", "second text", "first text"])
+        token_counter.count("third text")
+        token_counter.count("first text")
+        token_counter.count("second text")
+
+        # THEN
+        assert [call.args[0] for call in count_tokens_mock.call_args_list] == [
+            "first text", "second text", "third text", "second text"
+        ]
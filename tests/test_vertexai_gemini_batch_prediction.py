@@ -0,0 +1,166 @@
+import json
+import os
+import typing
+
+import pytest
+
+from allms.constants.vertex_ai import VertexModelConstants
+from allms.domain.batch_prediction import BatchPredictionJobStatus
+from allms.domain.input_data import InputData
+from allms.domain.prompt_dto import SummaryOutputClass
+from allms.utils.batch_prediction_utils import BatchPredictionJobClient
+
+
+class FakeBatchPredictionJobClient(BatchPredictionJobClient):
+    """Runs the job on the local filesystem: every staged request gets a prediction after the first status check."""
+
+    def __init__(self, fail_job: bool = False) -> None:
+        self.fail_job = fail_job
+        self.requests: typing.List[typing.Dict[str, typing.Any]] = []
+        self.output_uri: typing.Optional[str] = None
+        self.number_of_status_checks = 0
+
+    def submit(self, model_name: str, input_uri: str, output_uri_prefix: str) -> str:
+        with open(input_uri) as input_file:
+            self.requests = [json.loads(line) for line in input_file]
+        self.output_uri = f"{output_uri_prefix}/prediction-model-0"
+        return "projects/dummy-project/locations/us-central1/batchPredictionJobs/1"
+
+    def get_status(self, job_name: str) -> BatchPredictionJobStatus:
+        self.number_of_status_checks += 1
+        if self.number_of_status_checks == 1:
+            return BatchPredictionJobStatus(has_ended=False)
+        if self.fail_job:
+            return BatchPredictionJobStatus(has_ended=True, error_message="Quota exceeded")
+
+        os.makedirs(self.output_uri)
+        predictions = [self.get_prediction(request) for request in self.requests if request["id"] != "missing"]
+        with open(f"{self.output_uri}/predictions_00001.jsonl", "w") as predictions_file:
+            predictions_file.write("\n".join(map(json.dumps, reversed(predictions))))
+        return BatchPredictionJobStatus(has_ended=True, has_succeeded=True, output_uri=self.output_uri)
+
+    def cancel(self, job_name: str) -> None:
+        raise NotImplementedError
+
+    @staticmethod
+    def get_prediction(request: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        text = request["request"]["contents"][0]["parts"][0]["text"]
+        prediction = {"id": request["id"], "request": request["request"], "status": ""}
+        if request["id"] == "error":
+            prediction["status"] = "Some request error"
+        elif request["id"] == "blocked_prompt":
+            prediction["response"] = {"promptFeedback": {"blockReason": "SAFETY"}}
+        else:
+            prediction["response"] = {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"text": json.dumps({"summary": text[:16]})}]},
+                    "safetyRatings": [{"category": "HARM_CATEGORY_HARASSMENT", "blocked": request["id"] == "blocked"}]
+                }],
+                "usageMetadata": {"promptTokenCount": 12, "candidatesTokenCount": 3}
+            }
+        return prediction
+
+
+class TestGeminiBatchPrediction:
+
+    def test_predictions_are_streamed_back_as_response_data(self, models, tmp_path):
+        # GIVEN
+        ids = ["ok", "error", "blocked_prompt", "blocked", "missing"]
+        input_data = [InputData(input_mappings={"text": f"Some text {example_id}"}, id=example_id) for example_id in ids]
+        job_client = FakeBatchPredictionJobClient()
+
+        # WHEN
+        responses = models["vertex_gemini"].generate_batch_prediction(
+            "Summarize {text}",
+            staging_uri=str(tmp_path / "staging"),
+            input_data=iter(input_data),
+            output_data_model_class=SummaryOutputClass,
+            system_prompt="Some system prompt",
+            job_client=job_client,
+            poll_interval_s=0
+        )
+        responses_by_id = {response.input_data.id: response for response in responses}
+
+        # THEN
+        assert [request["id"] for request in job_client.requests] == ids
+        request = job_client.requests[0]["request"]
+        assert request["systemInstruction"] == {"parts": [{"text": "Some system prompt"}]}
+        assert request["contents"][0]["parts"][0]["text"].startswith("Summarize Some text ok")
+        assert request["generationConfig"]["maxOutputTokens"] == 2048
+
+        assert set(responses_by_id) == set(ids)
+        assert responses_by_id["ok"].response == SummaryOutputClass(summary="Summarize Some t")
+        assert (responses_by_id["ok"].number_of_prompt_tokens, responses_by_id["ok"].number_of_generated_tokens) == (12, 3)
+        assert "Some request error" in responses_by_id["error"].error
+        assert responses_by_id["blocked_prompt"].error == (
+            f"GCPInvalidRequestError: {VertexModelConstants.EMPTY_RESPONSE_ERROR_MESSAGE}"
+        )
+        assert responses_by_id["blocked"].response is None
+        assert "OutputParserException" in responses_by_id["blocked"].error
+        assert "No result was returned" in responses_by_id["missing"].error
+
+    def test_blocked_response_gets_placeholder_without_output_data_model_class(self, models, tmp_path):
+        # GIVEN
+        job_client = FakeBatchPredictionJobClient()
+
+        # WHEN
+        responses = list(models["vertex_gemini"].generate_batch_prediction(
+            "Summarize {text}",
+            staging_uri=str(tmp_path),
+            input_data=[InputData(input_mappings={"text": "Some text"}, id="blocked")],
+            job_client=job_client,
+            poll_interval_s=0
+        ))
+
+        # THEN
+        assert [response.response for response in responses] == [VertexModelConstants.RESPONSE_BLOCKED_STR]
+
+    def test_all_examples_get_error_if_job_fails(self, models, tmp_path):
+        # GIVEN
+        input_data = [InputData(input_mappings={"text": f"Some text {idx}"}, id=str(idx)) for idx in range(3)]
+
+        # WHEN
+        responses = list(models["vertex_gemini"].generate_batch_prediction(
+            "Summarize {text}",
+            staging_uri=str(tmp_path),
+            input_data=input_data,
+            job_client=FakeBatchPredictionJobClient(fail_job=True),
+            poll_interval_s=0
+        ))
+
+        # THEN
+        assert [response.input_data.id for response in responses] == ["0", "1", "2"]
+        assert all("Quota exceeded" in response.error for response in responses)
+
+    def test_job_is_submitted_before_responses_are_iterated(self, models, tmp_path):
+        # GIVEN
+        input_data = [InputData(input_mappings={"text": "Some text"}, id="ok")]
+        job_client = FakeBatchPredictionJobClient()
+
+        # WHEN
+        responses = models["vertex_gemini"].generate_batch_prediction(
+            "Summarize {text}",
+            staging_uri=str(tmp_path),
+            input_data=input_data,
+            job_client=job_client,
+            poll_interval_s=0
+        )
+
+        # THEN
+        assert [request["id"] for request in job_client.requests] == ["ok"]
+        assert job_client.number_of_status_checks == 0
+        assert [response.input_data.id for response in responses] == ["ok"]
+        assert job_client.number_of_status_checks == 2
+
+    def test_ids_of_input_data_have_to_be_unique(self, models, tmp_path):
+        # GIVEN
+        input_data = [InputData(input_mappings={"text": "Some text"}, id="1")] * 2
+
+        # WHEN & THEN
+        with pytest.raises(ValueError):
+            models["vertex_gemini"].generate_batch_prediction(
+                "Summarize {text}",
+                staging_uri=str(tmp_path),
+                input_data=input_data,
+                job_client=FakeBatchPredictionJobClient()
+            )
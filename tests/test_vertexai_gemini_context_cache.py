@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+import typing
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from allms.domain.configuration import VertexAIConfiguration
+from allms.domain.input_data import InputData
+from allms.models import VertexAIGeminiModel
+from allms.utils.context_cache_utils import ContextCache, ContextCacheClient
+
+SYSTEM_PROMPT = "Some long reference document"
+
+
+class FakeContextCacheClient(ContextCacheClient):
+    def __init__(self, fail_creation: bool = False, creation_time_s: float = 0.0) -> None:
+        self.fail_creation = fail_creation
+        self.creation_time_s = creation_time_s
+        self.created: typing.List[typing.Tuple[str, str]] = []
+        self.creating_threads: typing.List[threading.Thread] = []
+        self.renewed: typing.List[str] = []
+        self.deleted: typing.List[str] = []
+
+    def create(self, model_name: str, system_instruction: str, ttl_s: float, display_name: str) -> str:
+        self.creating_threads.append(threading.current_thread())
+        time.sleep(self.creation_time_s)
+        if self.fail_creation:
+            raise ValueError("The cached content is too small")
+        self.created.append((model_name, system_instruction))
+        return f"cache-{len(self.created)}"
+
+    def update_ttl(self, cache_name: str, ttl_s: float) -> None:
+        self.renewed.append(cache_name)
+
+    def delete(self, cache_name: str) -> None:
+        self.deleted.append(cache_name)
+
+
+def get_chat_result(*args, **kwargs) -> ChatResult:
+    usage_metadata = {"prompt_token_count": 110, "cached_content_token_count": 100 if "cached_content" in kwargs else 0}
+    return ChatResult(generations=[ChatGeneration(
+        message=AIMessage(content="Some model output"),
+        generation_info={"is_blocked": False, "usage_metadata": usage_metadata}
+    )])
+
+
+def get_model(context_cache: ContextCache) -> VertexAIGeminiModel:
+    return VertexAIGeminiModel(
+        config=VertexAIConfiguration(cloud_project="dummy-project-id", cloud_location="us-central1"),
+        context_cache=context_cache,
+        event_loop=asyncio.new_event_loop()
+    )
+
+
+def get_input_data() -> typing.List[InputData]:
+    return [InputData(input_mappings={"text": f"Some text {idx}"}, id=str(idx)) for idx in range(3)]
+
+
+class TestGeminiContextCache:
+
+    @patch("langchain_google_vertexai.chat_models.ChatVertexAI._agenerate")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_requests_reference_cached_system_prompt(self, tokens_mock, agenerate_mock):
+        # GIVEN
+        tokens_mock.return_value = 1
+        agenerate_mock.side_effect = get_chat_result
+        client = FakeContextCacheClient()
+        context_cache = ContextCache(client)
+        model = get_model(context_cache)
+
+        # WHEN
+        responses = model.generate("Summarize {text}", get_input_data(), system_prompt=SYSTEM_PROMPT)
+        model.generate("Summarize {text}", get_input_data(), system_prompt=SYSTEM_PROMPT)
+
+        # THEN
+        assert [response.response for response in responses] == ["Some model output"] * 3
+        assert client.created == [(model._config.gemini_model_name, SYSTEM_PROMPT)]
+        assert agenerate_mock.call_count == 6
+        for call in agenerate_mock.call_args_list:
+            assert call.kwargs["cached_content"] == "cache-1"
+            assert call.args[0][0].content.startswith("Human: Summarize Some text")
+        assert context_cache.stats.number_of_requests == 6
+        assert context_cache.stats.number_of_cached_tokens == 600
+        assert context_cache.stats.cached_tokens_ratio == 100 / 110
+
+    @patch("langchain_google_vertexai.chat_models.ChatVertexAI._agenerate")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_system_prompt_is_sent_inline_if_cached_content_cannot_be_created(
+            self, tokens_mock, agenerate_mock
+    ):
+        # GIVEN
+        tokens_mock.return_value = 1
+        agenerate_mock.side_effect = get_chat_result
+        client = FakeContextCacheClient(fail_creation=True)
+        model = get_model(ContextCache(client))
+
+        # WHEN
+        responses = model.generate("Summarize {text}", get_input_data(), system_prompt=SYSTEM_PROMPT)
+
+        # THEN
+        assert [response.error for response in responses] == [None] * 3
+        for call in agenerate_mock.call_args_list:
+            assert "cached_content" not in call.kwargs
+            assert call.args[0][0].content.startswith(f"System: {SYSTEM_PROMPT}\nHuman: Summarize Some text")
+
+    @patch("langchain_google_vertexai.chat_models.ChatVertexAI._agenerate")
+    @patch("langchain_google_vertexai.llms.VertexAI.get_num_tokens")
+    def test_prompts_without_system_prompt_are_not_cached(self, tokens_mock, agenerate_mock):
+        # GIVEN
+        tokens_mock.return_value = 1
+        agenerate_mock.side_effect = get_chat_result
+        client = FakeContextCacheClient()
+        model = get_model(ContextCache(client))
+
+        # WHEN
+        model.generate("Summarize {text}", get_input_data())
+
+        # THEN
+        assert client.created == []
+        assert all("cached_content" not in call.kwargs for call in agenerate_mock.call_args_list)
+
+
+class TestContextCache:
+
+    @patch("allms.utils.context_cache_utils.time.monotonic")
+    def test_ttl_is_renewed_before_cached_content_expires(self, monotonic_mock):
+        # GIVEN
+        client = FakeContextCacheClient()
+        context_cache = ContextCache(client, ttl_s=100, renewal_margin_s=10)
+
+        # WHEN
+        cache_names = []
+        for now in (0, 50, 95, 150, 300):
+            monotonic_mock.return_value = now
+            cache_names.append(context_cache.get_cache_name("gemini", SYSTEM_PROMPT))
+
+        # THEN
+        assert cache_names == ["cache-1", "cache-1", "cache-1", "cache-1", "cache-2"]
+        assert client.renewed == ["cache-1"]
+        assert len(client.created) == 2
+
+    @patch("allms.utils.context_cache_utils.time.monotonic")
+    def test_live_cached_contents_are_deleted(self, monotonic_mock):
+        # GIVEN
+        monotonic_mock.return_value = 0
+        client = FakeContextCacheClient()
+        context_cache = ContextCache(client, ttl_s=100, renewal_margin_s=10)
+        context_cache.get_cache_name("gemini", "First system prompt")
+        context_cache.get_cache_name("gemini", "Second system prompt")
+
+        # WHEN
+        context_cache.delete_all()
+
+        # THEN
+        assert client.deleted == ["cache-1", "cache-2"]
+
+    def test_cached_content_is_created_once_without_blocking_event_loop(self):
+        # GIVEN
+        client = FakeContextCacheClient(creation_time_s=0.1)
+        context_cache = ContextCache(client)
+        number_of_ticks = 0
+
+        async def tick():
+            nonlocal number_of_ticks
+            while not client.created:
+                number_of_ticks += 1
+                await asyncio.sleep(0.01)
+
+        async def get_cache_names():
+            cache_names, _ = await asyncio.gather(
+                asyncio.gather(*[context_cache.aget_cache_name("gemini", SYSTEM_PROMPT) for _ in range(5)]),
+                tick()
+            )
+            return cache_names
+
+        # WHEN
+        cache_names = asyncio.run(get_cache_names())
+
+        # THEN
+        assert cache_names == ["cache-1"] * 5
+        assert len(client.created) == 1
+        assert client.creating_threads[0] is not threading.main_thread()
+        assert number_of_ticks > 1